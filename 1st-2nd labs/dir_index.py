@@ -0,0 +1,92 @@
+import os
+from bisect import bisect_left
+
+from PyQt6.QtCore import (QObject, QFileSystemWatcher, QTimer, pyqtSignal)
+
+
+class DirectoryIndex(QObject):
+    changed = pyqtSignal()
+
+    def __init__(self, extensions=('.png', '.bmp', '.jpg', '.ppm', '.npy'), parent=None):
+        super(DirectoryIndex, self).__init__(parent)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.directory = None
+
+        self.__names = []
+        self.__positions = dict()
+
+        self.__watcher = QFileSystemWatcher(self)
+        self.__watcher.directoryChanged.connect(self.__schedule_refresh)
+        # editors and copy tools touch a folder many times in a row
+        self.__refresh_timer = QTimer(self)
+        self.__refresh_timer.setSingleShot(True)
+        self.__refresh_timer.setInterval(200)
+        self.__refresh_timer.timeout.connect(self.__refresh)
+
+    def __len__(self):
+        return len(self.__names)
+
+    def open(self, directory: str):
+        directory = os.path.abspath(directory)
+        if directory == self.directory:
+            return
+        if self.directory is not None:
+            self.__watcher.removePath(self.directory)
+        self.directory = directory
+        self.__names = sorted(self.__scan())
+        self.__reindex(0)
+        self.__watcher.addPath(directory)
+        self.changed.emit()
+
+    def index_of(self, name: str):
+        try:
+            return self.__positions[name]
+        except KeyError:
+            raise ValueError(f'{name} is not in {self.directory}') from None
+
+    def name(self, idx: int):
+        return self.__names[idx]
+
+    def path(self, idx: int):
+        return os.path.join(self.directory, self.__names[idx])
+
+    def paths(self, lo: int, hi: int):
+        return [os.path.join(self.directory, name) for name in self.__names[lo:hi]]
+
+    def __scan(self):
+        with os.scandir(self.directory) as entries:
+            return [entry.name for entry in entries
+                    if entry.name.lower().endswith(self.extensions) and entry.is_file()]
+
+    def __reindex(self, start: int):
+        if start == 0:
+            self.__positions = {name: i for i, name in enumerate(self.__names)}
+            return
+        for i in range(start, len(self.__names)):
+            self.__positions[self.__names[i]] = i
+
+    def __schedule_refresh(self, _path: str):
+        self.__refresh_timer.start()
+
+    def __refresh(self):
+        if self.directory is None:
+            return
+        try:
+            current = set(self.__scan())
+        except FileNotFoundError:
+            current = set()
+        removed = self.__positions.keys() - current
+        added = current - self.__positions.keys()
+        if not removed and not added:
+            return
+
+        first = len(self.__names)
+        if removed:
+            first = min(self.__positions.pop(name) for name in removed)
+            self.__names = [name for name in self.__names if name not in removed]
+        for name in added:
+            idx = bisect_left(self.__names, name)
+            self.__names.insert(idx, name)
+            first = min(first, idx)
+        self.__reindex(first)
+        self.changed.emit()
@@ -0,0 +1,80 @@
+import cv2 as cv
+import numpy as np
+
+
+def affine(image_arr):
+    pts1 = np.float32([[0, 0],
+                       [1, 0],
+                       [0, 1]])
+
+    pts2 = np.float32([[0, 0],
+                       [1, 0],
+                       [1, 1]])
+
+    warp_mat = cv.getAffineTransform(pts1, pts2)
+
+    return cv.warpAffine(
+        image_arr, warp_mat, (image_arr.shape[1], image_arr.shape[0]), cv.INTER_CUBIC, cv.BORDER_CONSTANT)
+
+
+def rotate(image_arr, angle=45, scale=1.0):
+    h, w = image_arr.shape[:2]
+    cX, cY = w // 2, h // 2
+
+    M = cv.getRotationMatrix2D((cX, cY), angle, scale)
+    return cv.warpAffine(image_arr, M, (w, h))
+
+
+def cartoon(image_arr, diameter=12, sigma=250):
+    gray = cv.cvtColor(image_arr, cv.COLOR_BGR2GRAY)
+    gray = cv.medianBlur(gray, 7)
+    edges = cv.adaptiveThreshold(
+        gray, 255, cv.ADAPTIVE_THRESH_MEAN_C, cv.THRESH_BINARY, 9, 10)
+
+    color = cv.bilateralFilter(image_arr, diameter, sigma, sigma)
+    return cv.bitwise_and(color, color, mask=edges)
+
+
+def erode(image_arr, ksize=5, iterations=1):
+    kernel = np.ones((ksize, ksize), np.uint8)
+    return cv.erode(image_arr, kernel, iterations=iterations)
+
+
+def sharpen(image_arr):
+    kernel = np.array([[-1, -1, -1],
+                       [-1, 9, -1],
+                       [-1, -1, -1]])
+    return cv.filter2D(image_arr, -1, kernel)
+
+
+def median(image_arr, k=3):
+    # the hand-written median with a zero border; cv.medianBlur replicates the border
+    # instead, so the two differ along the edges
+    size = k // 2
+    padded = np.pad(image_arr.astype(np.float32),
+                    [(size, size), (size, size)] + [(0, 0)] * (image_arr.ndim - 2))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (k, k), axis=(0, 1))
+    return np.median(windows, axis=(-2, -1)).astype(np.uint8)
+
+
+OPERATIONS = {
+    'affine': affine,
+    'rotate': rotate,
+    'cartoon': cartoon,
+    'erode': erode,
+    'sharpen': sharpen,
+}
+
+# size parameters that have to shrink with the image for a faithful preview
+SPATIAL_PARAMS = {
+    'cartoon': ('diameter',),
+    'erode': ('ksize',),
+}
+
+
+def scale_params(name, params, scale):
+    scaled = dict(params)
+    for key in SPATIAL_PARAMS.get(name, ()):
+        if key in scaled:
+            scaled[key] = max(1, int(round(scaled[key] * scale)))
+    return scaled
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+from enum import Enum, auto
+
+import numpy as np
+
+
+class EditHistory:
+    class StepKind(Enum):
+        OPERATION = auto()
+        DELTA = auto()
+
+    def __init__(self, source: np.ndarray, operations: dict, memory_budget=256 * 1024 * 1024):
+        # the source is stored once; every other state is rebuilt from it
+        self.__source = self.__freeze(source)
+        self.__operations = operations
+        self.memory_budget = memory_budget
+
+        self.__steps = []
+        self.__position = 0
+
+        self.__cache = OrderedDict()
+        self.__cache_bytes = 0
+        self.__spill_dir = None
+        self.__spilled = dict()
+
+    @property
+    def position(self):
+        return self.__position
+
+    @property
+    def can_undo(self):
+        return self.__position > 0
+
+    @property
+    def can_redo(self):
+        return self.__position < len(self.__steps)
+
+    def current(self):
+        return self.__materialize(self.__position)
+
+    def push_operation(self, name: str, result=None, **params):
+        if name not in self.__operations:
+            raise KeyError(f'Unknown operation: {name}')
+        self.__truncate()
+        self.__steps.append((self.StepKind.OPERATION, name, params))
+        self.__position += 1
+        if result is None:
+            # rendered somewhere else, fill() stores it when it is done
+            return None
+        result = self.__freeze(result)
+        self.__store(self.__position, result)
+        return result
+
+    def fill(self, index: int, result: np.ndarray):
+        # result of a step pushed without one, rendered somewhere else
+        if 0 < index <= len(self.__steps) and index not in self.__cache \
+                and index not in self.__spilled:
+            self.__store(index, self.__freeze(result))
+
+    def push_delta(self, result: np.ndarray):
+        prev = self.current()
+        self.__truncate()
+        result = self.__freeze(result)
+        if prev.shape == result.shape and prev.dtype == result.dtype:
+            payload = zlib.compress(np.bitwise_xor(prev, result).tobytes(), 1)
+            xor = True
+        else:
+            payload = zlib.compress(result.tobytes(), 1)
+            xor = False
+        self.__steps.append(
+            (self.StepKind.DELTA, (result.shape, result.dtype, xor), payload))
+        self.__position += 1
+        self.__store(self.__position, result)
+        return result
+
+    def undo(self):
+        if self.can_undo:
+            self.__position -= 1
+        return self.current()
+
+    def redo(self):
+        if self.can_redo:
+            self.__position += 1
+        return self.current()
+
+    def close(self):
+        self.__cache.clear()
+        self.__cache_bytes = 0
+        self.__spilled.clear()
+        if self.__spill_dir is not None:
+            self.__spill_dir.cleanup()
+            self.__spill_dir = None
+
+    def __materialize(self, index: int):
+        if index == 0:
+            return self.__source
+        if index in self.__cache:
+            self.__cache.move_to_end(index)
+            return self.__cache[index]
+        if index in self.__spilled:
+            state = self.__freeze(np.load(self.__spilled[index]))
+            self.__store(index, state)
+            return state
+
+        # replay forward from the nearest state we still have
+        start = index - 1
+        while start > 0 and start not in self.__cache and start not in self.__spilled:
+            start -= 1
+        state = self.__materialize(start)
+        for i in range(start + 1, index + 1):
+            state = self.__freeze(self.__apply(self.__steps[i - 1], state))
+        self.__store(index, state)
+        return state
+
+    def __apply(self, step, state: np.ndarray):
+        kind, header, payload = step
+        if kind == self.StepKind.OPERATION:
+            return self.__operations[header](state, **payload)
+
+        shape, dtype, xor = header
+        data = np.frombuffer(zlib.decompress(payload), dtype=dtype).reshape(shape)
+        if xor:
+            return np.bitwise_xor(state, data)
+        return data.copy()
+
+    def __store(self, index: int, state: np.ndarray):
+        if index in self.__cache:
+            self.__cache_bytes -= self.__cache.pop(index).nbytes
+        self.__cache[index] = state
+        self.__cache_bytes += state.nbytes
+
+        while self.__cache_bytes > self.memory_budget and len(self.__cache) > 1:
+            old_index, old_state = self.__cache.popitem(last=False)
+            self.__cache_bytes -= old_state.nbytes
+            self.__spill(old_index, old_state)
+
+    def __spill(self, index: int, state: np.ndarray):
+        if index in self.__spilled:
+            return
+        if self.__spill_dir is None:
+            self.__spill_dir = tempfile.TemporaryDirectory(prefix='edit_history_')
+        path = os.path.join(self.__spill_dir.name, f'{index}.npy')
+        np.save(path, state)
+        self.__spilled[index] = path
+
+    def __truncate(self):
+        # a new step drops the redo branch
+        del self.__steps[self.__position:]
+        for index in [i for i in self.__cache if i > self.__position]:
+            self.__cache_bytes -= self.__cache.pop(index).nbytes
+        for index in [i for i in self.__spilled if i > self.__position]:
+            os.remove(self.__spilled.pop(index))
+
+    @staticmethod
+    def __freeze(state: np.ndarray):
+        state = np.ascontiguousarray(state)
+        state.flags.writeable = False
+        return state
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+
+from PyQt6.QtCore import (QObject, QRunnable, QThreadPool, pyqtSignal)
+from PyQt6.QtGui import QImage
+
+from image_loader import load_qimage
+
+
+class DecodeSignals(QObject):
+    decoded = pyqtSignal(int, str, QImage)
+
+
+class DecodeTask(QRunnable):
+    def __init__(self, generation: int, path: str, is_stale):
+        super(DecodeTask, self).__init__()
+        self.generation = generation
+        self.path = path
+        self.is_stale = is_stale
+        self.signals = DecodeSignals()
+
+    def run(self):
+        if self.is_stale(self.generation, self.path):
+            return
+        image = load_qimage(self.path)
+        if not image.isNull():
+            self.signals.decoded.emit(self.generation, self.path, image)
+
+
+class ImageCache(QObject):
+    image_ready = pyqtSignal(str)
+
+    def __init__(self, byte_budget=512 * 1024 * 1024, radius=3, parent=None):
+        super(ImageCache, self).__init__(parent)
+        self.byte_budget = byte_budget
+        self.radius = radius
+
+        self.__pool = QThreadPool(self)
+        self.__pool.setMaxThreadCount(
+            max(1, min(4, QThreadPool.globalInstance().maxThreadCount() - 1)))
+
+        self.__images = OrderedDict()
+        self.__bytes = 0
+        self.__generation = 0
+        self.__wanted = set()
+        self.__pending = set()
+
+    def get(self, path: str):
+        image = self.__images.get(path)
+        if image is not None:
+            self.__images.move_to_end(path)
+        return image
+
+    def load(self, path: str):
+        image = self.get(path)
+        if image is None:
+            image = load_qimage(path)
+            if not image.isNull():
+                self.__insert(path, image)
+        return image
+
+    def prefetch(self, paths: list, index: int):
+        # everything queued for the previous position is stale now
+        self.__generation += 1
+        self.__pool.clear()
+        self.__pending.clear()
+
+        lo = max(0, index - self.radius)
+        hi = min(len(paths), index + self.radius + 1)
+        self.__wanted = set(paths[lo:hi])
+
+        for distance in range(1, self.radius + 1):
+            for i in (index + distance, index - distance):
+                if lo <= i < hi:
+                    self.__request(paths[i], self.radius - distance)
+
+    def clear(self):
+        self.__generation += 1
+        self.__pool.clear()
+        self.__pending.clear()
+        self.__wanted.clear()
+        self.__images.clear()
+        self.__bytes = 0
+
+    def __request(self, path: str, priority: int):
+        if path in self.__images or path in self.__pending:
+            return
+        self.__pending.add(path)
+        task = DecodeTask(self.__generation, path, self.__is_stale)
+        task.signals.decoded.connect(self.__on_decoded)
+        self.__pool.start(task, priority)
+
+    def __is_stale(self, generation: int, path: str):
+        return generation != self.__generation and path not in self.__wanted
+
+    def __on_decoded(self, generation: int, path: str, image: QImage):
+        self.__pending.discard(path)
+        if self.__is_stale(generation, path) or path in self.__images:
+            return
+        self.__insert(path, image)
+        self.image_ready.emit(path)
+
+    def __insert(self, path: str, image: QImage):
+        self.__images[path] = image
+        self.__bytes += image.sizeInBytes()
+        while self.__bytes > self.byte_budget and len(self.__images) > 1:
+            _, old = self.__images.popitem(last=False)
+            self.__bytes -= old.sizeInBytes()
@@ -0,0 +1,190 @@
+import os
+import struct
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+from PyQt6.QtCore import QSize
+from PyQt6.QtGui import (QImage, QImageReader)
+
+ImageInfo = namedtuple('ImageInfo', ['width', 'height', 'channels', 'format', 'file_size'])
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+REDUCED_JPEG_FLAGS = [(8, cv.IMREAD_REDUCED_COLOR_8),
+                      (4, cv.IMREAD_REDUCED_COLOR_4),
+                      (2, cv.IMREAD_REDUCED_COLOR_2)]
+
+
+def read_info(path: str):
+    # raises OSError for unreadable files and ValueError for broken headers
+    try:
+        return _read_info(path)
+    except struct.error:
+        raise ValueError(f'Truncated header in {path}')
+
+
+def _read_info(path: str):
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            width, height = struct.unpack('>II', head[16:24])
+            return ImageInfo(width, height, PNG_CHANNELS.get(head[25], 3), 'png', file_size)
+        if head.startswith(b'BM'):
+            width, height, _, bpp = struct.unpack('<iiHH', head[18:30])
+            return ImageInfo(width, abs(height), max(1, bpp // 8), 'bmp', file_size)
+        if head.startswith(b'\xff\xd8'):
+            return _read_jpeg_info(f, file_size)
+        if head[:2] in (b'P5', b'P6'):
+            width, height, _, _ = _read_ppm_header(path)
+            return ImageInfo(width, height, 3 if head[:2] == b'P6' else 1, 'ppm', file_size)
+        if head.startswith(b'\x93NUMPY'):
+            shape = np.load(path, mmap_mode='r').shape
+            if len(shape) not in (2, 3):
+                raise ValueError(f'{path} is not an image array')
+            return ImageInfo(shape[1], shape[0], shape[2] if len(shape) > 2 else 1, 'npy', file_size)
+
+    # anything else still gets a header-only answer from Qt
+    size = QImageReader(path).size()
+    return ImageInfo(size.width(), size.height(), 3, 'other', file_size)
+
+
+def _read_jpeg_info(f, file_size):
+    # walk the segment list instead of decoding, EXIF blocks are skipped by length
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, height, width, channels = struct.unpack('>BHHB', f.read(6))
+            return ImageInfo(width, height, channels, 'jpg', file_size)
+        f.seek(length - 2, os.SEEK_CUR)
+    raise ValueError('Broken JPEG header')
+
+
+def _read_ppm_header(path):
+    with open(path, 'rb') as f:
+        data = f.read(1024)
+    tokens = []
+    pos = 2
+    while len(tokens) < 3:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.index(b'\n', pos) + 1
+            continue
+        start = pos
+        while not data[pos:pos + 1].isspace():
+            pos += 1
+        tokens.append(int(data[start:pos]))
+    # exactly one whitespace byte separates maxval from the raster
+    return tokens[0], tokens[1], tokens[2], pos + 1
+
+
+def map_image(path: str):
+    # zero-copy views for uncompressed files; returns (array, channel order) or None
+    with open(path, 'rb') as f:
+        head = f.read(54)
+
+    if head.startswith(b'\x93NUMPY'):
+        return np.load(path, mmap_mode='r'), 'RGB'
+
+    if head[:2] in (b'P5', b'P6'):
+        width, height, maxval, offset = _read_ppm_header(path)
+        channels = 3 if head[:2] == b'P6' else 1
+        dtype = np.uint8 if maxval < 256 else np.dtype('>u2')
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape), 'RGB'
+
+    if head.startswith(b'BM'):
+        offset = struct.unpack('<I', head[10:14])[0]
+        width, height, _, bpp, compression = struct.unpack('<iiHHI', head[18:34])
+        if bpp not in (24, 32) or compression not in (0, 3):
+            return None
+        channels = bpp // 8
+        stride = (width * bpp + 31) // 32 * 4
+        rows = np.memmap(path, dtype=np.uint8, mode='r', offset=offset,
+                         shape=(abs(height), stride))
+        view = rows[:, :width * channels].reshape(abs(height), width, channels)
+        # positive height means the rows are stored bottom-up
+        return (view[::-1] if height > 0 else view), 'BGR'
+
+    return None
+
+
+def load_array(path: str, max_side=None):
+    mapped = map_image(path)
+    if mapped is not None:
+        view, order = mapped
+        if view.ndim not in (2, 3):
+            raise ValueError(f'{path} is not an image array')
+        if np.issubdtype(view.dtype, np.integer) and view.dtype != np.uint8:
+            view = (view >> 8).astype(np.uint8)
+        elif np.issubdtype(view.dtype, np.floating):
+            # float images are either 0..1 or already 0..255
+            view = np.asarray(view, np.float32)
+            scale = 255 if view.max(initial=0) <= 1 else 1
+            view = np.clip(view * scale, 0, 255).astype(np.uint8)
+        elif view.dtype != np.uint8:
+            raise ValueError(f'Unsupported array type {view.dtype} in {path}')
+        if view.ndim == 2:
+            view = cv.cvtColor(np.ascontiguousarray(view), cv.COLOR_GRAY2RGB)
+        image_arr = view[..., :3]
+        if order == 'BGR':
+            image_arr = image_arr[..., ::-1]
+        if max_side is not None:
+            image_arr = _downscale(np.ascontiguousarray(image_arr), max_side)
+        return np.ascontiguousarray(image_arr)
+
+    flags = cv.IMREAD_COLOR
+    if max_side is not None:
+        info = read_info(path)
+        if info.format == 'jpg':
+            # the JPEG decoder can skip DCT coefficients instead of resizing afterwards
+            for factor, reduced_flag in REDUCED_JPEG_FLAGS:
+                if max(info.width, info.height) // factor >= max_side:
+                    flags = reduced_flag
+                    break
+    image_arr = cv.imdecode(np.fromfile(path, dtype=np.uint8), flags)
+    if image_arr is None:
+        raise ValueError(f'Cannot decode {path}')
+    image_arr = cv.cvtColor(image_arr, cv.COLOR_BGR2RGB)
+    if max_side is not None:
+        image_arr = _downscale(image_arr, max_side)
+    return image_arr
+
+
+def load_qimage(path: str, max_side=None):
+    if path.lower().endswith('.npy'):
+        try:
+            image_arr = load_array(path, max_side)
+        except (OSError, ValueError):
+            # null image, like QImageReader gives for a file it cannot read
+            return QImage()
+        height, width, _ = image_arr.shape
+        return QImage(image_arr.data, width, height, 3 * width,
+                      QImage.Format.Format_RGB888).copy()
+
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    if max_side is not None:
+        size = reader.size()
+        scale = max_side / max(size.width(), size.height(), 1)
+        if scale < 1:
+            reader.setScaledSize(QSize(max(1, int(size.width() * scale)),
+                                       max(1, int(size.height() * scale))))
+    return reader.read()
+
+
+def _downscale(image_arr, max_side):
+    scale = max_side / max(image_arr.shape[:2])
+    if scale >= 1:
+        return image_arr
+    return cv.resize(image_arr, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
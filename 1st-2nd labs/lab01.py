@@ -1,11 +1,18 @@
 import sys
 
-from PyQt6.QtCore import (QSize, Qt, QFile, QRectF, QRegularExpression, QFileInfo, QDir)
+from PyQt6.QtCore import (QSize, Qt, QRectF, QRegularExpression, QFileInfo)
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QGraphicsScene, QGraphicsView, QLabel, QFileDialog, QMessageBox)
 from PyQt6.QtGui import QAction, QPixmap
 
+from image_cache import ImageCache
+from dir_index import DirectoryIndex
+from tiled_item import TiledImageItem
+from image_loader import read_info
+
 
 class MainWindow(QMainWindow):
+    TILED_MIN_PIXELS = 40_000_000
+
     def __init__(self):
         super().__init__()
 
@@ -28,6 +35,9 @@ class MainWindow(QMainWindow):
         self.main_status_bar.addPermanentWidget(self.main_status_label)
         self.main_status_label.setText('Image Information will be here!')
 
+        self.image_cache = ImageCache(parent=self)
+        self.dir_index = DirectoryIndex(parent=self)
+
         self.__create_actions()
 
     def __create_actions(self):
@@ -61,21 +71,40 @@ class MainWindow(QMainWindow):
         self.dialog = QFileDialog(self)
         self.dialog.setWindowTitle('Open Image')
         self.dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
-        self.dialog.setNameFilter(self.tr('Images (*.png *.bmp *.jpg)'))
+        self.dialog.setNameFilter(self.tr('Images (*.png *.bmp *.jpg *.ppm *.npy)'))
         file_paths = []
         if self.dialog.exec():
             file_paths = self.dialog.selectedFiles()
             self.__show_image(file_paths[0])
+            self.__prefetch_neighbours(self.__current_index())
 
     # Не работает :\
     def __show_image(self, path):
         self.image_scene.clear()
         self.image_view.resetTransform()
-        self.image = QPixmap(path)
-        self.cur_img = self.image_scene.addPixmap(self.image)
+        try:
+            info = read_info(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, 'Warning', f'Cannot open {path}: {e}')
+            return
+        size = QSize(info.width, info.height)
+        # only formats that can be read one tile at a time go to the tiled item
+        if info.width * info.height >= self.TILED_MIN_PIXELS and TiledImageItem.can_tile(path):
+            # huge scans are never decoded whole, only the visible tiles are
+            self.image = None
+            self.cur_img = TiledImageItem(path, size)
+            self.image_scene.addItem(self.cur_img)
+            self.image_view.setSceneRect(self.cur_img.boundingRect())
+            self.image_view.fitInView(
+                self.cur_img, Qt.AspectRatioMode.KeepAspectRatio)
+        else:
+            self.image = QPixmap.fromImage(self.image_cache.load(path))
+            if self.image.isNull():
+                QMessageBox.warning(self, 'Warning', f'Cannot decode {path}')
+            self.cur_img = self.image_scene.addPixmap(self.image)
+            self.image_view.setSceneRect(QRectF(self.image.rect()))
         self.image_scene.update()
-        self.image_view.setSceneRect(QRectF(self.image.rect()))
-        status = f'{path}, {self.image.width()}x{self.image.height()}, {QFile(path).size()} Bytes'
+        status = f'{path}, {size.width()}x{size.height()}, {info.file_size} Bytes'
         self.main_status_label.setText(status)
         self.current_image_path = path
 
@@ -85,6 +114,10 @@ class MainWindow(QMainWindow):
         except Exception:
             QMessageBox.information(self, 'Information', 'Nothing to save')
             return
+        if isinstance(self.cur_img, TiledImageItem):
+            QMessageBox.information(
+                self, 'Information', 'Image is too large to be saved from the viewer.')
+            return
         self.dialog = QFileDialog(self)
         self.dialog.setWindowTitle('Save Image As...')
         self.dialog.setFileMode(QFileDialog.FileMode.AnyFile)
@@ -106,41 +139,38 @@ class MainWindow(QMainWindow):
         self.image_view.scale(1/1.2, 1/1.2)
 
     def __prev_image(self):
-        try:
-            self.cur = QFileInfo(self.current_image_path)
-        except Exception:
-            QMessageBox.information(self, 'Information', 'No image selected.')
-            return
-        self.dir = QDir(self.cur.absoluteDir())
-        self.name_filters = ['*.png', '*.bmp', '*.jpg']
-        self.file_names = self.dir.entryList(
-            self.name_filters, QDir.Filter.Files, QDir.SortFlag.Name)
-        idx = self.file_names.index(self.cur.fileName())
-        if idx > 0:
-            self.__show_image(self.dir.absoluteFilePath(
-                self.file_names[idx - 1]))
-        else:
-            QMessageBox.information(
-                self, 'Information', 'Current image is the last one.')
+        self.__step_image(-1)
 
     def __next_image(self):
+        self.__step_image(1)
+
+    def __step_image(self, step):
         try:
-            self.cur = QFileInfo(self.current_image_path)
+            idx = self.__current_index()
         except Exception:
             QMessageBox.information(self, 'Information', 'No image selected.')
             return
-        self.dir = QDir(self.cur.absoluteDir())
-        self.name_filters = ['*.png', '*.bmp', '*.jpg']
-        self.file_names = self.dir.entryList(
-            self.name_filters, QDir.Filter.Files, QDir.SortFlag.Name)
-        idx = self.file_names.index(self.cur.fileName())
-        if idx < len(self.file_names) - 1:
-            self.__show_image(self.dir.absoluteFilePath(
-                self.file_names[idx + 1]))
+        new_idx = idx + step
+        if 0 <= new_idx < len(self.dir_index):
+            self.__show_image(self.dir_index.path(new_idx))
+            self.__prefetch_neighbours(new_idx)
+        elif step < 0:
+            QMessageBox.information(
+                self, 'Information', 'Current image is the first one.')
         else:
             QMessageBox.information(
                 self, 'Information', 'Current image is the last one.')
 
+    def __current_index(self):
+        self.cur = QFileInfo(self.current_image_path)
+        self.dir_index.open(self.cur.absolutePath())
+        return self.dir_index.index_of(self.cur.fileName())
+
+    def __prefetch_neighbours(self, idx):
+        lo = max(0, idx - self.image_cache.radius)
+        hi = min(len(self.dir_index), idx + self.image_cache.radius + 1)
+        self.image_cache.prefetch(self.dir_index.paths(lo, hi), idx - lo)
+
     def __setup_shortcuts(self):
         shortcuts = [Qt.Key.Key_Plus, Qt.Key.Key_Equal]
         self.zoom_in_action.setShortcuts(shortcuts)
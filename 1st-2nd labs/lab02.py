@@ -1,17 +1,20 @@
 import sys
 import numpy as np
-import time
 import cv2 as cv
 
-from PIL import Image
-import io
-
-from PyQt6.QtCore import (QSize, Qt, QFile, QRectF, QRegularExpression, QFileInfo, QDir, QIODeviceBase, QBuffer)
+from PyQt6.QtCore import (QSize, Qt, QRectF, QRegularExpression, QFileInfo, QDir, QThreadPool)
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QGraphicsScene, QGraphicsView, QLabel, QFileDialog, QMessageBox)
-from PyQt6.QtGui import (QAction, QPixmap, QImage)
+from PyQt6.QtGui import (QAction, QPixmap, QImage, QKeySequence)
+
+import filters
+from history import EditHistory
+from render import RenderWorker
+from image_loader import load_array, read_info
 
 
 class MainWindow(QMainWindow):
+    PREVIEW_MAX_PIXELS = 2_000_000
+
     def __init__(self):
         super().__init__()
 
@@ -20,10 +23,12 @@ class MainWindow(QMainWindow):
 
         menubar = self.menuBar()
         self.file_menu = menubar.addMenu('&File')
+        self.edit_menu = menubar.addMenu('&Edit')
         self.view_menu = menubar.addMenu('&View')
         self.filters_menu = menubar.addMenu('Filters')
 
         self.file_tool_bar = self.addToolBar('File')
+        self.edit_tool_bar = self.addToolBar('Edit')
         self.view_tool_bar = self.addToolBar('View')
         self.filters_tool_bar = self.addToolBar('Filters')
 
@@ -36,6 +41,13 @@ class MainWindow(QMainWindow):
         self.main_status_bar.addPermanentWidget(self.main_status_label)
         self.main_status_label.setText('Image Information will be here!')
 
+        self.render_pool = QThreadPool(self)
+        self.render_pool.setMaxThreadCount(1)
+        self.render_generation = 0
+        # last queued full-resolution render and the preview shown for it
+        self.pending_render = None
+        self.pending_preview = None
+
         self.__create_actions()
 
     def __create_actions(self):
@@ -46,12 +58,21 @@ class MainWindow(QMainWindow):
                         self.save_as_action, self.exit_action]
         self.file_menu.addActions(file_actions)
 
+        self.undo_action = QAction('&Undo', self)
+        self.redo_action = QAction('&Redo', self)
+        edit_actions = [self.undo_action, self.redo_action]
+        for action in edit_actions:
+            action.setEnabled(False)
+        self.edit_menu.addActions(edit_actions)
+
         self.zoom_in_action = QAction('Zoom In', self)
         self.zoom_out_action = QAction('Zoom Out', self)
         self.prev_action = QAction('&Previous Image', self)
         self.next_action = QAction('&Next Image', self)
+        self.preview_action = QAction('&Preview Mode', self)
+        self.preview_action.setCheckable(True)
         view_actions = [self.zoom_in_action, self.zoom_out_action,
-                        self.prev_action, self.next_action]
+                        self.prev_action, self.next_action, self.preview_action]
         self.view_menu.addActions(view_actions)
 
         self.median_filter = QAction('&Median Filter', self)
@@ -70,12 +91,15 @@ class MainWindow(QMainWindow):
         self.filters_menu.addActions(filters_actions)
 
         self.file_tool_bar.addAction(self.open_action)
+        self.edit_tool_bar.addActions(edit_actions)
         self.view_tool_bar.addActions(view_actions)
         self.filters_tool_bar.addActions(filters_actions)
 
         self.exit_action.triggered.connect(self.close)
         self.open_action.triggered.connect(self.__open_image)
         self.save_as_action.triggered.connect(self.__save_as)
+        self.undo_action.triggered.connect(self.__undo)
+        self.redo_action.triggered.connect(self.__redo)
         self.zoom_in_action.triggered.connect(self.__zoom_in)
         self.zoom_out_action.triggered.connect(self.__zoom_out)
         self.prev_action.triggered.connect(self.__prev_image)
@@ -93,7 +117,7 @@ class MainWindow(QMainWindow):
         self.dialog = QFileDialog(self)
         self.dialog.setWindowTitle('Open Image')
         self.dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
-        self.dialog.setNameFilter(self.tr('Images (*.png *.bmp *.jpg)'))
+        self.dialog.setNameFilter(self.tr('Images (*.png *.bmp *.jpg *.ppm *.npy)'))
         file_paths = []
         if self.dialog.exec():
             file_paths = self.dialog.selectedFiles()
@@ -101,20 +125,26 @@ class MainWindow(QMainWindow):
 
     # Не работает :\
     def __show_image(self, path):
-        self.image_scene.clear()
+        try:
+            # filters work on the array, so decode straight into it instead of via QPixmap
+            image_arr = load_array(path)
+            info = read_info(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, 'Warning', f'Cannot open {path}: {e}')
+            return
+        self.__cancel_render()
+        if getattr(self, 'history', None) is not None:
+            self.history.close()
+        self.history = EditHistory(image_arr, filters.OPERATIONS)
         self.image_view.resetTransform()
-        self.image = QPixmap(path)
-        self.cur_img = self.image_scene.addPixmap(self.image)
-        self.image_scene.update()
-        self.image_view.setSceneRect(QRectF(self.image.rect()))
-        status = f'{path}, {self.image.width()}x{self.image.height()}, {QFile(path).size()} Bytes'
+        self.__show_filtered_image(self.history.current())
+
+        status = f'{path}, {info.width}x{info.height}, {info.file_size} Bytes'
         self.main_status_label.setText(status)
         self.current_image_path = path
 
     def __save_as(self):
-        try:
-            self.cur_img
-        except Exception:
+        if getattr(self, 'history', None) is None:
             QMessageBox.information(self, 'Information', 'Nothing to save')
             return
         self.dialog = QFileDialog(self)
@@ -126,7 +156,11 @@ class MainWindow(QMainWindow):
         if self.dialog.exec():
             file_names = self.dialog.selectedFiles()
             if QRegularExpression('.+\\.(png|bmp|jpg)').match(file_names[0]):
-                self.cur_img.pixmap().save(file_names[0])
+                # the scene may still show a low resolution preview, save the real state
+                image_arr = self.history.current()
+                height, width, _ = image_arr.shape
+                QImage(image_arr.data, width, height, 3 * width,
+                       QImage.Format.Format_RGB888).save(file_names[0])
             else:
                 QMessageBox.information(
                     self, 'Information', 'Save Error: bad format or filename.')
@@ -144,7 +178,7 @@ class MainWindow(QMainWindow):
             QMessageBox.information(self, 'Information', 'No image selected.')
             return
         self.dir = QDir(self.cur.absoluteDir())
-        self.name_filters = ['*.png', '*.bmp', '*.jpg']
+        self.name_filters = ['*.png', '*.bmp', '*.jpg', '*.ppm', '*.npy']
         self.file_names = self.dir.entryList(
             self.name_filters, QDir.Filter.Files, QDir.SortFlag.Name)
         idx = self.file_names.index(self.cur.fileName())
@@ -162,7 +196,7 @@ class MainWindow(QMainWindow):
             QMessageBox.information(self, 'Information', 'No image selected.')
             return
         self.dir = QDir(self.cur.absoluteDir())
-        self.name_filters = ['*.png', '*.bmp', '*.jpg']
+        self.name_filters = ['*.png', '*.bmp', '*.jpg', '*.ppm', '*.npy']
         self.file_names = self.dir.entryList(
             self.name_filters, QDir.Filter.Files, QDir.SortFlag.Name)
         idx = self.file_names.index(self.cur.fileName())
@@ -173,128 +207,137 @@ class MainWindow(QMainWindow):
             QMessageBox.information(
                 self, 'Information', 'Current image is the last one.')
 
-    def __QImage2array(self, image):
-        image = image.pixmap().toImage().convertToFormat(QImage.Format.Format_RGB888)
-        buffer = QBuffer()
-        buffer.open(QIODeviceBase.OpenModeFlag.ReadWrite)
-        image.save(buffer, "PNG")
-        pil_im = Image.open(io.BytesIO(buffer.data()))
-        return np.array(pil_im)
-
-
     def __make_median(self):
         try:
-            image_arr = self.__QImage2array(self.cur_img)
+            image_arr = self.history.current()
         except Exception as e:
             print(e)
             return
 
-        w, h, c = image_arr.shape
-        k = 3
-        size = k // 2
-        _img = np.zeros((w + 2 * size, h + 2 * size, c), dtype=np.float32)
-        _img[size:size+w, size:size+h] = image_arr.copy().astype(np.float32)
-        dst = _img.copy()
-        start_time = time.time()
-
-        for x in np.arange(w):
-            for y in np.arange(h):
-                for z in np.arange(c):
-                    dst[x+size, y+size, z] = np.median(_img[x:x+k, y:y+k, z])
-
-        dst = dst[size:size+w, size:size+h].astype(np.uint8)
-
-        dst_2 = cv.medianBlur(image_arr, k)
-        diff = cv.absdiff(dst, dst_2)
-        print(diff.shape)
-        cv.imshow('color image', diff)
-        print("--- %s seconds ---" % (time.time() - start_time))
-        self.__show_filtered_image(dst)
+        dst = filters.median(image_arr)
+        self.__cancel_render()
+        # the hand-written median is too slow to replay, keep its result as a delta
+        self.__show_filtered_image(self.history.push_delta(dst))
 
     def __affine_plugin(self):
-        try:
-            image_arr = self.__QImage2array(self.cur_img)
-        except:
-            return
+        self.__apply_operation('affine')
 
-        pts1 = np.float32([[0, 0],
-                           [1, 0],
-                           [0, 1]])
+    def __rotate_plugin(self):
+        self.__apply_operation('rotate', angle=45)
 
-        pts2 = np.float32([[0, 0],
-                           [1, 0],
-                           [1, 1]])
+    def __cartoon_plugin(self):
+        self.__apply_operation('cartoon', diameter=12, sigma=250)
 
-        warp_mat = cv.getAffineTransform(pts1, pts2)
+    def __erode_plugin(self):
+        self.__apply_operation('erode', ksize=5)
 
-        warp_dst = cv.warpAffine(
-            image_arr, warp_mat, (image_arr.shape[1], image_arr.shape[0]), cv.INTER_CUBIC, cv.BORDER_CONSTANT)
-        self.__show_filtered_image(warp_dst)
+    def __sharpen_plugin(self):
+        self.__apply_operation('sharpen')
 
-    def __rotate_plugin(self):
-        try:
-            image_arr = self.__QImage2array(self.cur_img)
-        except:
+    def __apply_operation(self, name, **params):
+        if getattr(self, 'history', None) is None:
             return
 
-        h, w = image_arr.shape[:2]
-        cX, cY = w // 2, h // 2
-
-        M = cv.getRotationMatrix2D((cX, cY), 45, 1.0)
-        rotated_dst = cv.warpAffine(image_arr, M, (w, h))
-        self.__show_filtered_image(rotated_dst)
-
-    def __cartoon_plugin(self):
-        try:
-            image_arr = self.__QImage2array(self.cur_img)
-        except:
+        operation = filters.OPERATIONS[name]
+        if not self.preview_action.isChecked():
+            result = operation(self.history.current(), **params)
+            self.history.push_operation(name, result, **params)
+            self.__show_filtered_image(result)
             return
 
-        gray = cv.cvtColor(image_arr, cv.COLOR_BGR2GRAY)
-        gray = cv.medianBlur(gray, 7)
-        edges = cv.adaptiveThreshold(
-            gray, 255, cv.ADAPTIVE_THRESH_MEAN_C, cv.THRESH_BINARY, 9, 10)
-
-        color = cv.bilateralFilter(image_arr, 12, 250, 250)
-        cartoon = cv.bitwise_and(color, color, mask=edges)
-
-        self.__show_filtered_image(cartoon)
+        # while a render is pending the next one continues from it, not from the
+        # last finished state, so quick successive filters all end up in the history
+        if self.pending_render is not None:
+            source = self.pending_render
+            proxy, scale = self.pending_preview
+        else:
+            source = self.history.current()
+            scale = self.__preview_scale(source)
+            proxy = source if scale >= 1 else cv.resize(
+                source, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        # the step goes in right away, its result is filled in when the render is done
+        self.history.push_operation(name, **params)
+
+        if scale < 1:
+            proxy = operation(
+                proxy, **filters.scale_params(name, params, scale))
+            self.__show_filtered_image(proxy, 1 / scale)
+        self.pending_preview = (proxy, scale)
+
+        worker = RenderWorker(self.render_generation, self.history.position, operation,
+                              params, source, self.__is_stale_render)
+        worker.signals.finished.connect(self.__swap_full_render)
+        self.pending_render = worker
+        self.render_pool.start(worker)
+        self.main_status_bar.showMessage('Rendering full resolution...')
+
+    def __preview_scale(self, image_arr):
+        height, width = image_arr.shape[:2]
+        zoom = self.image_view.transform().m11() * self.image_view.devicePixelRatioF()
+        limit = (self.PREVIEW_MAX_PIXELS / (height * width)) ** 0.5
+        return min(1.0, zoom, limit)
+
+    def __is_stale_render(self, generation):
+        return generation != self.render_generation
+
+    def __cancel_render(self):
+        # steps without a result yet are replayed from the history when needed
+        self.render_generation += 1
+        self.render_pool.clear()
+        self.pending_render = None
+        self.pending_preview = None
+        self.main_status_bar.clearMessage()
+
+    def __swap_full_render(self, generation, index, result):
+        if self.__is_stale_render(generation):
+            return
+        self.history.fill(index, result)
+        if self.pending_render is None or index != self.pending_render.index:
+            # an earlier step of the chain, the next render is already on its way
+            return
+        self.pending_render = None
+        self.pending_preview = None
+        if index == self.history.position:
+            self.__show_filtered_image(result)
+        self.main_status_bar.clearMessage()
 
-    def __erode_plugin(self):
+    def __undo(self):
         try:
-            image_arr = self.__QImage2array(self.cur_img)
-        except:
+            image_arr = self.history.undo()
+        except AttributeError:
             return
+        self.__cancel_render()
+        self.__show_filtered_image(image_arr)
 
-        kernel = np.ones((5, 5), np.uint8)
-        eroded_image = cv.erode(image_arr, kernel, iterations=1)
-
-        self.__show_filtered_image(eroded_image)
-
-    def __sharpen_plugin(self):
+    def __redo(self):
         try:
-            image_arr = self.__QImage2array(self.cur_img)
-        except:
+            image_arr = self.history.redo()
+        except AttributeError:
             return
-        
-        kernel = np.array([[-1,-1,-1], 
-                           [-1, 9,-1],
-                           [-1,-1,-1]])
-        sharpened_image = cv.filter2D(image_arr, -1, kernel)
+        self.__cancel_render()
+        self.__show_filtered_image(image_arr)
 
-        self.__show_filtered_image(sharpened_image)
+    def __update_edit_actions(self):
+        self.undo_action.setEnabled(self.history.can_undo)
+        self.redo_action.setEnabled(self.history.can_redo)
 
-    def __show_filtered_image(self, img_arr):
+    def __show_filtered_image(self, img_arr, scale=1.0):
         self.image_scene.clear()
-        self.image_view.resetTransform()
+        # in preview mode the zoom level drives the proxy size, so keep it
+        if not self.preview_action.isChecked():
+            self.image_view.resetTransform()
         height, width, _ = img_arr.shape
         bytesPerLine = 3 * width
         qImg = QImage(img_arr.data, width, height,
                       bytesPerLine, QImage.Format.Format_RGB888)
         self.image = QPixmap(qImg)
         self.cur_img = self.image_scene.addPixmap(self.image)
+        self.cur_img.setScale(scale)
+        self.cur_img.setTransformationMode(
+            Qt.TransformationMode.SmoothTransformation)
         self.image_scene.update()
-        self.image_view.setSceneRect(QRectF(self.image.rect()))
+        self.image_view.setSceneRect(self.cur_img.sceneBoundingRect())
+        self.__update_edit_actions()
 
     def __setup_shortcuts(self):
         shortcuts = [Qt.Key.Key_Plus, Qt.Key.Key_Equal]
@@ -309,6 +352,9 @@ class MainWindow(QMainWindow):
         shortcuts = [Qt.Key.Key_Down, Qt.Key.Key_Right]
         self.next_action.setShortcuts(shortcuts)
 
+        self.undo_action.setShortcuts(QKeySequence.StandardKey.Undo)
+        self.redo_action.setShortcuts(QKeySequence.StandardKey.Redo)
+
 
 app = QApplication(sys.argv)
 
@@ -0,0 +1,39 @@
+import numpy as np
+
+from PyQt6.QtCore import (QObject, QRunnable, pyqtSignal)
+
+
+class RenderSignals(QObject):
+    finished = pyqtSignal(int, int, np.ndarray)
+
+
+class RenderWorker(QRunnable):
+    def __init__(self, generation: int, index: int, operation, params: dict, source, is_stale):
+        super(RenderWorker, self).__init__()
+        self.setAutoDelete(False)
+        self.generation = generation
+        # history step this render fills in
+        self.index = index
+        self.operation = operation
+        self.params = params
+        # an array, or the worker rendering the step before this one
+        self.source = source
+        self.is_stale = is_stale
+        self.result = None
+        self.signals = RenderSignals()
+
+    def run(self):
+        # a newer request may have arrived while this one was queued
+        if self.is_stale(self.generation):
+            return
+        image_arr = self.source
+        if isinstance(image_arr, RenderWorker):
+            # the pool runs one render at a time, so the previous step is done by now
+            image_arr = image_arr.result
+            if image_arr is None:
+                return
+        result = self.operation(image_arr, **self.params)
+        self.result = result
+        if self.is_stale(self.generation):
+            return
+        self.signals.finished.emit(self.generation, self.index, result)
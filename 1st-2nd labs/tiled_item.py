@@ -0,0 +1,263 @@
+import hashlib
+import math
+import os
+from collections import OrderedDict
+
+from PyQt6.QtCore import (QObject, QRunnable, QThreadPool, QRect, QRectF, QSize, QStandardPaths,
+                          QDir, pyqtSignal)
+from PyQt6.QtGui import (QImage, QImageReader, QImageIOHandler, QPainter, QPixmap)
+from PyQt6.QtWidgets import QGraphicsItem, QGraphicsObject
+
+import cv2 as cv
+import numpy as np
+
+from image_loader import map_image
+
+TILE_SIZE = 512
+
+
+def pyramid_cache_dir(path: str):
+    stat = os.stat(path)
+    key = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    cache_root = QStandardPaths.writableLocation(
+        QStandardPaths.StandardLocation.CacheLocation)
+    cache_dir = QDir(cache_root)
+    cache_dir.mkpath(f'tiles/{digest}')
+    return cache_dir.absoluteFilePath(f'tiles/{digest}')
+
+
+class TileSignals(QObject):
+    loaded = pyqtSignal(int, int, int, QImage)
+
+
+class TileTask(QRunnable):
+    def __init__(self, path: str, cache_dir: str, image_size: QSize, tile_size: int,
+                 level: int, tx: int, ty: int, is_wanted):
+        super(TileTask, self).__init__()
+        self.path = path
+        self.cache_dir = cache_dir
+        self.image_size = image_size
+        self.tile_size = tile_size
+        self.level = level
+        self.tx = tx
+        self.ty = ty
+        self.is_wanted = is_wanted
+        self.signals = TileSignals()
+
+    def run(self):
+        if not self.is_wanted(self.level):
+            return
+        image = self.__load(self.level, self.tx, self.ty)
+        if not image.isNull():
+            self.signals.loaded.emit(self.level, self.tx, self.ty, image)
+
+    def __tile_file(self, level, tx, ty):
+        return os.path.join(self.cache_dir, f'{level}_{tx}_{ty}.png')
+
+    def __load(self, level, tx, ty):
+        tile_file = self.__tile_file(level, tx, ty)
+        if os.path.exists(tile_file):
+            image = QImage(tile_file)
+            if not image.isNull():
+                return image
+
+        image = self.__from_children(level, tx, ty)
+        if image is None:
+            image = self.__from_source(level, tx, ty)
+        if not image.isNull():
+            image.save(tile_file, 'PNG', 90)
+        return image
+
+    def __source_rect(self, level, tx, ty):
+        span = self.tile_size << level
+        rect = QRect(tx * span, ty * span, span, span)
+        return rect.intersected(QRect(0, 0, self.image_size.width(), self.image_size.height()))
+
+    def __from_source(self, level, tx, ty):
+        rect = self.__source_rect(level, tx, ty)
+        reader = QImageReader(self.path)
+        if not reader.supportsOption(QImageIOHandler.ImageOption.ClipRect):
+            # handlers without clipping would decode the whole image for every tile
+            return self.__from_mapped(level, rect)
+        reader.setClipRect(rect)
+        if level > 0:
+            # lets the JPEG handler decode at a reduced DCT scale
+            reader.setScaledSize(QSize(max(1, rect.width() >> level),
+                                       max(1, rect.height() >> level)))
+        return reader.read()
+
+    def __from_mapped(self, level, rect):
+        # uncompressed BMP and PPM are sliced straight out of the file
+        mapped = map_image(self.path)
+        if mapped is None:
+            return QImage()
+        view, order = mapped
+        step = 1 << level
+        region = view[rect.top():rect.bottom() + 1:step, rect.left():rect.right() + 1:step]
+        if region.dtype != np.uint8:
+            region = region >> 8
+        region = np.ascontiguousarray(region, np.uint8)
+        if region.ndim == 2:
+            region = cv.cvtColor(region, cv.COLOR_GRAY2RGB)
+        elif order == 'BGR':
+            region = cv.cvtColor(region[..., :3], cv.COLOR_BGR2RGB)
+        else:
+            region = np.ascontiguousarray(region[..., :3])
+        height, width, _ = region.shape
+        return QImage(region.data, width, height, 3 * width,
+                      QImage.Format.Format_RGB888).copy()
+
+    def __from_children(self, level, tx, ty):
+        # a coarser tile is cheap to build when its four children are on disk
+        if level == 0:
+            return None
+        children = []
+        for cy in (2 * ty, 2 * ty + 1):
+            for cx in (2 * tx, 2 * tx + 1):
+                if self.__source_rect(level - 1, cx, cy).isEmpty():
+                    continue
+                tile_file = self.__tile_file(level - 1, cx, cy)
+                if not os.path.exists(tile_file):
+                    return None
+                children.append((cx - 2 * tx, cy - 2 * ty, QImage(tile_file)))
+
+        rect = self.__source_rect(level, tx, ty)
+        image = QImage(max(1, rect.width() >> level), max(1, rect.height() >> level),
+                       QImage.Format.Format_RGB32)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        half = self.tile_size // 2
+        for ox, oy, child in children:
+            painter.drawImage(QRectF(ox * half, oy * half, child.width() / 2, child.height() / 2),
+                              child)
+        painter.end()
+        return image
+
+
+class TiledImageItem(QGraphicsObject):
+    def __init__(self, path: str, image_size: QSize, tile_size=TILE_SIZE,
+                 byte_budget=256 * 1024 * 1024, parent=None):
+        super(TiledImageItem, self).__init__(parent)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+        self.path = path
+        self.image_size = image_size
+        self.tile_size = tile_size
+        self.byte_budget = byte_budget
+        self.max_level = max(0, math.ceil(
+            math.log2(max(image_size.width(), image_size.height()) / tile_size)))
+
+        self.__cache_dir = pyramid_cache_dir(path)
+        self.__pool = QThreadPool(self)
+        self.__pool.setMaxThreadCount(
+            max(1, QThreadPool.globalInstance().maxThreadCount() - 1))
+
+        self.__tiles = OrderedDict()
+        self.__bytes = 0
+        self.__pending = set()
+        self.__level = self.max_level
+
+    @staticmethod
+    def can_tile(path: str):
+        # JPEG decodes single tiles, uncompressed BMP and PPM are memory mapped;
+        # anything else would be decoded whole for every tile
+        if path.lower().endswith('.npy'):
+            return False
+        reader = QImageReader(path)
+        return reader.supportsOption(QImageIOHandler.ImageOption.ClipRect) or \
+            map_image(path) is not None
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.image_size.width(), self.image_size.height())
+
+    def paint(self, painter, option, widget=None):
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = 0 if lod >= 1 else int(math.floor(math.log2(1 / lod)))
+        level = min(level, self.max_level)
+        if level != self.__level:
+            self.__level = level
+            self.__pool.clear()
+            self.__pending.clear()
+
+        span = self.tile_size << level
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        tx0, ty0 = int(exposed.left() // span), int(exposed.top() // span)
+        tx1, ty1 = int(math.ceil(exposed.right() / span)), int(math.ceil(exposed.bottom() / span))
+
+        if level != self.max_level and self.__tile(self.max_level, 0, 0) is None:
+            self.__request(self.max_level, 0, 0)
+
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                pixmap = self.__tile(level, tx, ty)
+                if pixmap is not None:
+                    painter.drawPixmap(self.__tile_rect(level, tx, ty), pixmap,
+                                       QRectF(pixmap.rect()))
+                    continue
+                self.__request(level, tx, ty)
+                self.__paint_fallback(painter, level, tx, ty)
+
+    def clear_cache(self):
+        self.__pool.clear()
+        self.__pending.clear()
+        self.__tiles.clear()
+        self.__bytes = 0
+
+    def __tile_rect(self, level, tx, ty):
+        span = self.tile_size << level
+        return QRectF(tx * span, ty * span, span, span).intersected(self.boundingRect())
+
+    def __tile(self, level, tx, ty):
+        pixmap = self.__tiles.get((level, tx, ty))
+        if pixmap is not None:
+            self.__tiles.move_to_end((level, tx, ty))
+        return pixmap
+
+    def __paint_fallback(self, painter, level, tx, ty):
+        # stretch the nearest coarser tile we already have
+        target = self.__tile_rect(level, tx, ty)
+        for coarse in range(level + 1, self.max_level + 1):
+            shift = coarse - level
+            pixmap = self.__tile(coarse, tx >> shift, ty >> shift)
+            if pixmap is None:
+                continue
+            origin = self.__tile_rect(coarse, tx >> shift, ty >> shift).topLeft()
+            scale = 1 / (1 << coarse)
+            source = QRectF((target.left() - origin.x()) * scale, (target.top() - origin.y()) * scale,
+                            target.width() * scale, target.height() * scale)
+            painter.drawPixmap(target, pixmap, source)
+            return
+
+    def __request(self, level, tx, ty):
+        key = (level, tx, ty)
+        if key in self.__pending:
+            return
+        self.__pending.add(key)
+        task = TileTask(self.path, self.__cache_dir, self.image_size, self.tile_size,
+                        level, tx, ty, self.__is_wanted)
+        task.signals.loaded.connect(self.__on_loaded)
+        self.__pool.start(task)
+
+    def __is_wanted(self, level):
+        return level == self.__level or level == self.max_level
+
+    def __on_loaded(self, level, tx, ty, image):
+        self.__pending.discard((level, tx, ty))
+        pixmap = QPixmap.fromImage(image)
+        old = self.__tiles.pop((level, tx, ty), None)
+        if old is not None:
+            # a reloaded tile replaces the old one, it is not counted twice
+            self.__bytes -= old.width() * old.height() * old.depth() // 8
+        self.__tiles[(level, tx, ty)] = pixmap
+        self.__bytes += pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        # never evict the coarsest level, it is the fallback for everything else
+        for key in list(self.__tiles):
+            if self.__bytes <= self.byte_budget:
+                break
+            if key[0] == self.max_level:
+                continue
+            old = self.__tiles.pop(key)
+            self.__bytes -= old.width() * old.height() * old.depth() // 8
+        self.update(self.__tile_rect(level, tx, ty))
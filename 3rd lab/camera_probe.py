@@ -0,0 +1,165 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+import cv2 as cv
+
+from PyQt6.QtCore import QThread, QObject, pyqtSignal
+
+CaptureMode = namedtuple('CaptureMode', 'width height fourcc fps decode_ms')
+
+CANDIDATE_SIZES = [(1920, 1080), (1280, 720), (800, 600), (640, 480), (320, 240)]
+CANDIDATE_FOURCCS = ['MJPG', 'YUYV']
+
+
+def fourcc_code(name: str):
+    return cv.VideoWriter_fourcc(*name)
+
+
+def fourcc_name(code: float):
+    code = int(code)
+    return ''.join(chr((code >> (8 * i)) & 0xff) for i in range(4))
+
+
+def open_capture(camera_id, mode=None, buffer_size=1):
+    cap = cv.VideoCapture(camera_id)
+    if mode is not None:
+        # the pixel format has to be set before the size on most V4L2 drivers
+        cap.set(cv.CAP_PROP_FOURCC, fourcc_code(mode.fourcc))
+        cap.set(cv.CAP_PROP_FRAME_WIDTH, mode.width)
+        cap.set(cv.CAP_PROP_FRAME_HEIGHT, mode.height)
+        if mode.fps > 0:
+            cap.set(cv.CAP_PROP_FPS, round(mode.fps))
+    # a short driver queue keeps the preview from lagging behind
+    cap.set(cv.CAP_PROP_BUFFERSIZE, buffer_size)
+    return cap
+
+
+def device_key(camera_id: int):
+    # OpenCV numbers V4L2 cameras by their /dev/videoN node while Qt lists them in its
+    # own order, so the key is read from the node OpenCV is going to open
+    node = f'/sys/class/video4linux/video{camera_id}'
+    try:
+        with open(f'{node}/name') as f:
+            name = f.read().strip()
+    except OSError:
+        return f'camera-{camera_id}'
+    return f'{name}@{os.path.realpath(f"{node}/device")}'
+
+
+def measure_mode(cap: cv.VideoCapture, frames=30, warmup=5, on_frame=None):
+    for _ in range(warmup):
+        if not cap.grab():
+            return None
+    decode_ns = 0
+    start = time.perf_counter_ns()
+    for _ in range(frames):
+        # grab waits for the driver, retrieve is the decode / conversion cost
+        if not cap.grab():
+            return None
+        decode_start = time.perf_counter_ns()
+        ok, frame = cap.retrieve()
+        decode_ns += time.perf_counter_ns() - decode_start
+        if not ok:
+            return None
+        if on_frame is not None:
+            on_frame(frame)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    return frames / elapsed, decode_ns / frames / 1e6
+
+
+def probe_device(camera_id, sizes=CANDIDATE_SIZES, fourccs=CANDIDATE_FOURCCS, frames=30,
+                 should_stop=None, on_frame=None):
+    modes = []
+    seen = set()
+    for fourcc in fourccs:
+        for width, height in sizes:
+            if should_stop is not None and should_stop():
+                return modes
+            request = CaptureMode(width, height, fourcc, 0, 0)
+            cap = open_capture(camera_id, request)
+            if not cap.isOpened():
+                cap.release()
+                return modes
+            # drivers silently fall back to the nearest mode they support
+            actual = (int(cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+                      int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)),
+                      fourcc_name(cap.get(cv.CAP_PROP_FOURCC)))
+            if actual not in seen:
+                seen.add(actual)
+                measured = measure_mode(cap, frames, on_frame=on_frame)
+                if measured is not None:
+                    fps, decode_ms = measured
+                    modes.append(CaptureMode(*actual, round(fps, 1), round(decode_ms, 3)))
+            cap.release()
+    return modes
+
+
+def choose_mode(modes, width=640, height=480, fps=30):
+    # the cheapest mode that meets the target, otherwise the fastest one available
+    suitable = [m for m in modes
+                if m.width >= width and m.height >= height and m.fps >= 0.9 * fps]
+    if suitable:
+        return min(suitable, key=lambda m: (m.width * m.height, m.decode_ms))
+    if not modes:
+        return None
+    return max(modes, key=lambda m: (m.fps, -m.decode_ms))
+
+
+def load_cached_modes(cache_path: str, device_key: str):
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if device_key not in cache:
+        return None
+    return [CaptureMode(*m) for m in cache[device_key]]
+
+
+def save_cached_modes(cache_path: str, device_key: str, modes):
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[device_key] = [list(m) for m in modes]
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+
+class ProbeSignals(QObject):
+    progress = pyqtSignal(str)
+    frame_ready = pyqtSignal(object)
+    modes_found = pyqtSignal(str, list)
+
+
+class CameraProbe(QThread):
+    def __init__(self, camera_id, device_key: str, frames=30):
+        super(CameraProbe, self).__init__()
+        self.__camera_id = camera_id
+        self.__device_key = device_key
+        self.__frames = frames
+        self.__running = False
+        # the probe holds the device, so its frames are the preview until it is done
+        self.frame_pending = False
+        self.signals = ProbeSignals()
+
+    def run(self):
+        self.__running = True
+        self.signals.progress.emit(f'Probing camera {self.__camera_id}...')
+        modes = probe_device(self.__camera_id, frames=self.__frames,
+                             should_stop=lambda: not self.__running,
+                             on_frame=self.__preview)
+        if self.__running:
+            self.signals.modes_found.emit(self.__device_key, modes)
+        self.__running = False
+
+    def stop(self):
+        self.__running = False
+
+    def __preview(self, frame):
+        if not self.frame_pending:
+            self.frame_pending = True
+            self.signals.frame_ready.emit(frame)
@@ -3,16 +3,41 @@ import cv2 as cv
 import numpy as np
 
 from PyQt6.QtCore import (
-    QThread, QMutex, QElapsedTimer, QObject, pyqtSignal, QTime)
+    QThread, QObject, pyqtSignal, QTime, QThreadPool)
 
 from utils import new_saved_video_name, get_saved_video_path
+from frame_ring import FrameRing
+from camera_probe import open_capture
+from clip_index import ThumbnailStrip, IndexTask
+
+
+MOTION_KERNEL = cv.getStructuringElement(cv.MORPH_RECT, (9, 9))
+
+
+def region_key(rect, cell=64):
+    # regions moving around inside one cell count as the same detection
+    x, y, w, h = rect
+    return ((x + w // 2) // cell, (y + h // 2) // cell)
+
+
+def find_motion(segmentor, frame: np.ndarray):
+    mask = segmentor.apply(frame)
+    _, mask = cv.threshold(mask, 25, 255, cv.THRESH_BINARY)
+    mask = cv.erode(mask, MOTION_KERNEL)
+    mask = cv.dilate(mask, MOTION_KERNEL, iterations=3)
+
+    contours, _ = cv.findContours(
+        mask, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+    return [cv.boundingRect(contour) for contour in contours]
+
 
 class Communicate(QObject):
     fps_changed = pyqtSignal(float)
-    frame_captured = pyqtSignal(np.ndarray)
+    frame_ready = pyqtSignal()
     video_saved = pyqtSignal(str)
     data_changed = pyqtSignal(float, np.ndarray, np.ndarray)
     cv_data_changed = pyqtSignal(float, np.ndarray, np.ndarray)
+    cpu_usage = pyqtSignal(dict)
 
 
 class CaptureThread(QThread):
@@ -22,14 +47,23 @@ class CaptureThread(QThread):
         STOPPING = auto()
         STOPPED = auto()
 
-    def __init__(self, camera_id: int, lock: QMutex):
+    # smaller motion regions are recorded but not published as events
+    MIN_REGION_AREA = 400
+
+    def __init__(self, camera_id: int, mode=None):
         super(CaptureThread, self).__init__()
         self.__running = False
         self.__camera_id = camera_id
+        self.__mode = mode
         self.__video_path = ''
-        self.__data_lock = lock
+
+        self.frame_ring = None
+        # cleared by the GUI when it handles frame_ready, so at most one is ever queued
+        self.frame_pending = False
 
         self.signals = Communicate()
+        # EventBus, set by the window; motion and recordings are published to it
+        self.events = None
 
         self.fps_calculating = False
         self.motion_detected = False
@@ -42,42 +76,33 @@ class CaptureThread(QThread):
         self.video_saving_status = self.VideoSavingStatus.STOPPED
         self.saved_video_name = ''
         self.video_writer = None
+        self.thumbnail_strip = None
 
         self.curr_frame_ind = 0
         self.fps_buffer = [None] * 100
 
-    def calculate_fps(self, cap: cv.VideoCapture):
-        count_to_read = 100
-        timer = QElapsedTimer()
-        timer.start()
-
-        for _ in np.arange(0, count_to_read):
-            _, _ = cap.read()
-
-        elapsed_ms = timer.elapsed()
-
-        self.fps = count_to_read / (elapsed_ms / 1000.0)
-        self.fps_calculating = False
-        self.signals.fps_changed.emit(self.fps)
-
     def start_calc_fps(self):
         self.fps_calculating = True
 
     def run(self):
         self.__running = True
-        cap = cv.VideoCapture(self.__camera_id)
+        cap = open_capture(self.__camera_id, self.__mode)
         self.frame_width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
 
         self.segmentor = cv.createBackgroundSubtractorMOG2(500, 16, True)
+        self.frame_ring = FrameRing((self.frame_height, self.frame_width, 3))
+        tmp_frame = np.empty((self.frame_height, self.frame_width, 3), np.uint8)
 
         while self.__running:
             if self.fps_calculating:
-                self.calculate_fps(cap)
+                # fps is already averaged over the last 100 frames, no need to stop and measure
+                self.fps_calculating = False
+                self.signals.fps_changed.emit(self.fps)
 
-            _, tmp_frame = cap.read()
+            ok, tmp_frame = cap.read(tmp_frame)
 
-            if tmp_frame is None:
+            if not ok or tmp_frame is None:
                 break
 
             if self.motion_detecting_status:
@@ -87,18 +112,20 @@ class CaptureThread(QThread):
                 self.start_saving_video(tmp_frame)
             elif self.video_saving_status == self.VideoSavingStatus.STARTED:
                 self.video_writer.write(tmp_frame)
+                self.thumbnail_strip.add(tmp_frame)
             elif self.video_saving_status == self.VideoSavingStatus.STOPPING:
                 self.stop_saving_video()
 
-            tmp_frame = cv.cvtColor(tmp_frame, cv.COLOR_BGR2RGB)
+            # converted straight into the next ring slot, no per-frame allocation
+            slot, frame = self.frame_ring.acquire()
+            cv.cvtColor(tmp_frame, cv.COLOR_BGR2RGB, dst=frame)
 
-            self.__calc_data(tmp_frame)
+            self.__calc_data(frame)
 
-            self.__data_lock.lock()
-            frame = tmp_frame
-            self.__data_lock.unlock()
-
-            self.signals.frame_captured.emit(frame)
+            self.frame_ring.commit(slot)
+            if not self.frame_pending:
+                self.frame_pending = True
+                self.signals.frame_ready.emit()
         cap.release()
         cv.destroyAllWindows()
         self.__running = False
@@ -107,19 +134,28 @@ class CaptureThread(QThread):
         self.saved_video_name = new_saved_video_name()
         cover = get_saved_video_path(self.saved_video_name, 'jpg')
         cv.imwrite(cover, first_frame)
+        fps = self.fps if self.fps else 30
         self.video_writer = cv.VideoWriter(
             get_saved_video_path(self.saved_video_name, 'avi'),
             cv.VideoWriter_fourcc('M', 'J', 'P', 'G'),
-            self.fps if self.fps else 30,
+            fps,
             (self.frame_width, self.frame_height)
         )
+        # thumbnails are taken while recording, frame offsets are read from the file afterwards
+        self.thumbnail_strip = ThumbnailStrip(fps)
         self.video_saving_status = self.VideoSavingStatus.STARTED
 
     def stop_saving_video(self):
         self.video_saving_status = self.VideoSavingStatus.STOPPED
         self.video_writer.release()
         self.video_writer = None
+        QThreadPool.globalInstance().start(IndexTask(
+            get_saved_video_path(self.saved_video_name, 'avi'), self.thumbnail_strip))
+        self.thumbnail_strip = None
         self.signals.video_saved.emit(self.saved_video_name)
+        self.__publish('recording_saved', key=self.saved_video_name,
+                       name=self.saved_video_name,
+                       path=get_saved_video_path(self.saved_video_name, 'avi'))
 
     def set_running(self, running):
         self.__running = running
@@ -128,35 +164,34 @@ class CaptureThread(QThread):
         self.video_saving_status = status
 
     def __motion_detect(self, frame: np.ndarray):
-        mask = self.segmentor.apply(frame)
-        _, mask = cv.threshold(mask, 25, 255, cv.THRESH_BINARY)
-        noise_size = 9
-        kernel = cv.getStructuringElement(
-            cv.MORPH_RECT, (noise_size, noise_size))
-        mask = cv.erode(mask, kernel)
-        mask = cv.dilate(mask, kernel, iterations=3)
-
-        contours, _ = cv.findContours(
-            mask, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+        rects = find_motion(self.segmentor, frame)
 
-        has_motion = len(contours) > 0
+        has_motion = len(rects) > 0
 
         if not self.motion_detected and has_motion:
             self.motion_detected = True
             self.video_saving_status = self.VideoSavingStatus.STARTING
-            print('New motion detected, should send a notification.')
-            #! https://stackoverflow.com/questions/32378719/qtconcurrent-in-pyside-pyqt
-            #! QtConcurrent in PyQt is unavaliable
+            self.__publish('motion_started', regions=len(rects))
         elif self.motion_detected and not has_motion:
             self.motion_detected = False
             self.video_saving_status = self.VideoSavingStatus.STOPPING
-            print('Detected motion disappeared.')
+            self.__publish('motion_stopped')
+        self.__publish_regions(rects)
 
         color = (0, 0, 255)
-        for contour in contours:
-            rect = cv.boundingRect(contour)
+        for rect in rects:
             frame = cv.rectangle(frame, rect, color, 1)
 
+    def __publish_regions(self, rects):
+        for rect in rects:
+            x, y, w, h = rect
+            if w * h >= self.MIN_REGION_AREA:
+                self.__publish('motion_region', key=region_key(rect), x=x, y=y, w=w, h=h)
+
+    def __publish(self, kind: str, **payload):
+        if self.events is not None:
+            self.events.publish(kind, camera=self.__camera_id, **payload)
+
     def set_motion_detecting_status(self, status: bool):
         self.motion_detecting_status = status
         self.motion_detected = False
@@ -0,0 +1,234 @@
+import os
+import struct
+
+import cv2 as cv
+import numpy as np
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+IDX1_ENTRY = np.dtype([('id', 'S4'), ('flags', '<u4'), ('offset', '<u4'), ('size', '<u4')])
+THUMB_EVERY = 2.0
+THUMB_WIDTH = 160
+
+
+def index_path(video_path: str):
+    return os.path.splitext(video_path)[0] + '.idx.npz'
+
+
+def _walk(f, start, end):
+    # yields fourcc, list type (or None), data offset and size of each chunk in [start, end)
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        fourcc, size = struct.unpack('<4sI', header)
+        list_type = None
+        if fourcc in (b'RIFF', b'LIST'):
+            list_type = f.read(4)
+        yield fourcc, list_type, pos + 8, size
+        # chunks are word aligned
+        pos += 8 + size + (size & 1)
+
+
+def scan_avi(path: str):
+    info = {'usec_per_frame': 0, 'scale': 0, 'rate': 0, 'width': 0, 'height': 0}
+    movi = []
+    idx1 = None
+    segments = 0
+
+    def headers(f, start, end):
+        for fourcc, list_type, offset, size in _walk(f, start, end):
+            if list_type in (b'hdrl', b'strl'):
+                headers(f, offset + 4, offset + size)
+            elif list_type == b'movi':
+                movi.append((offset + 4, offset + size))
+            elif fourcc == b'avih':
+                f.seek(offset)
+                info['usec_per_frame'] = struct.unpack('<I', f.read(4))[0]
+            elif fourcc == b'strh' and info['rate'] == 0:
+                f.seek(offset)
+                strh = f.read(32)
+                if strh[:4] == b'vids':
+                    info['scale'], info['rate'] = struct.unpack('<II', strh[20:28])
+            elif fourcc == b'strf' and info['width'] == 0:
+                f.seek(offset + 4)
+                info['width'], info['height'] = struct.unpack('<ii', f.read(8))
+
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        for fourcc, list_type, offset, size in _walk(f, 0, file_size):
+            if fourcc != b'RIFF' or list_type not in (b'AVI ', b'AVIX'):
+                raise ValueError(f'{path} is not an AVI file')
+            segments += 1
+            headers(f, offset + 4, min(offset + size, file_size))
+            if idx1 is None:
+                for chunk, _, chunk_offset, chunk_size in _walk(f, offset + 4, min(offset + size, file_size)):
+                    if chunk == b'idx1':
+                        f.seek(chunk_offset)
+                        idx1 = np.frombuffer(
+                            f.read(chunk_size - chunk_size % 16), IDX1_ENTRY)
+
+        offsets = sizes = None
+        # idx1 only covers the first RIFF segment, OpenDML files are scanned instead
+        if idx1 is not None and segments == 1 and movi:
+            video = idx1[np.char.endswith(idx1['id'], b'dc') | np.char.endswith(idx1['id'], b'db')]
+            if len(video):
+                base = movi[0][0] - 4 if video['offset'][0] < movi[0][0] else 0
+                offsets = video['offset'].astype(np.int64) + base + 8
+                sizes = video['size'].astype(np.int64)
+                f.seek(offsets[0] - 8)
+                if f.read(4) != video['id'][0]:
+                    offsets = sizes = None
+        if offsets is None:
+            found = []
+            for start, end in movi:
+                for fourcc, list_type, offset, size in _walk(f, start, min(end, file_size)):
+                    if list_type == b'rec ':
+                        found += [(o, s) for c, _, o, s in _walk(f, offset + 4, offset + size)
+                                  if c[2:] in (b'dc', b'db')]
+                    elif fourcc[2:] in (b'dc', b'db'):
+                        found.append((offset, size))
+            found = np.array(found, np.int64).reshape(-1, 2)
+            offsets, sizes = found[:, 0], found[:, 1]
+
+    if info['rate'] and info['scale']:
+        frame_duration = info['scale'] / info['rate']
+    elif info['usec_per_frame']:
+        frame_duration = info['usec_per_frame'] / 1e6
+    else:
+        frame_duration = 1 / 30
+    return offsets, sizes, frame_duration, info['width'], abs(info['height'])
+
+
+class ThumbnailStrip:
+    # collected while recording, one downscaled RGB frame every `every` seconds of video
+    def __init__(self, fps: float, every=THUMB_EVERY, width=THUMB_WIDTH):
+        self.step = max(1, round(every * fps))
+        self.width = width
+        self.frame_count = 0
+        self.indices = []
+        self.images = []
+
+    def add(self, frame_bgr: np.ndarray):
+        if self.frame_count % self.step == 0:
+            height = max(1, frame_bgr.shape[0] * self.width // frame_bgr.shape[1])
+            small = cv.resize(frame_bgr, (self.width, height), interpolation=cv.INTER_AREA)
+            self.indices.append(self.frame_count)
+            self.images.append(cv.cvtColor(small, cv.COLOR_BGR2RGB))
+        self.frame_count += 1
+
+
+class ClipIndex:
+    def __init__(self, offsets, sizes, frame_duration, width, height,
+                 thumb_indices=None, thumbnails=None):
+        self.offsets = np.asarray(offsets, np.int64)
+        self.sizes = np.asarray(sizes, np.int64)
+        self.frame_duration = float(frame_duration)
+        self.width = int(width)
+        self.height = int(height)
+        self.timestamps = np.arange(len(self.offsets)) * self.frame_duration
+        self.thumb_indices = np.zeros(0, np.int64) if thumb_indices is None else np.asarray(thumb_indices, np.int64)
+        self.thumbnails = np.zeros((0, 1, 1, 3), np.uint8) if thumbnails is None else np.asarray(thumbnails, np.uint8)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def fps(self):
+        return 1 / self.frame_duration
+
+    @property
+    def duration(self):
+        return len(self) * self.frame_duration
+
+    def frame_at(self, seconds: float):
+        # constant frame rate, so a timestamp maps straight to a frame index
+        return int(np.clip(round(seconds / self.frame_duration), 0, max(len(self) - 1, 0)))
+
+    def thumbnail_at(self, seconds: float):
+        if len(self.thumbnails) == 0:
+            return None
+        i = np.searchsorted(self.thumb_indices, self.frame_at(seconds), side='right') - 1
+        return self.thumbnails[max(i, 0)]
+
+    def read_jpeg(self, f, index: int):
+        f.seek(self.offsets[index])
+        return f.read(self.sizes[index])
+
+    def decode(self, f, index: int, flags=cv.IMREAD_COLOR):
+        # MJPEG frames are independent JPEGs, any one can be decoded on its own
+        data = self.read_jpeg(f, index)
+        if len(data) == 0:
+            return None
+        return cv.imdecode(np.frombuffer(data, np.uint8), flags)
+
+    def save(self, path: str):
+        np.savez(path, offsets=self.offsets, sizes=self.sizes,
+                 meta=np.array([self.frame_duration, self.width, self.height]),
+                 thumb_indices=self.thumb_indices, thumbnails=self.thumbnails)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            frame_duration, width, height = data['meta']
+            return cls(data['offsets'], data['sizes'], frame_duration, width, height,
+                       data['thumb_indices'], data['thumbnails'])
+
+
+def build_index(video_path: str, strip: ThumbnailStrip = None, every=THUMB_EVERY, width=THUMB_WIDTH):
+    offsets, sizes, frame_duration, frame_width, frame_height = scan_avi(video_path)
+    index = ClipIndex(offsets, sizes, frame_duration, frame_width, frame_height)
+    if strip is not None and strip.images:
+        index.thumb_indices = np.array(strip.indices, np.int64)
+        index.thumbnails = np.stack(strip.images)
+    elif len(index):
+        # old recordings: decode only the thumbnail frames, at reduced size
+        step = max(1, round(every / frame_duration))
+        indices, images = [], []
+        with open(video_path, 'rb') as f:
+            for i in range(0, len(index), step):
+                frame = index.decode(f, i, cv.IMREAD_REDUCED_COLOR_4)
+                if frame is None:
+                    continue
+                height = max(1, frame.shape[0] * width // frame.shape[1])
+                small = cv.resize(frame, (width, height), interpolation=cv.INTER_AREA)
+                indices.append(i)
+                images.append(cv.cvtColor(small, cv.COLOR_BGR2RGB))
+        if images:
+            index.thumb_indices = np.array(indices, np.int64)
+            index.thumbnails = np.stack(images)
+    index.save(index_path(video_path))
+    return index
+
+
+def load_index(video_path: str):
+    path = index_path(video_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(video_path):
+        return None
+    try:
+        return ClipIndex.load(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class IndexSignals(QObject):
+    index_ready = pyqtSignal(str)
+    index_failed = pyqtSignal(str, str)
+
+
+class IndexTask(QRunnable):
+    def __init__(self, video_path: str, strip: ThumbnailStrip = None):
+        super(IndexTask, self).__init__()
+        self.video_path = video_path
+        self.strip = strip
+        self.signals = IndexSignals()
+
+    def run(self):
+        try:
+            build_index(self.video_path, self.strip)
+        except (OSError, ValueError) as e:
+            self.signals.index_failed.emit(self.video_path, str(e))
+            return
+        self.signals.index_ready.emit(self.video_path)
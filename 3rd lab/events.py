@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class FileSink:
+    def __init__(self, path: str):
+        self.name = f'file:{path}'
+        self.path = path
+
+    async def send(self, batch: list):
+        # a slow disk must not hold up the webhook and socket sinks on the same loop
+        await asyncio.get_running_loop().run_in_executor(None, self.__write, batch)
+
+    def __write(self, batch: list):
+        with open(self.path, 'a') as f:
+            for event in batch:
+                f.write(json.dumps(event) + '\n')
+
+
+class WebhookSink:
+    def __init__(self, url: str, timeout=5.0):
+        self.name = f'webhook:{url}'
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.ssl = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+
+    async def send(self, batch: list):
+        await asyncio.wait_for(self.__post(batch), self.timeout)
+
+    async def __post(self, batch: list):
+        body = json.dumps({'events': batch}).encode()
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        try:
+            writer.write((f'POST {self.path} HTTP/1.1\r\n'
+                          f'Host: {self.host}:{self.port}\r\n'
+                          'Content-Type: application/json\r\n'
+                          f'Content-Length: {len(body)}\r\n'
+                          'Connection: close\r\n\r\n').encode() + body)
+            await writer.drain()
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[1].startswith(b'2'):
+            raise ConnectionError(f'{self.name} answered {status_line!r}')
+
+
+class UnixSocketSink:
+    def __init__(self, path: str, timeout=5.0):
+        self.name = f'unix:{path}'
+        self.path = path
+        self.timeout = timeout
+        self.__writer = None
+
+    async def send(self, batch: list):
+        # the connection is kept between batches and reopened after a failure
+        try:
+            if self.__writer is None:
+                _, self.__writer = await asyncio.wait_for(
+                    asyncio.open_unix_connection(self.path), self.timeout)
+            self.__writer.write(
+                b''.join(json.dumps(event).encode() + b'\n' for event in batch))
+            await asyncio.wait_for(self.__writer.drain(), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            if self.__writer is not None:
+                self.__writer.close()
+            self.__writer = None
+            raise
+
+
+class EventBus:
+    def __init__(self, sinks=(), batch_size=20, batch_interval=0.5, dedup_window=5.0,
+                 max_queue=1000, retries=5, backoff=0.5, max_backoff=30.0):
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.dedup_window = dedup_window
+        self.max_queue = max_queue
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.__loop = None
+        self.__thread = None
+        self.__queue = None
+        self.__last_seen = {}
+        self.__next_prune = 0.0
+        self.__lock = threading.Lock()
+        self.__metrics = {'published': 0, 'deduplicated': 0, 'dropped': 0,
+                          'delivered': 0, 'failed': 0, 'retries': 0,
+                          'lag_last_ms': 0.0, 'lag_mean_ms': 0.0, 'lag_max_ms': 0.0}
+        self.__sink_errors = {sink.name: {'failed': 0, 'last_error': ''} for sink in self.sinks}
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        ready = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, args=(ready,), name='event-bus', daemon=True)
+        self.__thread.start()
+        ready.wait()
+
+    def stop(self, timeout=5.0):
+        # pending batches get up to timeout seconds to go out
+        if self.__thread is None:
+            return
+        self.__loop.call_soon_threadsafe(self.__queue.put_nowait, None)
+        self.__thread.join(timeout)
+        self.__thread = None
+
+    def publish(self, kind: str, key=None, **payload):
+        # called from the capture threads, never blocks; only keyed events are
+        # deduplicated, state changes like motion_started / motion_stopped have no key
+        if self.__thread is None:
+            return
+        event = {'kind': kind, 'time': time.time(), **payload}
+        self.__count('published')
+        try:
+            self.__loop.call_soon_threadsafe(
+                self.__enqueue, (kind, key), event, time.monotonic())
+        except RuntimeError:
+            # the bus is shutting down
+            self.__count('dropped')
+
+    def metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics['sinks'] = {name: dict(errors) for name, errors in self.__sink_errors.items()}
+        metrics['queued'] = self.__queue.qsize() if self.__queue is not None else 0
+        return metrics
+
+    def __count(self, name, value=1):
+        with self.__lock:
+            self.__metrics[name] += value
+
+    def __run(self, ready: threading.Event):
+        self.__loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.__loop)
+        self.__queue = asyncio.Queue()
+        ready.set()
+        try:
+            self.__loop.run_until_complete(self.__dispatch())
+        finally:
+            self.__loop.close()
+
+    def __enqueue(self, dedup_key, event, published_at):
+        if dedup_key[1] is not None:
+            if self.__is_duplicate(dedup_key, published_at):
+                self.__count('deduplicated')
+                return
+        if self.__queue.qsize() >= self.max_queue:
+            self.__count('dropped')
+            return
+        self.__queue.put_nowait((event, published_at))
+
+    def __is_duplicate(self, dedup_key, published_at):
+        if published_at >= self.__next_prune:
+            # keys that have been quiet for a whole window cannot suppress anything
+            self.__last_seen = {key: seen for key, seen in self.__last_seen.items()
+                                if published_at - seen < self.dedup_window}
+            self.__next_prune = published_at + self.dedup_window
+        last = self.__last_seen.get(dedup_key)
+        if last is not None and published_at - last < self.dedup_window:
+            return True
+        self.__last_seen[dedup_key] = published_at
+        return False
+
+    async def __dispatch(self):
+        sink_queues = [asyncio.Queue(self.max_queue) for _ in self.sinks]
+        workers = [asyncio.ensure_future(self.__sink_worker(sink, q))
+                   for sink, q in zip(self.sinks, sink_queues)]
+        while True:
+            item = await self.__queue.get()
+            for q in sink_queues:
+                if q.full():
+                    # a sink that is down for long loses its oldest events, not the newest
+                    q.get_nowait()
+                    self.__count('dropped')
+                q.put_nowait(item)
+            if item is None:
+                break
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def __next_batch(self, q: asyncio.Queue):
+        item = await q.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = self.__loop.time() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - self.__loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(q.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def __sink_worker(self, sink, q: asyncio.Queue):
+        finished = False
+        while not finished:
+            batch, finished = await self.__next_batch(q)
+            if batch:
+                await self.__deliver(sink, batch)
+
+    async def __deliver(self, sink, batch):
+        events = [event for event, _ in batch]
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                await sink.send(events)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    with self.__lock:
+                        self.__metrics['failed'] += len(batch)
+                        errors = self.__sink_errors[sink.name]
+                        errors['failed'] += len(batch)
+                        errors['last_error'] = f'{type(e).__name__}: {e}'
+                    return
+                self.__count('retries')
+                # full jitter keeps several sinks from retrying in lockstep
+                await asyncio.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, self.max_backoff)
+
+        now = time.monotonic()
+        with self.__lock:
+            m = self.__metrics
+            for _, published_at in batch:
+                lag = (now - published_at) * 1000
+                m['delivered'] += 1
+                m['lag_last_ms'] = round(lag, 2)
+                m['lag_max_ms'] = round(max(m['lag_max_ms'], lag), 2)
+                m['lag_mean_ms'] = round(
+                    m['lag_mean_ms'] + (lag - m['lag_mean_ms']) / m['delivered'], 2)
+
+
+async def serve_webhook(host: str, port: int, fail_every=0):
+    # stand-in receiver for trying sinks locally, fail_every > 0 answers 503 to every n-th request
+    count = 0
+
+    async def handle(reader, writer):
+        nonlocal count
+        count += 1
+        headers = {}
+        await reader.readline()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        if fail_every and count % fail_every == 0:
+            writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n')
+        else:
+            for event in json.loads(body)['events']:
+                print(json.dumps(event))
+            writer.write(b'HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_unix(path: str):
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            print(line.decode().rstrip())
+
+    server = await asyncio.start_unix_server(handle, path)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local receivers for Video Viewer events')
+    parser.add_argument('--webhook-port', type=int, help='serve a webhook on 127.0.0.1:PORT')
+    parser.add_argument('--fail-every', type=int, default=0,
+                        help='answer 503 to every n-th webhook request')
+    parser.add_argument('--unix', help='listen on this Unix socket path')
+    args = parser.parse_args()
+
+    if args.webhook_port:
+        asyncio.run(serve_webhook('127.0.0.1', args.webhook_port, args.fail_every))
+    elif args.unix:
+        asyncio.run(serve_unix(args.unix))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class FrameRing:
+    image_format = 'RGB'
+
+    def __init__(self, shape: tuple, slots=4, dtype=np.uint8):
+        self.shape = shape
+        self.slots = slots
+        self.__buffers = np.zeros((slots, *shape), dtype)
+        # odd sequence number = slot is being written
+        self.__sequences = np.zeros(slots, np.int64)
+        self.__next_sequence = 2
+        self.__latest = -1
+
+    def acquire(self):
+        seq = self.__next_sequence
+        slot = (seq // 2) % self.slots
+        self.__sequences[slot] = seq - 1
+        return slot, self.__buffers[slot]
+
+    def commit(self, slot: int):
+        seq = self.__next_sequence
+        self.__sequences[slot] = seq
+        self.__latest = slot
+        self.__next_sequence = seq + 2
+        return seq
+
+    def latest(self):
+        slot = self.__latest
+        if slot < 0:
+            return 0, None
+        seq = int(self.__sequences[slot])
+        if seq % 2:
+            return 0, None
+        return seq, self.__buffers[slot]
+
+    def is_valid(self, seq: int):
+        # a reader re-checks this after using a slot, the producer may have lapped it
+        slot = (seq // 2) % self.slots
+        return self.__sequences[slot] == seq
@@ -1,28 +1,49 @@
+from functools import partial
 import sys
 import numpy as np
 
-from PyQt6.QtCore import (QSize, Qt, QDir, QMutex, QRectF)
+from PyQt6.QtCore import (QSize, Qt, QDir, QFileInfo, QRectF, QThreadPool, QTimer)
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QGraphicsScene, QGraphicsView,
-                             QLabel, QMessageBox, QGridLayout, QWidget, QCheckBox, QPushButton, QListView)
+                             QLabel, QMessageBox, QGridLayout, QWidget, QCheckBox, QPushButton, QListView,
+                             QSlider, QComboBox)
 from PyQt6.QtGui import (QAction, QPixmap, QImage,
                          QStandardItemModel, QStandardItem)
 from PyQt6.QtMultimedia import (QMediaDevices, QCamera, QMediaCaptureSession)
 from PyQt6.QtMultimediaWidgets import QVideoWidget
 
-from utils import get_saved_video_path, get_data_path
+from utils import get_saved_video_path, get_data_path, get_cache_path
 from cap import CaptureThread
+from mp_pipeline import ProcessCaptureThread
+from camera_probe import (CameraProbe, choose_mode, device_key as camera_device_key,
+                          load_cached_modes, save_cached_modes)
+from events import EventBus, FileSink, WebhookSink, UnixSocketSink
+from clip_index import IndexTask, load_index
+from player import Player, SPEEDS
 
 
 class MainWindow(QMainWindow):
     USE_CAMERA = False
+    # capture, motion detection and encoding in separate processes
+    USE_PROCESSES = False
+    PROCESS_WORKERS = 2
+    # width, height, fps; the cheapest probed mode that reaches it is used
+    CAPTURE_TARGET = (1280, 720, 30)
+    # motion and recording events always go to events.jsonl, these sinks are optional
+    EVENTS_WEBHOOK = ''
+    EVENTS_SOCKET = ''
 
     def __init__(self):
         super().__init__()
         self.capturer = None
+        self.probe = None
+        self.player = None
+        self.play_position = 0
+        self.__probe_cache = f'{get_cache_path()}/camera_modes.json'
+        self.events = EventBus(self.__event_sinks())
+        self.events.start()
         self.__init_ui()
         self.__create_actions()
         self.__populate_saved_list()
-        self.data_lock = QMutex()
 
     def __init_ui(self):
         self.resize(QSize(1000, 800))
@@ -59,6 +80,30 @@ class MainWindow(QMainWindow):
                                Qt.AlignmentFlag.AlignHCenter)
         tools_layout.addWidget(QLabel(self), 0, 2)
 
+        self.play_button = QPushButton('Pause')
+        self.seek_slider = QSlider(Qt.Orientation.Horizontal)
+        self.speed_box = QComboBox()
+        self.speed_box.addItems([f'{speed}x' for speed in SPEEDS])
+        self.speed_box.setCurrentText('1x')
+        self.live_button = QPushButton('Back to Live')
+        playback_layout = QGridLayout()
+        playback_layout.addWidget(self.play_button, 0, 0)
+        playback_layout.addWidget(self.seek_slider, 0, 1)
+        playback_layout.addWidget(self.speed_box, 0, 2)
+        playback_layout.addWidget(self.live_button, 0, 3)
+        tools_layout.addLayout(playback_layout, 1, 0, 1, 3)
+        self.__set_playback_enabled(False)
+
+        self.play_timer = QTimer(self)
+        self.play_timer.timeout.connect(self.__play_tick)
+        self.play_button.clicked.connect(self.__toggle_play)
+        self.seek_slider.sliderMoved.connect(self.__scrub)
+        self.seek_slider.sliderReleased.connect(
+            lambda: self.__seek(self.seek_slider.value()))
+        self.seek_slider.valueChanged.connect(self.__seek_clicked)
+        self.speed_box.currentIndexChanged.connect(self.__speed_changed)
+        self.live_button.clicked.connect(self.__stop_playback)
+
         self.saved_list = QListView(self)
         self.saved_list.setViewMode(QListView.ViewMode.IconMode)
         self.saved_list.setResizeMode(QListView.ResizeMode.Adjust)
@@ -67,6 +112,7 @@ class MainWindow(QMainWindow):
         self.list_model = QStandardItemModel(self)
         self.saved_list.setModel(self.list_model)
         main_layout.addWidget(self.saved_list, 13, 0, 4, 1)
+        self.saved_list.doubleClicked.connect(self.__play_saved)
 
         self.record_button.clicked.connect(self.__recording_start_stop)
         self.monitor_check_box.stateChanged.connect(
@@ -83,15 +129,19 @@ class MainWindow(QMainWindow):
         open_camera_action = QAction('&Open Camera', self)
         open_camera_action.triggered.connect(self.__open_camera)
 
-        # calculate_FPS_action = QAction('&Calculate FPS', self)
-        # calculate_FPS_action.triggered.connect(self.__calculate_fps)
+        probe_camera_action = QAction('&Probe Camera Modes', self)
+        probe_camera_action.triggered.connect(self.__reprobe_camera)
+
+        calculate_FPS_action = QAction('&Calculate FPS', self)
+        calculate_FPS_action.triggered.connect(self.__calculate_fps)
 
         exit_action = QAction('&Exit', self)
         exit_action.triggered.connect(self.close)
 
         actions = [camera_info_action,
                    open_camera_action,
-                   #    calculate_FPS_action,
+                   probe_camera_action,
+                   calculate_FPS_action,
                    exit_action]
 
         self.file_menu.addActions(actions)
@@ -132,44 +182,257 @@ class MainWindow(QMainWindow):
 
             self.camera.start()
         else:
-            if self.capturer is not None:
-                self.capturer.set_running(False)
-                self.capturer.signals.frame_captured.disconnect(
-                    self.__update_frame)
-                self.capturer.signals.fps_changed.disconnect(self.__update_fps)
-                self.capturer.signals.data_changed.disconnect(
-                    self.__update_data)
-                self.capturer.signals.video_saved.disconnect(
-                    self.__append_saved_video)
-
+            self.__stop_capturer()
             camID = 0
-            self.capturer = CaptureThread(camID, self.data_lock)
-            self.capturer.signals.frame_captured.connect(self.__update_frame)
-            self.capturer.signals.fps_changed.connect(self.__update_fps)
-            self.capturer.signals.data_changed.connect(self.__update_data)
-            self.capturer.signals.video_saved.connect(
-                self.__append_saved_video)
-            self.capturer.start()
-            self.main_status_label.setText(f'Capturing Camera {camID}')
+            device_key = camera_device_key(camID)
+            modes = load_cached_modes(self.__probe_cache, device_key)
+            if modes is None:
+                # first time this device is seen, probe it once and remember its modes
+                self.__start_probe(camID, device_key)
+            else:
+                self.__start_capturer(camID, choose_mode(modes, *self.CAPTURE_TARGET))
+
+    def __event_sinks(self):
+        sinks = [FileSink(f'{get_data_path()}/events.jsonl')]
+        if self.EVENTS_WEBHOOK:
+            sinks.append(WebhookSink(self.EVENTS_WEBHOOK))
+        if self.EVENTS_SOCKET:
+            sinks.append(UnixSocketSink(self.EVENTS_SOCKET))
+        return sinks
+
+    def closeEvent(self, event):
+        self.__stop_playback()
+        if self.probe is not None:
+            self.probe.stop()
+            self.probe.wait()
+        self.__stop_capturer()
+        self.events.stop()
+        super().closeEvent(event)
+
+    def __stop_capturer(self):
+        if self.capturer is None:
+            return
+        self.capturer.set_running(False)
+        self.capturer.signals.frame_ready.disconnect(
+            self.__update_frame)
+        self.capturer.signals.fps_changed.disconnect(self.__update_fps)
+        self.capturer.signals.data_changed.disconnect(
+            self.__update_data)
+        self.capturer.signals.video_saved.disconnect(
+            self.__append_saved_video)
+        self.capturer.signals.cpu_usage.disconnect(
+            self.__update_cpu_usage)
+        # the device has to be released before it can be opened again, and a QThread
+        # destroyed while it still runs aborts the app, so wait for the loop to end
+        self.capturer.wait()
+        self.capturer = None
+
+    def __start_probe(self, camID: int, device_key: str):
+        if self.probe is not None and self.probe.isRunning():
+            return
+        self.probe = CameraProbe(camID, device_key)
+        self.probe.signals.progress.connect(self.main_status_label.setText)
+        self.probe.signals.frame_ready.connect(self.__show_probe_frame)
+        self.probe.signals.modes_found.connect(
+            partial(self.__probe_finished, camID))
+        self.probe.start()
+
+    def __show_probe_frame(self, frame: np.ndarray):
+        self.probe.frame_pending = False
+        if self.player is not None:
+            return
+        height, width, _ = frame.shape
+        image = QImage(frame, width, height, 3 * width, QImage.Format.Format_BGR888)
+        self.__show_pixmap(QPixmap.fromImage(image))
+
+    def __probe_finished(self, camID: int, device_key: str, modes: list):
+        if modes:
+            save_cached_modes(self.__probe_cache, device_key, modes)
+        self.__start_capturer(camID, choose_mode(modes, *self.CAPTURE_TARGET))
 
-    def __update_frame(self, frame: np.ndarray):
-        self.data_lock.lock()
-        current_frame = frame
-        self.data_lock.unlock()
+    def __reprobe_camera(self):
+        if self.USE_CAMERA:
+            return
+        self.__stop_capturer()
+        camID = 0
+        self.__start_probe(camID, camera_device_key(camID))
+
+    def __start_capturer(self, camID: int, mode):
+        if self.USE_PROCESSES:
+            self.capturer = ProcessCaptureThread(
+                camID, mode, self.PROCESS_WORKERS)
+        else:
+            self.capturer = CaptureThread(camID, mode)
+        self.shown_seq = 0
+        self.capturer.events = self.events
+        self.capturer.signals.frame_ready.connect(self.__update_frame)
+        self.capturer.signals.fps_changed.connect(self.__update_fps)
+        self.capturer.signals.data_changed.connect(self.__update_data)
+        self.capturer.signals.video_saved.connect(
+            self.__append_saved_video)
+        self.capturer.signals.cpu_usage.connect(self.__update_cpu_usage)
+        self.capturer.start()
+        if mode is None:
+            self.main_status_label.setText(f'Capturing Camera {camID}')
+        else:
+            self.main_status_label.setText(
+                f'Capturing Camera {camID}: {mode.width}x{mode.height} {mode.fourcc} '
+                f'~{mode.fps} FPS, decode {mode.decode_ms} ms')
+
+    def __update_frame(self):
+        self.capturer.frame_pending = False
+        ring = self.capturer.frame_ring
+        if ring is None or self.player is not None:
+            return
+        # always the newest frame, the ones that arrived while we were busy are skipped
+        seq, current_frame = ring.latest()
+        if current_frame is None or seq <= self.shown_seq:
+            return
         height, width, _ = current_frame.shape
         bytes_per_line = 3 * width
         image = QImage(current_frame,
                        width,
                        height,
                        bytes_per_line,
-                       QImage.Format.Format_RGB888)
+                       QImage.Format.Format_BGR888 if ring.image_format == 'BGR'
+                       else QImage.Format.Format_RGB888)
         pixmap = QPixmap.fromImage(image)
+        self.shown_seq = seq
+        if not ring.is_valid(seq):
+            # the capture thread lapped the ring while we copied, drop the torn frame
+            return
+        self.__show_pixmap(pixmap)
+
+    def __show_pixmap(self, pixmap: QPixmap):
         self.image_scene.clear()
         self.image_view.resetTransform()
         self.image_scene.addPixmap(pixmap)
         self.image_scene.update()
         self.image_view.setSceneRect(QRectF(pixmap.rect()))
 
+    def __show_rgb(self, frame: np.ndarray):
+        height, width, _ = frame.shape
+        image = QImage(frame, width, height, 3 * width,
+                       QImage.Format.Format_RGB888)
+        self.__show_pixmap(QPixmap.fromImage(image))
+
+    def __set_playback_enabled(self, enabled: bool):
+        for widget in (self.play_button, self.seek_slider, self.speed_box, self.live_button):
+            widget.setEnabled(enabled)
+
+    def __play_saved(self, model_index):
+        if self.USE_CAMERA:
+            return
+        name = model_index.data(Qt.ItemDataRole.DisplayRole)
+        video_path = get_saved_video_path(name, 'avi')
+        if not QDir().exists(video_path):
+            self.main_status_label.setText(f'{name}.avi is missing')
+            return
+        if load_index(video_path) is not None:
+            self.__open_player(video_path)
+            return
+        self.main_status_label.setText(f'Indexing {name}...')
+        task = IndexTask(video_path)
+        task.signals.index_ready.connect(self.__open_player)
+        task.signals.index_failed.connect(self.__index_failed)
+        QThreadPool.globalInstance().start(task)
+
+    def __index_failed(self, video_path: str, error: str):
+        self.main_status_label.setText(f'Cannot index {QFileInfo(video_path).fileName()}: {error}')
+
+    def __open_player(self, video_path: str):
+        self.__stop_playback()
+        index = load_index(video_path)
+        if index is None or len(index) == 0:
+            self.main_status_label.setText(f'Cannot play {video_path}')
+            return
+        self.player = Player(video_path, index)
+        self.player.signals.stats_changed.connect(self.__update_player_stats)
+        self.player.signals.end_reached.connect(self.__playback_ended)
+        self.player.speed = SPEEDS[self.speed_box.currentIndex()]
+        self.play_position = 0
+        self.seek_slider.blockSignals(True)
+        self.seek_slider.setRange(0, len(index) - 1)
+        self.seek_slider.setValue(0)
+        self.seek_slider.blockSignals(False)
+        self.__set_playback_enabled(True)
+        self.player.start()
+        self.play_timer.start(round(self.player.interval_ms))
+        self.play_button.setText('Pause')
+
+    def __play_tick(self):
+        item = self.player.next_frame()
+        if item is None:
+            # buffer underrun, the previous frame stays on screen
+            return
+        self.play_position, frame = item
+        self.__show_rgb(frame)
+        self.seek_slider.blockSignals(True)
+        self.seek_slider.setValue(self.play_position)
+        self.seek_slider.blockSignals(False)
+
+    def __toggle_play(self):
+        if self.player is None:
+            return
+        if self.play_timer.isActive():
+            self.play_timer.stop()
+            self.play_button.setText('Play')
+        else:
+            if self.play_position >= len(self.player.index) - 1:
+                self.__seek(0)
+            self.play_timer.start(round(self.player.interval_ms))
+            self.play_button.setText('Pause')
+
+    def __playback_ended(self):
+        # the rest of the buffer still plays out before the timer stops
+        QTimer.singleShot(round(self.player.buffer.qsize() * self.player.interval_ms) + 100,
+                          self.__pause_if_drained)
+
+    def __pause_if_drained(self):
+        if self.player is not None and self.player.buffer.empty():
+            self.play_timer.stop()
+            self.play_button.setText('Play')
+
+    def __scrub(self, value: int):
+        # while dragging only the thumbnail strip is shown, nothing is decoded
+        index = self.player.index
+        thumbnail = index.thumbnail_at(index.timestamps[value])
+        if thumbnail is not None:
+            self.__show_rgb(np.ascontiguousarray(thumbnail))
+        self.main_status_label.setText(
+            f'{index.timestamps[value]:.1f} / {index.duration:.1f} s')
+
+    def __seek_clicked(self, value: int):
+        if not self.seek_slider.isSliderDown():
+            self.__seek(value)
+
+    def __seek(self, value: int):
+        if self.player is None:
+            return
+        self.play_position = value
+        self.player.seek(value)
+
+    def __speed_changed(self, i: int):
+        if self.player is None:
+            return
+        self.player.set_speed(SPEEDS[i], self.play_position)
+        self.play_timer.setInterval(round(self.player.interval_ms))
+
+    def __update_player_stats(self, decode_fps: float, filled: int, capacity: int):
+        self.main_status_label.setText(
+            f'Playback {SPEEDS[self.speed_box.currentIndex()]}x; '
+            f'decode FPS: {decode_fps}; buffer: {filled}/{capacity}')
+
+    def __stop_playback(self):
+        if self.player is None:
+            return
+        self.play_timer.stop()
+        self.player.stop()
+        self.player.wait()
+        self.player = None
+        self.__set_playback_enabled(False)
+        self.image_scene.clear()
+
     def __update_fps(self):
         self.main_status_label.setText(
             f'FPS of current camera is {self.capturer.fps}')
@@ -189,11 +452,17 @@ class MainWindow(QMainWindow):
             self.capturer.start_calc_fps()
 
     def __update_data(self, fps: float, mean: float, std: float):
+        if self.player is not None:
+            return
         fps_info = f'FPS: {fps}; '
         mean_info = f'mean: {mean}; '
         std_info = f'std: {std};'
         self.main_status_label.setText(fps_info + mean_info + std_info)
 
+    def __update_cpu_usage(self, usage: dict):
+        self.main_status_bar.showMessage(
+            'CPU: ' + '; '.join(f'{name} {percent}%' for name, percent in usage.items()))
+
     def __populate_saved_list(self):
         dir = QDir(get_data_path())
         name_filters = ['*.jpg']
@@ -211,6 +480,13 @@ class MainWindow(QMainWindow):
                 145), Qt.ItemDataRole.DecorationRole)
             self.list_model.setData(index, name, Qt.ItemDataRole.DisplayRole)
 
+            # recordings made before indexing existed are indexed in the background
+            video_path = get_saved_video_path(name, 'avi')
+            if QDir().exists(video_path) and load_index(video_path) is None:
+                task = IndexTask(video_path)
+                task.signals.index_failed.connect(self.__index_failed)
+                QThreadPool.globalInstance().start(task)
+
     def __update_monitor_status(self, status: bool):
         if self.capturer is None:
             return
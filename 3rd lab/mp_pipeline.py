@@ -0,0 +1,423 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+
+from PyQt6.QtCore import QThread
+
+from cap import CaptureThread, Communicate, find_motion, region_key
+from utils import new_saved_video_name, get_saved_video_path
+from camera_probe import open_capture
+from clip_index import ThumbnailStrip, build_index
+
+
+class SharedFrameRing:
+    # same protocol as FrameRing, but the slots and sequence numbers live in shared memory
+    image_format = 'BGR'
+
+    def __init__(self, shape: tuple, slots=16, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        header = (slots + 1) * 8
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=header + slots * int(np.prod(shape)))
+        else:
+            # spawned children share the parent's resource tracker, the Qt process unlinks
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.__sequences = np.ndarray((slots,), np.int64, self.shm.buf)
+        self.__latest = np.ndarray((1,), np.int64, self.shm.buf, slots * 8)
+        self.__frames = np.ndarray(
+            (slots, *self.shape), np.uint8, self.shm.buf, header)
+        if name is None:
+            self.__sequences[:] = 0
+            self.__latest[0] = -1
+        # only the capture process writes, so the counter does not need to be shared
+        self.__next_sequence = 2
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self):
+        seq = self.__next_sequence
+        slot = (seq // 2) % self.slots
+        self.__sequences[slot] = seq - 1
+        return slot, self.__frames[slot]
+
+    def commit(self, slot: int):
+        seq = self.__next_sequence
+        self.__sequences[slot] = seq
+        self.__latest[0] = slot
+        self.__next_sequence = seq + 2
+        return seq
+
+    def latest(self):
+        slot = int(self.__latest[0])
+        if slot < 0:
+            return 0, None
+        seq = int(self.__sequences[slot])
+        if seq % 2:
+            return 0, None
+        return seq, self.__frames[slot]
+
+    def frame(self, seq: int):
+        return self.__frames[(seq // 2) % self.slots]
+
+    def is_valid(self, seq: int):
+        return self.__sequences[(seq // 2) % self.slots] == seq
+
+    def close(self):
+        # views into the buffer have to go before the mapping can be closed
+        del self.__sequences, self.__latest, self.__frames
+        try:
+            self.shm.close()
+        except BufferError:
+            # the GUI still holds a frame, the mapping goes away with it
+            pass
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def put_latest(task_queue, task, results):
+    # a full queue means the worker fell behind, its oldest frame is stale by now
+    while True:
+        try:
+            task_queue.put_nowait(task)
+            return
+        except queue.Full:
+            pass
+        try:
+            old = task_queue.get_nowait()
+        except queue.Empty:
+            continue
+        if old is not None:
+            results.put(('dropped', old[0]))
+
+
+def capture_main(camera_id, mode, handshake, ring_name, tasks, results, encoder, recording, stop,
+                 cpu_times, cpu_index):
+    cap = open_capture(camera_id, mode)
+    width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+    handshake.put((width, height, cap.get(cv.CAP_PROP_FPS)))
+    ring = SharedFrameRing((height, width, 3), name=ring_name.get())
+
+    while not stop.is_set():
+        slot, frame = ring.acquire()
+        # decoded straight into the shared slot
+        ok, image = cap.read(frame)
+        if not ok or image is None:
+            break
+        if image is not frame:
+            np.copyto(frame, image)
+        seq = ring.commit(slot)
+
+        put_latest(tasks[(seq // 2) % len(tasks)], (seq, time.time()), results)
+        if recording.value:
+            encoder.put(('frame', seq))
+        cpu_times[cpu_index] = time.process_time()
+
+    for task_queue in tasks:
+        put_latest(task_queue, None, results)
+    cap.release()
+    ring.close()
+
+
+def worker_main(ring_name, shape, slots, tasks, results, stop, cpu_times, cpu_index):
+    ring = SharedFrameRing(shape, slots, ring_name)
+    # each worker sees every n-th frame, so it keeps its own background model
+    segmentor = cv.createBackgroundSubtractorMOG2(500, 16, True)
+
+    while True:
+        try:
+            task = tasks.get(timeout=0.5)
+        except queue.Empty:
+            if stop.is_set():
+                break
+            continue
+        if task is None:
+            break
+
+        seq, timestamp = task
+        frame = ring.frame(seq)
+        # frames are BGR here, the GUI reports channels in RGB order
+        mean_frame = np.round(np.mean(frame, axis=(1, 0))[::-1], 2)
+        std_frame = np.round(np.std(frame, axis=(1, 0))[::-1], 2)
+        rects = find_motion(segmentor, frame)
+        if ring.is_valid(seq):
+            results.put(('frame', seq, timestamp, mean_frame, std_frame, rects))
+        else:
+            # the capture process lapped the ring while we were reading
+            results.put(('dropped', seq))
+        cpu_times[cpu_index] = time.process_time()
+
+    ring.close()
+
+
+def encoder_main(ring_name, shape, slots, commands, results, stop, cpu_times, cpu_index):
+    ring = SharedFrameRing(shape, slots, ring_name)
+    writer = None
+    cover = None
+    strip = None
+    name = ''
+    video_path = ''
+    dropped = 0
+
+    while True:
+        try:
+            command = commands.get(timeout=0.5)
+        except queue.Empty:
+            if stop.is_set():
+                break
+            continue
+        if command is None:
+            break
+
+        if command[0] == 'start':
+            _, name, video_path, cover, fps, size = command
+            writer = cv.VideoWriter(
+                video_path, cv.VideoWriter_fourcc('M', 'J', 'P', 'G'), fps, size)
+            strip = ThumbnailStrip(fps)
+            dropped = 0
+        elif command[0] == 'frame' and writer is not None:
+            seq = command[1]
+            frame = ring.frame(seq).copy()
+            if not ring.is_valid(seq):
+                # the capture process lapped the ring, the copy holds a newer or torn frame
+                dropped += 1
+            else:
+                if cover is not None:
+                    cv.imwrite(cover, frame)
+                    cover = None
+                writer.write(frame)
+                strip.add(frame)
+        elif command[0] == 'stop' and writer is not None:
+            writer.release()
+            writer = None
+            # this process has nothing better to do, the index is built right away
+            index_error = index_clip(video_path, strip)
+            results.put(('saved', name, dropped, index_error))
+        cpu_times[cpu_index] = time.process_time()
+
+    if writer is not None:
+        writer.release()
+        index_error = index_clip(video_path, strip)
+        results.put(('saved', name, dropped, index_error))
+    ring.close()
+
+
+def index_clip(video_path: str, strip: ThumbnailStrip):
+    # a clip without an index still plays, it must not take the encoder down;
+    # the error goes out with the recording_saved event
+    try:
+        build_index(video_path, strip)
+    except (OSError, ValueError) as e:
+        return str(e)
+    return None
+
+
+class ProcessCaptureThread(QThread):
+    VideoSavingStatus = CaptureThread.VideoSavingStatus
+
+    def __init__(self, camera_id: int, mode=None, workers=2, slots=16):
+        super(ProcessCaptureThread, self).__init__()
+        self.__running = False
+        self.__camera_id = camera_id
+        self.__mode = mode
+        self.__workers = workers
+        self.__slots = slots
+
+        self.frame_ring = None
+        self.frame_pending = False
+
+        self.signals = Communicate()
+        self.events = None
+
+        self.motion_detected = False
+        self.motion_detecting_status = False
+
+        self.frame_width = 0
+        self.frame_height = 0
+        self.fps = 0.0
+        self.last_rects = []
+
+        self.video_saving_status = self.VideoSavingStatus.STOPPED
+
+    def set_running(self, running):
+        self.__running = running
+
+    def start_calc_fps(self):
+        self.signals.fps_changed.emit(self.fps)
+
+    def set_video_saving_status(self, status):
+        self.video_saving_status = status
+
+    def set_motion_detecting_status(self, status: bool):
+        self.motion_detecting_status = status
+        self.motion_detected = False
+        if self.video_saving_status != self.VideoSavingStatus.STOPPED:
+            self.video_saving_status = self.VideoSavingStatus.STOPPING
+
+    def run(self):
+        self.__running = True
+        # spawn, forking a process that runs Qt threads is not safe
+        ctx = mp.get_context('spawn')
+        handshake, ring_name = ctx.Queue(), ctx.Queue()
+        # frames older than a ring's worth are overwritten anyway
+        tasks = [ctx.Queue(max(1, self.__slots // self.__workers)) for _ in range(self.__workers)]
+        results, commands = ctx.Queue(), ctx.Queue()
+        self.__recording = ctx.Value('b', 0)
+        stop = ctx.Event()
+        cpu_times = ctx.Array('d', self.__workers + 2)
+        names = ['capture', 'encoder'] + \
+            [f'worker {i}' for i in range(self.__workers)]
+
+        capture = ctx.Process(target=capture_main, daemon=True, args=(
+            self.__camera_id, self.__mode, handshake, ring_name, tasks, results, commands,
+            self.__recording, stop, cpu_times, 0))
+        capture.start()
+        processes = [capture]
+        try:
+            width, height, fps = handshake.get(timeout=10)
+        except queue.Empty:
+            width = height = 0
+        if width == 0 or height == 0:
+            stop.set()
+            capture.join(1)
+            capture.terminate()
+            self.__running = False
+            return
+
+        self.frame_width, self.frame_height = width, height
+        self.__camera_fps = fps if fps > 0 else 30
+        shape = (height, width, 3)
+        ring = SharedFrameRing(shape, self.__slots)
+        ring_name.put(ring.name)
+        self.frame_ring = ring
+
+        processes.append(ctx.Process(target=encoder_main, daemon=True, args=(
+            ring.name, shape, self.__slots, commands, results, stop, cpu_times, 1)))
+        for i, task_queue in enumerate(tasks):
+            processes.append(ctx.Process(target=worker_main, daemon=True, args=(
+                ring.name, shape, self.__slots, task_queue, results, stop, cpu_times, i + 2)))
+        for process in processes[1:]:
+            process.start()
+        feeders = [capture] + processes[2:]
+
+        self.__commands = commands
+        # results come back out of order from the workers, they are handled in sequence order
+        pending = {}
+        expected = 2
+        last_time = None
+        cpu_wall = time.monotonic()
+        cpu_last = list(cpu_times)
+
+        while self.__running:
+            self.__update_recording()
+            try:
+                record = results.get(timeout=0.05)
+            except queue.Empty:
+                # the clip or the camera ended and every queued frame has been processed
+                if not any(process.is_alive() for process in feeders):
+                    break
+                record = None
+
+            if record is not None:
+                if record[0] == 'saved':
+                    self.__saved(*record[1:])
+                else:
+                    pending[record[1]] = record
+            if len(pending) > 2 * self.__slots and expected not in pending:
+                # a worker died or a result got lost, do not stall forever
+                expected = min(pending)
+
+            while expected in pending:
+                record = pending.pop(expected)
+                expected += 2
+                if record[0] != 'frame':
+                    continue
+                _, seq, timestamp, mean_frame, std_frame, rects = record
+                if last_time is not None and timestamp > last_time:
+                    self.fps = 0.9 * self.fps + 0.1 / (timestamp - last_time) \
+                        if self.fps else 1 / (timestamp - last_time)
+                last_time = timestamp
+                self.last_rects = rects
+                if self.motion_detecting_status:
+                    self.__motion_detect(rects)
+                self.signals.data_changed.emit(
+                    round(self.fps, 2), mean_frame, std_frame)
+                if not self.frame_pending:
+                    self.frame_pending = True
+                    self.signals.frame_ready.emit()
+
+            now = time.monotonic()
+            if now - cpu_wall >= 1.0:
+                current = list(cpu_times)
+                usage = {name: round(100 * (c - l) / (now - cpu_wall), 1)
+                         for name, c, l in zip(names, current, cpu_last)}
+                self.signals.cpu_usage.emit(usage)
+                cpu_wall, cpu_last = now, current
+
+        self.__recording.value = 0
+        stop.set()
+        commands.put(None)
+        for process in processes:
+            process.join(2)
+            if process.is_alive():
+                process.terminate()
+        while True:
+            try:
+                record = results.get_nowait()
+            except queue.Empty:
+                break
+            if record[0] == 'saved':
+                self.__saved(*record[1:])
+        self.frame_ring = None
+        ring.close()
+        ring.unlink()
+        self.__running = False
+
+    def __update_recording(self):
+        if self.video_saving_status == self.VideoSavingStatus.STARTING:
+            name = new_saved_video_name()
+            self.__commands.put(('start', name,
+                                 get_saved_video_path(name, 'avi'),
+                                 get_saved_video_path(name, 'jpg'),
+                                 self.fps if self.fps else self.__camera_fps,
+                                 (self.frame_width, self.frame_height)))
+            self.__recording.value = 1
+            self.video_saving_status = self.VideoSavingStatus.STARTED
+        elif self.video_saving_status == self.VideoSavingStatus.STOPPING:
+            self.__recording.value = 0
+            self.__commands.put(('stop',))
+            self.video_saving_status = self.VideoSavingStatus.STOPPED
+
+    def __motion_detect(self, rects):
+        has_motion = len(rects) > 0
+        if not self.motion_detected and has_motion:
+            self.motion_detected = True
+            self.video_saving_status = self.VideoSavingStatus.STARTING
+            self.__publish('motion_started', regions=len(rects))
+        elif self.motion_detected and not has_motion:
+            self.motion_detected = False
+            self.video_saving_status = self.VideoSavingStatus.STOPPING
+            self.__publish('motion_stopped')
+        for rect in rects:
+            x, y, w, h = rect
+            if w * h >= CaptureThread.MIN_REGION_AREA:
+                self.__publish('motion_region', key=region_key(rect), x=x, y=y, w=w, h=h)
+
+    def __saved(self, name: str, dropped=0, index_error=None):
+        self.signals.video_saved.emit(name)
+        self.__publish('recording_saved', key=name, name=name,
+                       path=get_saved_video_path(name, 'avi'), dropped_frames=dropped,
+                       index_error=index_error)
+
+    def __publish(self, kind: str, **payload):
+        if self.events is not None:
+            self.events.publish(kind, camera=self.__camera_id, **payload)
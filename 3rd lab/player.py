@@ -0,0 +1,120 @@
+import queue
+import threading
+import time
+
+import cv2 as cv
+import numpy as np
+
+from PyQt6.QtCore import QThread, QObject, pyqtSignal
+
+from clip_index import ClipIndex
+
+SPEEDS = [0.25, 0.5, 1, 2, 4, 8, 16]
+
+
+class PlayerSignals(QObject):
+    stats_changed = pyqtSignal(float, int, int)
+    end_reached = pyqtSignal()
+
+
+class Player(QThread):
+    def __init__(self, video_path: str, index: ClipIndex, buffer_size=24):
+        super(Player, self).__init__()
+        self.video_path = video_path
+        self.index = index
+        self.signals = PlayerSignals()
+        self.buffer = queue.Queue(buffer_size)
+        self.speed = 1.0
+        self.decode_fps = 0.0
+
+        self.__running = False
+        self.__lock = threading.Lock()
+        # bumped by every seek, frames decoded for an older generation are thrown away
+        self.__generation = 0
+        self.__seek_to = 0
+
+    @property
+    def interval_ms(self):
+        # slow motion stretches the display interval, fast forward skips frames instead
+        return self.index.frame_duration * 1000 / min(self.speed, 1.0)
+
+    def seek(self, frame_index: int):
+        with self.__lock:
+            self.__generation += 1
+            self.__seek_to = int(np.clip(frame_index, 0, len(self.index) - 1))
+
+    def set_speed(self, speed: float, position: int):
+        self.speed = speed
+        # frames already buffered were picked for the old step
+        self.seek(position)
+
+    def stop(self):
+        self.__running = False
+
+    def next_frame(self):
+        # called by the GUI timer, returns (frame index, RGB frame), None on underrun
+        while True:
+            try:
+                generation, frame_index, frame = self.buffer.get_nowait()
+            except queue.Empty:
+                return None
+            if generation == self.__generation:
+                return frame_index, frame
+
+    def run(self):
+        self.__running = True
+        generation = -1
+        position = 0.0
+        at_end = False
+        decoded = 0
+        decode_time = 0.0
+        stats_time = time.perf_counter()
+
+        with open(self.video_path, 'rb') as f:
+            while self.__running:
+                with self.__lock:
+                    if generation != self.__generation:
+                        generation = self.__generation
+                        position = float(self.__seek_to)
+                        at_end = False
+                        self.__drain()
+
+                frame_index = int(position)
+                if frame_index >= len(self.index):
+                    if not at_end:
+                        at_end = True
+                        self.signals.end_reached.emit()
+                    time.sleep(0.02)
+                    continue
+
+                start = time.perf_counter()
+                frame = self.index.decode(f, frame_index)
+                position += max(self.speed, 1.0)
+                if frame is None:
+                    continue
+                frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+                decode_time += time.perf_counter() - start
+                decoded += 1
+
+                item = (generation, frame_index, frame)
+                while self.__running and generation == self.__generation:
+                    try:
+                        self.buffer.put(item, timeout=0.05)
+                        break
+                    except queue.Full:
+                        pass
+
+                now = time.perf_counter()
+                if now - stats_time >= 0.5 and decoded:
+                    # what the decoder could sustain, not the rate it is throttled to by the display
+                    self.decode_fps = decoded / decode_time
+                    decoded, decode_time, stats_time = 0, 0.0, now
+                    self.signals.stats_changed.emit(
+                        round(self.decode_fps, 1), self.buffer.qsize(), self.buffer.maxsize)
+
+    def __drain(self):
+        while True:
+            try:
+                self.buffer.get_nowait()
+            except queue.Empty:
+                return
@@ -18,3 +18,11 @@ def new_saved_video_name():
 
 def get_saved_video_path(name: str, postfix: str):
     return f'{get_data_path()}/{name}.{postfix}'
+
+
+def get_cache_path():
+    cache_path = QStandardPaths.writableLocation(
+        QStandardPaths.StandardLocation.CacheLocation)
+    QDir().mkpath(cache_path)
+
+    return cache_path
@@ -1,20 +1,35 @@
 from enum import Enum, auto
 import cv2 as cv
 import numpy as np
-import collections
 from PyQt6.QtCore import (QThread, QObject, pyqtSignal)
 import time
 
-from nn_utils import (build_model, format_yolov5, detect,
-                      wrap_detection, load_classes)
+from nn_utils import (DetectorNets, InputSizeController, format_yolov5, detect,
+                      wrap_detection, detect_regions, load_classes, INPUT_WIDTH)
+from track_history import TrackHistory
+from trackers import create_tracker
+from mot import MultiObjectTracker
+from motion_gate import MotionGate
+from segmentation import HSVSegmenter, find_motion_rect, find_bright_blobs
+from profiler import StageProfiler
+from governor import QualityGovernor
+from overlay import Annotations
+from result_sink import (objects_array, KIND_DETECTION, KIND_TRACK,
+                         KIND_MOTION, KIND_BLOB)
 
 
 class CaptureSignals(QObject):
     captured_frame = pyqtSignal(np.ndarray)
+    # sent right before the frame it belongs to
+    annotations = pyqtSignal(object)
     current_fps = pyqtSignal(int)
     mean_pi = pyqtSignal(np.ndarray)
     pi_std = pyqtSignal(np.ndarray)
     min_max_pi = pyqtSignal(np.ndarray)
+    track_velocity = pyqtSignal(np.ndarray)
+    captured_mask = pyqtSignal(np.ndarray)
+    blob_stats = pyqtSignal(np.ndarray)
+    quality_changed = pyqtSignal(str)
     update_data = pyqtSignal()
 
 
@@ -40,41 +55,81 @@ class CaptureThread(QThread):
         self.current_mode = self.DetectionMode.DEFAULT
         self.mode_state = self.ModeState.DEFAULT
         self.bbox = None
-        self.trajectory_buffer = collections.deque(maxlen=100)
+        self.trajectory_buffer = TrackHistory(capacity=100)
         self.slider_info = dict()
         self.signals = CaptureSignals()
         self.model_path = ''
         self.classes_path = ''
+        self.tracker_name = 'MIL'
+        self.objects = MultiObjectTracker()
+        self.motion_gate = MotionGate()
+        self.motion_gating = False
+        self.regions_area_limit = 0.6
+        self.hsv_segmenter = HSVSegmenter()
+        self.send_mask = True
+        self.profiler = StageProfiler()
+        self.fps_smoothing = 0.1
+        # ResultSink, set by the window while results are being exported
+        self.result_sink = None
+        self.input_size_controller = InputSizeController()
+        self.input_size = INPUT_WIDTH
+        self.governor = QualityGovernor()
 
     def run(self):
         cap = cv.VideoCapture(self.__camera_id)
-        tracker = cv.TrackerMIL_create()
+        tracker = None
         segmentor = cv.createBackgroundSubtractorMOG2(200, 16, True)
 
         colors = [(255, 255, 0), (0, 255, 0), (0, 255, 255), (255, 0, 0)]
-        new_frame_time = 0
-        prev_frame_time = 0
+        profiler = self.profiler
+        prev_frame_time = None
+        fps = 0.0
+        frame_index = 0
+        governor = self.governor
+        mean = std = min_max_pi = None
+        # results of the last processed frame, drawn again on skipped ones
+        last_rect = None
+        last_blobs = None
+        # tracker state of the last frame it actually ran on
+        track_ok = False
+        last_bbox = None
 
         while self.__video_capture:
-            new_frame_time = time.time()
-            _, frame = cap.read()
-            frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
-            if frame is None:
+            stage_start = profiler.now()
+            new_frame_time = stage_start / 1e9
+            ok, frame = cap.read()
+            if not ok or frame is None:
                 break
+            frame_timestamp = time.time()
+            stage_start = profiler.lap('read', stage_start)
+            process_start = stage_start
+            level = governor.settings
+            process_frame = frame_index % level.process_every == 0
+            refresh_stats = mean is None or frame_index % level.stats_every == 0
+
+            frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+            stage_start = profiler.lap('convert', stage_start)
 
-            mean, std = cv.meanStdDev(frame)
-            min_v = np.min(frame)
-            max_v = np.max(frame)
-            min_max_pi = np.array([min_v, max_v])
+            if refresh_stats:
+                mean, std = cv.meanStdDev(frame)
+                min_v = np.min(frame)
+                max_v = np.max(frame)
+                min_max_pi = np.array([min_v, max_v])
+            stage_start = profiler.lap('stats', stage_start)
+            frame_objects = []
+            # the frame itself stays clean, the GUI draws these over it
+            annotations = Annotations()
 
             if self.bbox is not None:
                 if self.current_mode == self.DetectionMode.DRAW:
-                    self.trajectory_buffer = collections.deque(maxlen=100)
+                    self.trajectory_buffer.clear()
                     start_point = self.bbox[0]
                     end_point = self.bbox[1]
                     if start_point is not None and end_point is not None:
-                        frame = cv.rectangle(
-                            frame, start_point, end_point, (255, 0, 0), 1)
+                        corners = np.array([start_point, end_point])
+                        annotations.add_rects(
+                            [*corners.min(axis=0), *np.abs(corners[1] - corners[0])],
+                            (255, 0, 0), 1)
                 if self.current_mode == self.DetectionMode.MANUAL:
                     start_point = self.bbox[0]
                     end_point = self.bbox[1]
@@ -83,26 +138,32 @@ class CaptureThread(QThread):
                             bbox_width = end_point[0] - start_point[0]
                             bbox_height = end_point[1] - start_point[1]
                             bbox = [*start_point, bbox_width, bbox_height]
+                            # tracking on a smaller frame is much cheaper, boxes are scaled back
+                            tracker_scale = self.slider_info.get(
+                                'Tracking scale %', 100) / 100
+                            tracker = create_tracker(
+                                self.tracker_name, tracker_scale)
                             tracker.init(frame, bbox)
+                            track_ok, last_bbox = True, bbox
                             self.mode_state = self.ModeState.STREAM
                         elif self.mode_state == self.ModeState.STREAM:
-                            ok, bbox = tracker.update(frame)
-                            if ok:
-                                p1 = (int(bbox[0]), int(bbox[1]))
-                                p2 = (int(bbox[0] + bbox[2]),
-                                      int(bbox[1] + bbox[3]))
+                            if process_frame:
+                                track_ok, last_bbox = tracker.update(frame)
+                            if track_ok:
+                                bbox = last_bbox
                                 x_c = int(bbox[0] + bbox[2] / 2)
                                 y_c = int(bbox[1] + bbox[3] / 2)
-                                self.trajectory_buffer.append((x_c, y_c))
-                                cv.circle(frame, (x_c, y_c),
-                                          5, (0, 255, 255), -1)
-                                for idx, point in enumerate(reversed(self.trajectory_buffer)):
-                                    if len(self.trajectory_buffer) > 1 and idx > 0:
-                                        next_point = self.trajectory_buffer[len(
-                                            self.trajectory_buffer) - idx]
-                                        cv.line(frame, point,
-                                                next_point, (0, 255, 255), 2)
-                                cv.rectangle(frame, p1, p2, (255, 0, 0), 1)
+                                if process_frame:
+                                    self.trajectory_buffer.append(
+                                        x_c, y_c, new_frame_time)
+                                annotations.add_point(x_c, y_c, 5, (0, 255, 255))
+                                annotations.add_path(
+                                    self.trajectory_buffer.points(), (0, 255, 255), 2)
+                                annotations.add_rects(bbox, (255, 0, 0), 1)
+                                frame_objects.append(
+                                    objects_array(KIND_TRACK, bbox))
+                                self.signals.track_velocity.emit(
+                                    self.trajectory_buffer.velocity())
                             else:
                                 self.current_mode = self.DetectionMode.DEFAULT
                                 self.mode_state = self.ModeState.DEFAULT
@@ -113,76 +174,132 @@ class CaptureThread(QThread):
                 s_max = self.slider_info['S max']
                 v_min = self.slider_info['V min']
                 v_max = self.slider_info['V max']
+                self.hsv_segmenter.analysis_scale = self.slider_info.get(
+                    'Analysis scale %', 50) / 100 * level.analysis_scale
+                self.hsv_segmenter.blur_ksize = level.blur_ksize
 
+                mask = None
                 if self.mode_state == self.ModeState.DEFAULT:
-                    hsv = cv.cvtColor(frame, cv.COLOR_RGB2HSV)
-                    blurred_frame = cv.medianBlur(hsv, ksize=7)
-                    mask = cv.inRange(
-                        blurred_frame, (h_min, s_min, v_min), (h_max, s_max, v_max))
-                    frame = cv.hconcat(
-                        [frame, cv.cvtColor(mask, cv.COLOR_GRAY2RGB)])
+                    if process_frame:
+                        mask = self.hsv_segmenter.segment(
+                            frame, (h_min, s_min, v_min), (h_max, s_max, v_max))
                 elif self.mode_state == self.ModeState.INIT:
                     self.mode_state = self.ModeState.STREAM
+                    last_rect = None
                 elif self.mode_state == self.ModeState.STREAM:
-                    hsv = cv.cvtColor(frame, cv.COLOR_RGB2HSV)
-                    blurred_frame = cv.medianBlur(hsv, ksize=7)
-                    mask = cv.inRange(
-                        blurred_frame, (h_min, s_min, v_min), (h_max, s_max, v_max))
-                    mask = segmentor.apply(mask)
-                    frame = cv.hconcat(
-                        [frame, cv.cvtColor(mask, cv.COLOR_GRAY2RGB)])
-                    contours, _ = cv.findContours(
-                        mask, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-                    sorted_contours = sorted(
-                        contours, key=cv.contourArea, reverse=True)
-                    has_motion = len(sorted_contours) > 0
-                    if has_motion:
-                        rect = cv.boundingRect(sorted_contours[0])
-                        cv.rectangle(frame, rect, (255, 0, 0), 1)
+                    if process_frame:
+                        last_rect, mask = find_motion_rect(
+                            self.hsv_segmenter, segmentor, frame,
+                            (h_min, s_min, v_min), (h_max, s_max, v_max))
+                    if last_rect is not None:
+                        annotations.add_rects(last_rect, (255, 0, 0), 1)
+                        frame_objects.append(objects_array(KIND_MOTION, last_rect))
+                # the mask goes to the GUI on its own, at analysis resolution
+                if self.send_mask and mask is not None:
+                    self.signals.captured_mask.emit(mask.copy())
             elif self.current_mode == self.DetectionMode.CONTRAST:
                 brightness_min = self.slider_info['Brightness min']
-                brightness_max = self.slider_info['Brightness min']
+                brightness_max = self.slider_info['Brightness max']
+                min_area = self.slider_info.get('Min blob area', 0)
 
                 if self.mode_state == self.ModeState.DEFAULT:
-                    gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY)
-                    _, thresh = cv.threshold(
-                        gray, brightness_min, brightness_max, cv.THRESH_BINARY)
-                    contours, _ = cv.findContours(
-                        thresh, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-                    has_contours = len(contours) > 0
-                    if has_contours:
-                        for c in contours:
-                            rect = cv.boundingRect(c)
-                            frame = cv.rectangle(frame, rect, (255, 0, 0), 1)
+                    if process_frame or last_blobs is None:
+                        last_blobs = find_bright_blobs(
+                            frame, brightness_min, brightness_max, min_area,
+                            level.analysis_scale)
+                        self.signals.blob_stats.emit(last_blobs)
+                    annotations.add_rects(last_blobs[:, :4], (255, 0, 0), 1)
+                    frame_objects.append(objects_array(KIND_BLOB, last_blobs[:, :4]))
             elif self.current_mode == self.DetectionMode.NEURAL:
                 if self.mode_state == self.ModeState.INIT:
                     if self.model_path != '' and self.classes_path != '':
-                        net = build_model(self.model_path, is_cuda=True)
+                        nets = DetectorNets(self.model_path, is_cuda=True)
+                        self.input_size_controller = InputSizeController(
+                            nets.available() or [INPUT_WIDTH])
                         class_list = load_classes(self.classes_path)
+                        self.objects.clear()
+                        self.motion_gate.reset()
                         self.mode_state = self.ModeState.STREAM
                 elif self.mode_state == self.mode_state.STREAM:
-                    input_img = format_yolov5(frame)
-                    outs = detect(input_img, net)
-                    class_ids, confidences, boxes = wrap_detection(
-                        input_img, outs[0])
-                    for (classid, confidence, box) in zip(class_ids, confidences, boxes):
-                        color = colors[int(classid) % len(colors)]
-                        cv.rectangle(frame, box, color, 2)
-                        cv.rectangle(
-                            frame, (box[0], box[1] - 20), (box[0] + box[2], box[1]), color, -1)
-                        cv.putText(
-                            frame, class_list[classid], (box[0], box[1] - 10), cv.FONT_HERSHEY_SIMPLEX, .5, (0, 0, 0))
-
-            fps = int(1 / (new_frame_time - prev_frame_time))
+                    # the detector runs every K frames, tracks are extrapolated in between
+                    detect_every = self.slider_info.get(
+                        'Detect every N frames', 1) * level.process_every
+                    regions = None
+                    if self.motion_gating:
+                        # the background model has to see every frame, not only detector frames
+                        regions = self.motion_gate.regions(frame)
+                    if self.motion_gating and not regions:
+                        # static scene: nothing new to detect, keep the tracks where they are
+                        pass
+                    elif frame_index % max(1, detect_every) == 0:
+                        # small inputs are cheap, large ones keep small objects detectable
+                        controller = self.input_size_controller
+                        controller.latency_budget_ms = self.slider_info.get(
+                            'Detector budget ms', controller.latency_budget_ms)
+                        controller.max_size = level.max_input_size
+                        size = controller.choose()
+                        net = nets.get(size)
+                        detect_start = time.perf_counter()
+                        regions_area = sum(w * h for (_, _, w, h) in regions or [])
+                        if regions and regions_area < self.regions_area_limit * frame.shape[0] * frame.shape[1]:
+                            class_ids, confidences, boxes = detect_regions(
+                                frame, regions, net, size)
+                        else:
+                            input_img = format_yolov5(frame)
+                            outs = detect(input_img, net, size)
+                            class_ids, confidences, boxes = wrap_detection(
+                                input_img, outs[0], size)
+                        controller.record(
+                            size, (time.perf_counter() - detect_start) * 1000)
+                        controller.observe(boxes, frame.shape)
+                        self.input_size = size
+                        self.objects.update(class_ids, confidences, boxes)
+                        frame_objects.append(objects_array(
+                            KIND_DETECTION, boxes, classes=class_ids, confidences=confidences))
+                    else:
+                        self.objects.predict()
+            stage_start = profiler.lap('mode', stage_start)
+
+            if self.current_mode == self.DetectionMode.NEURAL and self.mode_state == self.ModeState.STREAM:
+                if len(self.objects):
+                    frame_objects.append(objects_array(
+                        KIND_TRACK, self.objects.boxes, self.objects.ids,
+                        self.objects.class_ids, self.objects.confidences))
+                for (track_id, classid, confidence, box) in self.objects.tracks():
+                    color = colors[int(classid) % len(colors)]
+                    annotations.add_rects(box, color, 2)
+                    annotations.add_label(
+                        box, class_list[classid], color, f'#{track_id}')
+            stage_start = profiler.lap('draw', stage_start)
+
+            # smoothed over frames, a single frame delta is too noisy and can be zero
+            if prev_frame_time is not None and new_frame_time > prev_frame_time:
+                instant = 1 / (new_frame_time - prev_frame_time)
+                fps = instant if fps == 0 else \
+                    fps + self.fps_smoothing * (instant - fps)
 
             prev_frame_time = new_frame_time
 
+            result_sink = self.result_sink
+            if result_sink is not None:
+                result_sink.write_frame(
+                    frame_index, frame_timestamp, fps, mean, std, min_max_pi,
+                    np.concatenate(frame_objects) if frame_objects else None)
+            frame_index += 1
+
+            self.signals.annotations.emit(annotations)
             self.signals.captured_frame.emit(frame)
-            self.signals.current_fps.emit(fps)
-            self.signals.mean_pi.emit(mean)
-            self.signals.pi_std.emit(std)
-            self.signals.min_max_pi.emit(min_max_pi)
-            self.signals.update_data.emit()
+            self.signals.current_fps.emit(round(fps))
+            if refresh_stats:
+                self.signals.mean_pi.emit(mean)
+                self.signals.pi_std.emit(std)
+                self.signals.min_max_pi.emit(min_max_pi)
+                self.signals.update_data.emit()
+            stage_start = profiler.lap('emit', stage_start)
+
+            # the wait for the next camera frame is not part of the budget
+            if governor.record((stage_start - process_start) / 1e6) or frame_index % 30 == 0:
+                self.signals.quality_changed.emit(governor.describe())
 
         cap.release()
         cv.destroyAllWindows()
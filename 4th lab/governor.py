@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+QualityLevel = namedtuple(
+    'QualityLevel',
+    ['analysis_scale', 'process_every', 'blur_ksize', 'max_input_size', 'stats_every'])
+
+# level 0 is full quality, every next one is cheaper
+LEVELS = (
+    QualityLevel(1.0, 1, 7, 640, 1),
+    QualityLevel(0.75, 1, 5, 640, 2),
+    QualityLevel(0.5, 1, 5, 512, 3),
+    QualityLevel(0.5, 2, 3, 416, 5),
+    QualityLevel(0.35, 3, 3, 320, 10),
+)
+
+
+class QualityGovernor:
+    def __init__(self, target_fps=25.0, levels=LEVELS, smoothing=0.1,
+                 recover_ratio=0.6, hold_frames=30, recover_frames=90):
+        self.target_fps = target_fps
+        self.levels = levels
+        self.smoothing = smoothing
+        # a level is only given back once frames are well under the budget,
+        # otherwise it would flip between two levels every hold_frames
+        self.recover_ratio = recover_ratio
+        self.hold_frames = hold_frames
+        self.recover_frames = recover_frames
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        self.level = 0
+        self.frame_ms = 0.0
+        self.__since_change = 0
+        self.__under_budget = 0
+
+    @property
+    def budget_ms(self):
+        return 1000 / max(self.target_fps, 1)
+
+    @property
+    def settings(self):
+        return self.levels[self.level if self.enabled else 0]
+
+    def record(self, frame_ms: float):
+        # processing time of one frame, without the wait for the camera;
+        # returns True when the level changed
+        self.frame_ms = frame_ms if self.frame_ms == 0 else \
+            self.frame_ms + self.smoothing * (frame_ms - self.frame_ms)
+        if not self.enabled:
+            return False
+        self.__since_change += 1
+        if self.frame_ms < self.budget_ms * self.recover_ratio:
+            self.__under_budget += 1
+        else:
+            self.__under_budget = 0
+
+        if self.__since_change < self.hold_frames:
+            return False
+        if self.frame_ms > self.budget_ms and self.level < len(self.levels) - 1:
+            return self.__set_level(self.level + 1)
+        if self.__under_budget >= self.recover_frames and self.level > 0:
+            return self.__set_level(self.level - 1)
+        return False
+
+    def describe(self):
+        level = self.settings
+        every = 'every frame' if level.process_every == 1 else f'every {level.process_every} frames'
+        return (f'Quality: {self.level if self.enabled else 0}/{len(self.levels) - 1} '
+                f'({self.frame_ms:.1f} / {self.budget_ms:.1f} ms)\n'
+                f'scale {level.analysis_scale:.0%}, {every}, blur {level.blur_ksize}, '
+                f'input <= {level.max_input_size}, stats every {level.stats_every}')
+
+    def __set_level(self, level: int):
+        self.level = level
+        self.__since_change = 0
+        self.__under_budget = 0
+        return True
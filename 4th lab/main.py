@@ -6,11 +6,15 @@ from pathlib import Path
 
 from PyQt6.QtCore import (QSize, Qt, QRectF)
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QGraphicsView,
-                             QLabel, QGridLayout, QWidget, QPushButton, QVBoxLayout, QFormLayout, QSlider, QFileDialog)
-from PyQt6.QtGui import (QAction, QPixmap, QImage)
+                             QLabel, QGridLayout, QWidget, QPushButton, QVBoxLayout, QFormLayout, QSlider, QFileDialog,
+                             QComboBox, QCheckBox, QGraphicsSimpleTextItem)
+from PyQt6.QtGui import (QAction, QActionGroup, QPixmap, QImage, QFont, QColor)
 
 from cap import CaptureThread
 from graphicsScene import GraphicsScene
+from trackers import available_trackers
+from result_sink import ResultSink
+from overlay import OverlayLayer
 
 
 class MainWindow(QMainWindow):
@@ -51,11 +55,28 @@ class MainWindow(QMainWindow):
         self.image_scene.signals.send_release_pos.connect(
             self.__update_release_pos)
         self.image_view = QGraphicsView(self.image_scene)
+        # the frame, the annotations and the profiler overlay are items that
+        # live as long as the scene, only their contents change per frame
+        self.frame_item = self.image_scene.addPixmap(QPixmap())
+        self.overlay_layer = OverlayLayer(self.image_scene)
+        self.annotations = None
+        self.profile_item = self.image_scene.addRect(
+            QRectF(), QColor(0, 0, 0, 0), QColor(0, 0, 0, 160))
+        self.profile_item.setPos(4, 4)
+        self.profile_item.setZValue(2)
+        self.profile_item.setVisible(False)
+        self.profile_text = QGraphicsSimpleTextItem(self.profile_item)
+        self.profile_text.setFont(QFont('monospace', 8))
+        self.profile_text.setBrush(QColor(255, 255, 0))
 
         self.fps_l = QLabel('FPS')
         self.mean_pi_l = QLabel('Mean Pixel Intensity')
         self.pi_std_l = QLabel('Pixel Intensity STD')
         self.min_max_pi_l = QLabel('Min / Max Pixel Intensity')
+        self.track_speed_l = QLabel('Track Speed')
+        self.blobs_l = QLabel('Blobs')
+        self.quality_l = QLabel('Quality')
+        self.mask_l = QLabel()
         # self.coords_bright_l = QLabel('Coords and Pixel Brightness')
 
         self.info_layout = QFormLayout()
@@ -63,8 +84,14 @@ class MainWindow(QMainWindow):
         self.info_layout.addWidget(self.mean_pi_l)
         self.info_layout.addWidget(self.pi_std_l)
         self.info_layout.addWidget(self.min_max_pi_l)
+        self.info_layout.addWidget(self.track_speed_l)
+        self.info_layout.addWidget(self.blobs_l)
+        self.info_layout.addWidget(self.quality_l)
+        self.info_layout.addWidget(self.mask_l)
         # self.info_layout.addWidget(self.coords_bright_l)
 
+        self.fixed_info_rows = self.info_layout.rowCount()
+
         self.main_layout.addWidget(self.image_view, 0, 0)
         self.main_layout.addLayout(self.info_layout, 0, 1, 1, 3)
 
@@ -91,11 +118,47 @@ class MainWindow(QMainWindow):
                    neural_net_act]
         self.actions_tool_bar.addActions(actions)
 
+        self.profiling_menu = self.menu_bar.addMenu('&Profiling')
+        self.overlay_act = QAction('Performance &Overlay', self)
+        self.overlay_act.setCheckable(True)
+        save_profile_act = QAction('&Save Profile...', self)
+        save_profile_act.triggered.connect(self.__save_profile)
+        reset_profile_act = QAction('&Reset Profile', self)
+        reset_profile_act.triggered.connect(self.__reset_profile)
+        self.profiling_menu.addActions(
+            [self.overlay_act, save_profile_act, reset_profile_act])
+
+        self.results_menu = self.menu_bar.addMenu('&Results')
+        self.export_act = QAction('&Export Results...', self)
+        self.export_act.setCheckable(True)
+        self.export_act.toggled.connect(self.__export_toggled)
+        self.results_menu.addAction(self.export_act)
+
+        self.quality_menu = self.menu_bar.addMenu('&Quality')
+        self.auto_quality_act = QAction('&Auto Quality', self)
+        self.auto_quality_act.setCheckable(True)
+        self.auto_quality_act.setChecked(True)
+        self.auto_quality_act.toggled.connect(self.__auto_quality_toggled)
+        self.quality_menu.addAction(self.auto_quality_act)
+        self.quality_menu.addSeparator()
+        target_fps_group = QActionGroup(self)
+        for target_fps in (15, 25, 30, 60):
+            target_fps_act = QAction(f'Target {target_fps} FPS', self)
+            target_fps_act.setCheckable(True)
+            target_fps_act.setChecked(target_fps == 25)
+            target_fps_act.triggered.connect(
+                partial(self.__target_fps_changed, target_fps))
+            target_fps_group.addAction(target_fps_act)
+            self.quality_menu.addAction(target_fps_act)
+
     def __init_params(self):
         self.fps = None
         self.mpi = None
         self.pi_std = None
         self.min_max_pi = None
+        self.track_velocity = None
+        self.blob_stats = None
+        self.input_size_l = None
         self.coords_bright = None
 
         self.click_pos = None
@@ -104,12 +167,15 @@ class MainWindow(QMainWindow):
         self.bbox_status = self.SelectState.NO_SELECTED_POINTS
 
         self.slider_info = dict()
+        self.result_sink = None
 
     def __turn_on_camera(self):
         if self.capturer is not None:
             self.capturer.video_capture = False
             self.capturer.signals.captured_frame.disconnect(
                 self.__update_frame)
+            self.capturer.signals.annotations.disconnect(
+                self.__update_annotations)
             self.capturer.signals.current_fps.disconnect(
                 self.__update_fps
             )
@@ -117,19 +183,35 @@ class MainWindow(QMainWindow):
             self.capturer.signals.pi_std.disconnect(self.__update_pi_std)
             self.capturer.signals.min_max_pi.disconnect(
                 self.__update_min_max_pi)
+            self.capturer.signals.track_velocity.disconnect(
+                self.__update_track_velocity)
+            self.capturer.signals.captured_mask.disconnect(self.__update_mask)
+            self.capturer.signals.blob_stats.disconnect(self.__update_blob_stats)
             self.capturer.signals.update_data.disconnect(self.__update_data)
+            self.capturer.signals.quality_changed.disconnect(
+                self.quality_l.setText)
         else:
             camera_id = 0
             self.capturer = CaptureThread(camera_id)
             self.capturer.signals.captured_frame.connect(self.__update_frame)
+            self.capturer.signals.annotations.connect(
+                self.__update_annotations)
             self.capturer.signals.current_fps.connect(self.__update_fps)
             self.capturer.signals.mean_pi.connect(self.__update_mean_pi)
             self.capturer.signals.pi_std.connect(self.__update_pi_std)
             self.capturer.signals.min_max_pi.connect(self.__update_min_max_pi)
+            self.capturer.signals.track_velocity.connect(
+                self.__update_track_velocity)
+            self.capturer.signals.captured_mask.connect(self.__update_mask)
+            self.capturer.signals.blob_stats.connect(self.__update_blob_stats)
             self.capturer.signals.update_data.connect(self.__update_data)
+            self.capturer.signals.quality_changed.connect(
+                self.quality_l.setText)
             self.capturer.start()
 
     def __update_frame(self, frame: np.ndarray):
+        profiler = self.capturer.profiler
+        start = profiler.now()
         height, width, _ = frame.shape
         bytes_per_line = 3 * width
         image = QImage(frame,
@@ -138,11 +220,33 @@ class MainWindow(QMainWindow):
                        bytes_per_line,
                        QImage.Format.Format_RGB888)
         pixmap = QPixmap.fromImage(image)
-        self.image_scene.clear()
         self.image_view.resetTransform()
-        self.image_scene.addPixmap(pixmap)
-        self.image_scene.update()
+        self.frame_item.setPixmap(pixmap)
+        if self.annotations is not None:
+            self.overlay_layer.show(self.annotations)
+            self.annotations = None
+        if self.overlay_act.isChecked():
+            self.profile_text.setText(profiler.overlay_text())
+            self.profile_item.setRect(
+                self.profile_text.boundingRect().adjusted(-2, -2, 2, 2))
+        self.profile_item.setVisible(self.overlay_act.isChecked())
         self.image_view.setSceneRect(QRectF(pixmap.rect()))
+        profiler.lap('render', start)
+
+    def __update_annotations(self, annotations):
+        self.annotations = annotations
+
+    def __update_mask(self, mask: np.ndarray):
+        if self.capturer.current_mode != self.capturer.DetectionMode.MOTION:
+            return
+        height, width = mask.shape
+        image = QImage(mask, width, height, width,
+                       QImage.Format.Format_Grayscale8)
+        self.mask_l.setPixmap(QPixmap.fromImage(image).scaledToWidth(
+            240, Qt.TransformationMode.FastTransformation))
+
+    def __update_blob_stats(self, blobs: np.ndarray):
+        self.blob_stats = blobs
 
     def __update_fps(self, fps: float):
         self.fps = fps
@@ -156,9 +260,13 @@ class MainWindow(QMainWindow):
     def __update_min_max_pi(self, min_max_pi):
         self.min_max_pi = min_max_pi
 
+    def __update_track_velocity(self, velocity: np.ndarray):
+        self.track_velocity = velocity
+
     def __mouse_in_view(self, click_pos: tuple):
-        scene_width = self.image_scene.sceneRect().width()
-        scene_height = self.image_scene.sceneRect().height()
+        # the frame, not the scene: labels and boxes past the edges make the scene larger
+        scene_width = self.frame_item.boundingRect().width()
+        scene_height = self.frame_item.boundingRect().height()
         if click_pos[0] < 0 or click_pos[1] < 0:
             return False
         elif click_pos[0] > scene_width or click_pos[1] > scene_height:
@@ -198,6 +306,9 @@ class MainWindow(QMainWindow):
             self.bbox_status = self.SelectState.TWO_POINTS_ARE_SELECTED
 
     def __update_data(self):
+        if self.result_sink is not None and self.result_sink.error is not None:
+            # unchecking closes the sink and shows the error
+            self.export_act.setChecked(False)
         self.fps_l.setText(f'FPS: {self.fps}')
         self.mean_pi_l.setText(
             f'Mean Pixel Intensity:\n{np.round(self.mpi, 2).flatten()}')
@@ -205,6 +316,18 @@ class MainWindow(QMainWindow):
             f'Pixel Intensity STD:\n{np.round(self.pi_std, 2).flatten()}')
         self.min_max_pi_l.setText(
             f'Min / Max Pixel Intensity:\n{self.min_max_pi}')
+        if self.track_velocity is not None:
+            self.track_speed_l.setText(
+                f'Track Speed: {np.hypot(*self.track_velocity):.1f} px/s\n'
+                f'Velocity: {np.round(self.track_velocity, 1)}')
+        if self.blob_stats is not None:
+            areas = self.blob_stats[:, 4]
+            largest = int(areas.max()) if len(areas) else 0
+            self.blobs_l.setText(
+                f'Blobs: {len(areas)}\nTotal / Largest Area: {int(areas.sum())} / {largest}')
+        if self.input_size_l is not None:
+            self.input_size_l.setText(
+                f'Detector input: {self.capturer.input_size} px')
         # self.coords_bright_l.setText(
         #     f'Coords and Pixel Brightness:\n{self.coords_bright}')
 
@@ -215,6 +338,16 @@ class MainWindow(QMainWindow):
         self.bbox_status = self.SelectState.SELECTING_POINTS
         self.__clear_sliders()
 
+        tracker_box = QComboBox()
+        tracker_box.addItems(available_trackers())
+        tracker_box.setCurrentText(self.capturer.tracker_name)
+        tracker_box.currentTextChanged.connect(self.__tracker_changed)
+        scale_slider = self.__create_custom_slider(
+            'Tracking scale %', 25, 100, 150, 50)
+
+        self.info_layout.addRow(QLabel('Tracker'), tracker_box)
+        self.info_layout.addRow(scale_slider)
+
     def __motion_mode(self):
         self.capturer.bbox = None
         self.capturer.current_mode = self.capturer.current_mode.MOTION
@@ -226,6 +359,11 @@ class MainWindow(QMainWindow):
         s_max_slider = self.__create_custom_slider('S max', 0, 255, 150, 255)
         v_min_slider = self.__create_custom_slider('V min', 0, 255, 150, 0)
         v_max_slider = self.__create_custom_slider('V max', 0, 255, 150, 255)
+        scale_slider = self.__create_custom_slider(
+            'Analysis scale %', 25, 100, 150, 50)
+        mask_box = QCheckBox('Show mask')
+        mask_box.setChecked(self.capturer.send_mask)
+        mask_box.toggled.connect(self.__send_mask_changed)
         btn = QPushButton('Применить')
         btn.clicked.connect(self.__apply_det_params)
 
@@ -235,6 +373,8 @@ class MainWindow(QMainWindow):
         self.info_layout.addRow(s_max_slider)
         self.info_layout.addRow(v_min_slider)
         self.info_layout.addRow(v_max_slider)
+        self.info_layout.addRow(scale_slider)
+        self.info_layout.addRow(mask_box)
         self.info_layout.addRow(btn)
 
     def __contrast_mode(self):
@@ -246,9 +386,12 @@ class MainWindow(QMainWindow):
             'Brightness min', 0, 255, 150, 0)
         h_max_slider = self.__create_custom_slider(
             'Brightness max', 0, 255, 150, 255)
+        min_area_slider = self.__create_custom_slider(
+            'Min blob area', 0, 2000, 150, 20)
 
         self.info_layout.addRow(h_min_slider)
         self.info_layout.addRow(h_max_slider)
+        self.info_layout.addRow(min_area_slider)
 
     def __neural_mode(self):
         self.capturer.bbox = None
@@ -266,6 +409,21 @@ class MainWindow(QMainWindow):
         self.info_layout.addRow(input_model_btn)
         self.info_layout.addRow(input_classes_btn)
 
+        detect_every_slider = self.__create_custom_slider(
+            'Detect every N frames', 1, 10, 150, 3)
+        self.info_layout.addRow(detect_every_slider)
+
+        budget_slider = self.__create_custom_slider(
+            'Detector budget ms', 10, 300, 150, 80)
+        self.input_size_l = QLabel('Detector input')
+        self.info_layout.addRow(budget_slider)
+        self.info_layout.addRow(self.input_size_l)
+
+        motion_gating_box = QCheckBox('Detect only moving regions')
+        motion_gating_box.setChecked(self.capturer.motion_gating)
+        motion_gating_box.toggled.connect(self.__motion_gating_changed)
+        self.info_layout.addRow(motion_gating_box)
+
     def __onInputModelClick(self):
         home_dir = str(Path.home())
         fname = QFileDialog.getOpenFileName(self, 'Open file', home_dir)
@@ -277,8 +435,12 @@ class MainWindow(QMainWindow):
         self.capturer.classes_path = fname[0]
 
     def __clear_sliders(self):
-        count = self.info_layout.count()
-        for i in reversed(range(5, count)):
+        self.mask_l.clear()
+        self.blob_stats = None
+        self.blobs_l.setText('Blobs')
+        self.input_size_l = None
+        count = self.info_layout.rowCount()
+        for i in reversed(range(self.fixed_info_rows, count)):
             self.info_layout.removeRow(i)
 
     def __create_custom_slider(self, label, min_val, max_val, max_width, first_val):
@@ -302,6 +464,92 @@ class MainWindow(QMainWindow):
         self.slider_info[name] = val
         self.capturer.slider_info = self.slider_info
 
+    def __send_mask_changed(self, checked: bool):
+        self.capturer.send_mask = checked
+        if not checked:
+            self.mask_l.clear()
+
+    def __motion_gating_changed(self, checked: bool):
+        self.capturer.motion_gating = checked
+
+    def __tracker_changed(self, name: str):
+        self.capturer.tracker_name = name
+
+    def __auto_quality_toggled(self, checked: bool):
+        if self.capturer is None:
+            return
+        self.capturer.governor.enabled = checked
+        self.capturer.governor.reset()
+        self.quality_l.setText(self.capturer.governor.describe())
+
+    def __target_fps_changed(self, target_fps: int):
+        if self.capturer is None:
+            return
+        # start from full quality again, the governor degrades as needed
+        self.capturer.governor.target_fps = target_fps
+        self.capturer.governor.reset()
+        self.quality_l.setText(self.capturer.governor.describe())
+
+    def __save_profile(self):
+        if self.capturer is None:
+            return
+        fname, selected = QFileDialog.getSaveFileName(
+            self, 'Save Profile', str(Path.home() / 'profile.json'),
+            'Stage summary (*.json);;Chrome trace (*.json)')
+        if fname == '':
+            return
+        if selected.startswith('Chrome'):
+            self.capturer.profiler.dump_chrome_trace(fname)
+        else:
+            self.capturer.profiler.dump_json(fname)
+
+    def closeEvent(self, event):
+        # the capturer goes first so nothing writes to the sink while it is flushed
+        if self.capturer is not None:
+            self.capturer.result_sink = None
+            self.capturer.video_capture = False
+            self.capturer.wait()
+        self.__close_result_sink()
+        super().closeEvent(event)
+
+    def __close_result_sink(self):
+        if self.result_sink is None:
+            return
+        if self.capturer is not None:
+            self.capturer.result_sink = None
+        self.result_sink.close()
+        if self.result_sink.error is not None:
+            self.main_status_label.setText(
+                f'Export failed after {self.result_sink.written} frames: {self.result_sink.error}')
+        else:
+            self.main_status_label.setText(
+                f'{self.result_sink.written} frames exported, {self.result_sink.dropped} dropped')
+        self.result_sink = None
+
+    def __export_toggled(self, checked: bool):
+        if not checked:
+            self.__close_result_sink()
+            return
+        fname, selected = QFileDialog.getSaveFileName(
+            self, 'Export Results', str(Path.home() / 'results'),
+            'JSON Lines (*.jsonl);;CSV (*.csv);;Columnar (*.parquet *.npz)')
+        if fname == '' or self.capturer is None:
+            self.export_act.setChecked(False)
+            return
+        if selected.startswith('JSON'):
+            fmt = 'jsonl'
+        elif selected.startswith('CSV'):
+            fmt = 'csv'
+        else:
+            fmt = 'columnar'
+        self.result_sink = ResultSink(fname, fmt)
+        self.capturer.result_sink = self.result_sink
+        self.main_status_label.setText(f'Exporting results to {self.result_sink.path}')
+
+    def __reset_profile(self):
+        if self.capturer is not None:
+            self.capturer.profiler.reset()
+
     def __apply_det_params(self):
         self.capturer.mode_state = self.capturer.ModeState.INIT
 
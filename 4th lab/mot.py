@@ -0,0 +1,153 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def iou_matrix(a, b):
+    a = np.asarray(a, np.float64).reshape(-1, 4)
+    b = np.asarray(b, np.float64).reshape(-1, 4)
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    y1 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def linear_assignment(cost):
+    cost = np.asarray(cost, np.float64)
+    if cost.size == 0:
+        return np.empty((0, 2), int)
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(cost)
+        return np.stack([rows, cols], axis=1)
+
+    # Hungarian method with potentials, the inner scan over columns is vectorized
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, int)
+    way = np.zeros(m + 1, int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            used_cols = np.nonzero(used)[0]
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[1:][cols] - 1
+    pairs = np.stack([cols, rows] if transposed else [rows, cols], axis=1)
+    return pairs[np.argsort(pairs[:, 0])]
+
+
+class MultiObjectTracker:
+    def __init__(self, iou_threshold=0.3, max_misses=3, smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.smoothing = smoothing
+        self.__next_id = 1
+        self.clear()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def clear(self):
+        self.ids = np.zeros(0, int)
+        self.class_ids = np.zeros(0, int)
+        self.confidences = np.zeros(0)
+        self.boxes = np.zeros((0, 4))
+        self.velocities = np.zeros((0, 2))
+        self.anchors = np.zeros((0, 2))
+        self.since_update = np.zeros(0, int)
+        self.misses = np.zeros(0, int)
+
+    def predict(self):
+        # constant velocity between detector runs
+        self.boxes[:, :2] += self.velocities
+        self.since_update += 1
+
+    def update(self, class_ids, confidences, boxes):
+        self.predict()
+        det_boxes = np.asarray(boxes, np.float64).reshape(-1, 4)
+        det_classes = np.asarray(class_ids, int).reshape(-1)
+        det_conf = np.asarray(confidences, np.float64).reshape(-1)
+
+        iou = iou_matrix(self.boxes, det_boxes)
+        iou[self.class_ids[:, None] != det_classes[None, :]] = 0
+        pairs = linear_assignment(1 - iou)
+        if len(pairs):
+            pairs = pairs[iou[pairs[:, 0], pairs[:, 1]] >= self.iou_threshold]
+        t, d = pairs[:, 0], pairs[:, 1]
+
+        observed = (det_boxes[d, :2] - self.anchors[t]) / self.since_update[t, None]
+        self.velocities[t] = self.smoothing * observed + \
+            (1 - self.smoothing) * self.velocities[t]
+        self.boxes[t] = det_boxes[d]
+        self.anchors[t] = det_boxes[d, :2]
+        self.confidences[t] = det_conf[d]
+        self.since_update[t] = 0
+        self.misses[t] = 0
+
+        unmatched = np.ones(len(self.ids), bool)
+        unmatched[t] = False
+        self.misses[unmatched] += 1
+        self.__keep(self.misses <= self.max_misses)
+
+        new = np.ones(len(det_boxes), bool)
+        new[d] = False
+        self.__add(det_classes[new], det_conf[new], det_boxes[new])
+
+    def tracks(self):
+        boxes = np.round(self.boxes).astype(int)
+        return list(zip(self.ids, self.class_ids, self.confidences, boxes))
+
+    def __keep(self, mask):
+        self.ids = self.ids[mask]
+        self.class_ids = self.class_ids[mask]
+        self.confidences = self.confidences[mask]
+        self.boxes = self.boxes[mask]
+        self.velocities = self.velocities[mask]
+        self.anchors = self.anchors[mask]
+        self.since_update = self.since_update[mask]
+        self.misses = self.misses[mask]
+
+    def __add(self, class_ids, confidences, boxes):
+        n = len(boxes)
+        self.ids = np.concatenate([self.ids, np.arange(self.__next_id, self.__next_id + n)])
+        self.__next_id += n
+        self.class_ids = np.concatenate([self.class_ids, class_ids])
+        self.confidences = np.concatenate([self.confidences, confidences])
+        self.boxes = np.concatenate([self.boxes, boxes])
+        self.velocities = np.concatenate([self.velocities, np.zeros((n, 2))])
+        self.anchors = np.concatenate([self.anchors, boxes[:, :2]])
+        self.since_update = np.concatenate([self.since_update, np.zeros(n, int)])
+        self.misses = np.concatenate([self.misses, np.zeros(n, int)])
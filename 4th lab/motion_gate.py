@@ -0,0 +1,45 @@
+import cv2 as cv
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, analysis_width=160, min_area_ratio=0.002, padding=0.25, max_regions=4):
+        self.analysis_width = analysis_width
+        self.min_area_ratio = min_area_ratio
+        self.padding = padding
+        self.max_regions = max_regions
+        self.segmentor = cv.createBackgroundSubtractorMOG2(200, 16, False)
+        self.kernel = cv.getStructuringElement(cv.MORPH_RECT, (3, 3))
+
+    def reset(self):
+        self.segmentor = cv.createBackgroundSubtractorMOG2(200, 16, False)
+
+    def regions(self, frame: np.ndarray):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.analysis_width / width)
+        small = cv.resize(frame, None, fx=scale, fy=scale,
+                          interpolation=cv.INTER_AREA)
+        mask = self.segmentor.apply(small)
+        mask = cv.morphologyEx(mask, cv.MORPH_OPEN, self.kernel)
+        # grow blobs so parts of one moving object end up in one region
+        mask = cv.dilate(mask, self.kernel, iterations=3)
+
+        count, _, stats, _ = cv.connectedComponentsWithStats(mask)
+        stats = stats[1:count]
+        min_area = self.min_area_ratio * mask.shape[0] * mask.shape[1]
+        stats = stats[stats[:, cv.CC_STAT_AREA] >= min_area]
+        if len(stats) == 0:
+            return []
+
+        boxes = stats[:, :4].astype(np.float64) / scale
+        if len(boxes) > self.max_regions:
+            # too many blobs to be worth cropping, take their union
+            x0, y0 = boxes[:, :2].min(axis=0)
+            x1, y1 = (boxes[:, :2] + boxes[:, 2:]).max(axis=0)
+            boxes = np.array([[x0, y0, x1 - x0, y1 - y0]])
+
+        pad = boxes[:, 2:] * self.padding
+        x0y0 = np.clip(boxes[:, :2] - pad, 0, None)
+        x1y1 = np.minimum(boxes[:, :2] + boxes[:, 2:] + pad, (width, height))
+        return [tuple(int(v) for v in (*p0, *(p1 - p0)))
+                for p0, p1 in zip(x0y0, x1y1)]
@@ -1,8 +1,13 @@
+import os
+from collections import deque
+
 import cv2 as cv
 import numpy as np
 
 INPUT_WIDTH = 640
 INPUT_HEIGHT = 640
+# multiples of the 32 px stride of YOLOv5
+INPUT_SIZES = (320, 416, 512, 640)
 
 def build_model(model_path, is_cuda):
     net = cv.dnn.readNet(model_path)
@@ -21,13 +26,27 @@ def format_yolov5(frame):
     result[0:row, 0:col] = frame
     return result
 
-def detect(image, net):
-    blob = cv.dnn.blobFromImage(image, 1/255.0, (INPUT_WIDTH, INPUT_HEIGHT), swapRB=True, crop=False)
+def detect(image, net, size=INPUT_WIDTH):
+    blob = cv.dnn.blobFromImage(image, 1/255.0, (size, size), swapRB=True, crop=False)
     net.setInput(blob)
     preds = net.forward()
     return preds
 
-def wrap_detection(input_image, output_data):
+# nets whose batched forward failed once, they are not tried with a batch again
+_single_batch_nets = set()
+
+def detect_batch(images, net, size=INPUT_WIDTH):
+    if net not in _single_batch_nets:
+        blob = cv.dnn.blobFromImages(images, 1/255.0, (size, size), swapRB=True, crop=False)
+        net.setInput(blob)
+        try:
+            return net.forward()
+        except cv.error:
+            # models exported with a fixed batch size of one
+            _single_batch_nets.add(net)
+    return np.concatenate([detect(image, net, size) for image in images])
+
+def wrap_detection(input_image, output_data, size=INPUT_WIDTH):
     class_ids = []
     confidences = []
     boxes = []
@@ -36,8 +55,9 @@ def wrap_detection(input_image, output_data):
 
     image_width, image_height, _ = input_image.shape
 
-    x_factor = image_width / INPUT_WIDTH
-    y_factor =  image_height / INPUT_HEIGHT
+    # boxes come out in the coordinates of the size the network actually ran at
+    x_factor = image_width / size
+    y_factor =  image_height / size
 
     for r in range(rows):
         row = output_data[r]
@@ -45,8 +65,7 @@ def wrap_detection(input_image, output_data):
         if confidence >= 0.4:
 
             classes_scores = row[5:]
-            _, _, _, max_indx = cv.minMaxLoc(classes_scores)
-            class_id = max_indx[1]
+            class_id = int(np.argmax(classes_scores))
             if (classes_scores[class_id] > .25):
 
                 confidences.append(confidence)
@@ -74,8 +93,110 @@ def wrap_detection(input_image, output_data):
 
     return result_class_ids, result_confidences, result_boxes
 
+def detect_regions(frame, regions, net, size=INPUT_WIDTH):
+    inputs = [format_yolov5(frame[y:y + h, x:x + w]) for (x, y, w, h) in regions]
+    outs = detect_batch(inputs, net, size)
+
+    class_ids = []
+    confidences = []
+    boxes = []
+    for (x, y, _, _), input_img, output_data in zip(regions, inputs, outs):
+        region_class_ids, region_confidences, region_boxes = wrap_detection(
+            input_img, output_data, size)
+        class_ids += region_class_ids
+        confidences += region_confidences
+        boxes += [box + np.array([x, y, 0, 0]) for box in region_boxes]
+
+    # regions may overlap, so the same object can come back twice
+    indexes = cv.dnn.NMSBoxes(boxes, confidences, 0.25, 0.45)
+    return ([class_ids[i] for i in indexes],
+            [confidences[i] for i in indexes],
+            [boxes[i] for i in indexes])
+
 def load_classes(classes_path):
     class_list = []
     with open(classes_path, "r") as f:
         class_list = [cname.strip() for cname in f.readlines()]
-    return class_list
\ No newline at end of file
+    return class_list
+
+class DetectorNets:
+    # one network per input size: a sibling <stem>_<size>.onnx when there is one,
+    # otherwise the main model, if it was exported with a dynamic input shape
+    def __init__(self, model_path, is_cuda, sizes=INPUT_SIZES):
+        self.model_path = model_path
+        self.is_cuda = is_cuda
+        self.sizes = tuple(sizes)
+        self.__nets = {}
+        self.__shared = None
+
+    def get(self, size):
+        if size in self.__nets:
+            return self.__nets[size]
+        stem, ext = os.path.splitext(self.model_path)
+        sibling = f'{stem}_{size}{ext}'
+        if os.path.exists(sibling):
+            net = build_model(sibling, self.is_cuda)
+        else:
+            if self.__shared is None:
+                self.__shared = build_model(self.model_path, self.is_cuda)
+            net = self.__shared
+            if size != INPUT_WIDTH:
+                try:
+                    detect(np.zeros((size, size, 3), np.uint8), net, size)
+                except cv.error:
+                    # fixed 640x640 export, this size is not available
+                    net = None
+        self.__nets[size] = net
+        return net
+
+    def available(self):
+        return [size for size in self.sizes if self.get(size) is not None]
+
+class InputSizeController:
+    def __init__(self, sizes=INPUT_SIZES, latency_budget_ms=80.0, min_object_px=24,
+                 history=15, smoothing=0.2):
+        self.sizes = sorted(sizes)
+        self.latency_budget_ms = latency_budget_ms
+        self.min_object_px = min_object_px
+        self.smoothing = smoothing
+        # upper limit set from outside, e.g. by the quality governor
+        self.max_size = None
+        self.latency_ms = {}
+        # smallest box side relative to the frame, per recent detector run
+        self.__object_sides = deque(maxlen=history)
+
+    def record(self, size, latency_ms):
+        previous = self.latency_ms.get(size)
+        self.latency_ms[size] = latency_ms if previous is None else \
+            previous + self.smoothing * (latency_ms - previous)
+
+    def observe(self, boxes, frame_shape):
+        boxes = np.asarray(boxes, np.float64).reshape(-1, 4)
+        if len(boxes):
+            side = boxes[:, 2:].min(axis=1).min()
+            self.__object_sides.append(side / max(frame_shape[:2]))
+
+    def estimate_ms(self, size):
+        if size in self.latency_ms:
+            return self.latency_ms[size]
+        if not self.latency_ms:
+            return 0.0
+        # cost grows with the number of input pixels
+        ref_size, ref_ms = min(self.latency_ms.items(), key=lambda item: abs(item[0] - size))
+        return ref_ms * (size / ref_size) ** 2
+
+    def choose(self):
+        sizes = [s for s in self.sizes if self.max_size is None or s <= self.max_size] \
+            or self.sizes[:1]
+        affordable = [s for s in sizes if self.estimate_ms(s) <= self.latency_budget_ms]
+        if not affordable:
+            return sizes[0]
+        if not self.__object_sides:
+            # nothing seen yet, look as closely as the budget allows
+            return affordable[-1]
+        # the smallest size at which the smallest recent object still covers min_object_px
+        smallest = min(self.__object_sides)
+        for size in affordable:
+            if smallest * size >= self.min_object_px:
+                return size
+        return affordable[-1]
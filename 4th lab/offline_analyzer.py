@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2 as cv
+
+from nn_utils import build_model, format_yolov5, detect, wrap_detection
+from result_sink import objects_array, object_rows, KIND_DETECTION
+
+_net = None
+
+
+def fourcc_name(code: float):
+    code = int(code)
+    return ''.join(chr((code >> (8 * i)) & 0xff) for i in range(4))
+
+
+def plan_chunks(video: str, chunk_frames: int):
+    cap = cv.VideoCapture(video)
+    frame_count = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv.CAP_PROP_FPS) or 30.0
+    codec = fourcc_name(cap.get(cv.CAP_PROP_FOURCC))
+    cap.release()
+    if frame_count <= 0:
+        return [], fps
+    if codec.upper() != 'MJPG':
+        # only intra-only codecs can be cut at any frame, other videos go to one worker whole
+        return [(0, frame_count)], fps
+    return [(start, min(start + chunk_frames, frame_count))
+            for start in range(0, frame_count, chunk_frames)], fps
+
+
+def output_stem(video: str):
+    # videos with the same name in different folders must not share checkpoints
+    stem = os.path.splitext(os.path.basename(video))[0]
+    digest = hashlib.sha1(os.path.abspath(video).encode()).hexdigest()[:8]
+    return f'{stem}-{digest}'
+
+
+def chunk_path(out_dir: str, video: str, start: int, end: int):
+    return os.path.join(out_dir, f'{output_stem(video)}.{start:08d}-{end:08d}.part.jsonl')
+
+
+def merged_path(out_dir: str, video: str):
+    return os.path.join(out_dir, f'{output_stem(video)}.detections.jsonl')
+
+
+def _init_worker(model_path: str, is_cuda: bool):
+    global _net
+    # one network per process, and no OpenCV thread pool fighting the other workers
+    cv.setNumThreads(1)
+    _net = build_model(model_path, is_cuda)
+
+
+def analyze_chunk(video: str, start: int, end: int, fps: float, out_file: str):
+    began = time.perf_counter()
+    cap = cv.VideoCapture(video)
+    cap.set(cv.CAP_PROP_POS_FRAMES, start)
+    lines = []
+    frame_index = start
+    while frame_index < end:
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            break
+        frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+        input_img = format_yolov5(frame)
+        outs = detect(input_img, _net)
+        class_ids, confidences, boxes = wrap_detection(input_img, outs[0])
+        record = {'f': frame_index, 't': round(frame_index / fps, 3)}
+        if boxes:
+            record['obj'] = object_rows(objects_array(
+                KIND_DETECTION, boxes, classes=class_ids, confidences=confidences))
+        lines.append(json.dumps(record, separators=(',', ':')))
+        frame_index += 1
+    cap.release()
+    if frame_index != end:
+        # a short part would be merged as if the rest of its frames had no detections
+        raise ValueError(f'cannot read frame {frame_index} of [{start}, {end})')
+
+    # the part file only appears once complete, so its presence is the checkpoint
+    with open(out_file + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n' if lines else '')
+    os.replace(out_file + '.tmp', out_file)
+    return frame_index - start, time.perf_counter() - began
+
+
+def merge_chunks(out_dir: str, video: str, chunks):
+    target = merged_path(out_dir, video)
+    with open(target + '.tmp', 'w') as out:
+        for start, end in chunks:
+            with open(chunk_path(out_dir, video, start, end)) as part:
+                out.write(part.read())
+    os.replace(target + '.tmp', target)
+    for start, end in chunks:
+        os.remove(chunk_path(out_dir, video, start, end))
+
+
+def analyze(videos, model_path, out_dir, workers=None, chunk_frames=300, is_cuda=False):
+    os.makedirs(out_dir, exist_ok=True)
+    plans = {}
+    jobs = []
+    failed = []
+    for video in videos:
+        if os.path.exists(merged_path(out_dir, video)):
+            print(f'{video}: already analyzed')
+            continue
+        chunks, fps = plan_chunks(video, chunk_frames)
+        if not chunks:
+            # no merged file, so the next run tries again
+            print(f'{video}: failed, cannot open it or it reports no frames')
+            failed.append(video)
+            continue
+        plans[video] = chunks
+        for start, end in chunks:
+            part = chunk_path(out_dir, video, start, end)
+            if not os.path.exists(part):
+                jobs.append((video, start, end, fps, part))
+        done = len(chunks) - sum(1 for job in jobs if job[0] == video)
+        if done:
+            print(f'{video}: resuming, {done} of {len(chunks)} chunks already done')
+
+    remaining = {video: sum(1 for job in jobs if job[0] == video) for video in plans}
+    for video, count in remaining.items():
+        if count == 0:
+            merge_chunks(out_dir, video, plans[video])
+
+    total_frames = 0
+    busy = 0.0
+    began = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(model_path, is_cuda)) as pool:
+            futures = {pool.submit(analyze_chunk, *job): job for job in jobs}
+            for future in as_completed(futures):
+                video, start, end, _, _ = futures[future]
+                try:
+                    frames, seconds = future.result()
+                except Exception as e:
+                    # the other parts of this video still run, so a retry has less to do
+                    print(f'{video} [{start}, {end}): failed, {e}')
+                    if video not in failed:
+                        failed.append(video)
+                    continue
+                total_frames += frames
+                busy += seconds
+                print(f'{video} [{start}, {end}): {frames} frames, {frames / max(seconds, 1e-9):.1f} FPS')
+                remaining[video] -= 1
+                if remaining[video] == 0:
+                    # parts are merged in frame order once the last one of a video is in
+                    merge_chunks(out_dir, video, plans[video])
+
+    elapsed = time.perf_counter() - began
+    return {'frames': total_frames, 'seconds': round(elapsed, 2),
+            'fps': round(total_frames / max(elapsed, 1e-9), 1),
+            'worker_fps': round(total_frames / max(busy, 1e-9), 1), 'failed': failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the NEURAL mode detector over recorded videos on all cores')
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--model', required=True, help='YOLOv5 ONNX model')
+    parser.add_argument('--out', default='analysis',
+                        help='directory for <video>.detections.jsonl and checkpoints')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, one network each (default: all cores)')
+    parser.add_argument('--chunk-frames', type=int, default=300)
+    parser.add_argument('--cuda', action='store_true')
+    args = parser.parse_args()
+
+    report = analyze(args.videos, args.model, args.out,
+                     args.workers, args.chunk_frames, args.cuda)
+    print(f'{report["frames"]} frames in {report["seconds"]} s: {report["fps"]} FPS total, '
+          f'{report["worker_fps"]} FPS per worker')
+    if report['failed']:
+        print(f'{len(report["failed"])} videos failed: {", ".join(report["failed"])}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
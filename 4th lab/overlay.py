@@ -0,0 +1,140 @@
+from collections import OrderedDict
+
+import numpy as np
+from PyQt6.QtCore import QPointF, QRectF
+from PyQt6.QtGui import QColor, QPen, QPainter, QPainterPath, QPixmap, QFont, QFontMetrics
+from PyQt6.QtWidgets import (QGraphicsPathItem, QGraphicsPixmapItem, QGraphicsEllipseItem,
+                             QGraphicsSimpleTextItem)
+
+
+class Annotations:
+    # what to draw over one frame, in frame coordinates; filled by the capture thread
+    def __init__(self):
+        self.rects = []
+        self.labels = []
+        self.paths = []
+        self.points = []
+
+    def __len__(self):
+        return len(self.rects) + len(self.labels) + len(self.paths) + len(self.points)
+
+    def add_rects(self, boxes, color, width=1):
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        if len(boxes):
+            self.rects.append((boxes.astype(np.int32), tuple(color), width))
+
+    def add_label(self, box, text: str, color, tag=''):
+        # sits on top of the box, like the filled cv.putText labels did; text is cached
+        # as a pixmap, so per-object parts like a track id go in tag
+        self.labels.append((int(box[0]), int(box[1]), text, tuple(color), tag))
+
+    def add_path(self, points, color, width=1):
+        if len(points) > 1:
+            self.paths.append((np.array(points, np.float64), tuple(color), width))
+
+    def add_point(self, x, y, radius, color):
+        self.points.append((int(x), int(y), radius, tuple(color)))
+
+
+class OverlayLayer:
+    # draws Annotations with items that are created once and reused every frame
+    def __init__(self, scene, z=1.0, label_cache_size=256):
+        self.scene = scene
+        self.z = z
+        self.font = QFont('sans-serif', 8)
+        self.label_cache_size = label_cache_size
+        self.__pens = {}
+        self.__labels = OrderedDict()
+        self.__path_items = []
+        self.__label_items = []
+        self.__tag_items = []
+        self.__point_items = []
+
+    def show(self, annotations: Annotations):
+        # one path per color and width however many boxes there are
+        paths = {}
+        for boxes, color, width in annotations.rects:
+            path = paths.setdefault((color, width), QPainterPath())
+            for x, y, w, h in boxes.tolist():
+                path.addRect(QRectF(x, y, w, h))
+        for points, color, width in annotations.paths:
+            path = paths.setdefault((color, width), QPainterPath())
+            path.moveTo(QPointF(*points[0]))
+            for x, y in points[1:].tolist():
+                path.lineTo(QPointF(x, y))
+        for i, ((color, width), path) in enumerate(paths.items()):
+            item = self.__item(self.__path_items, i, QGraphicsPathItem)
+            item.setPen(self.__pen(color, width))
+            item.setPath(path)
+        self.__hide(self.__path_items, len(paths))
+
+        tags = 0
+        for i, (x, y, text, color, tag) in enumerate(annotations.labels):
+            item = self.__item(self.__label_items, i, QGraphicsPixmapItem)
+            pixmap = self.__label(text, color)
+            item.setPixmap(pixmap)
+            item.setPos(x, y - pixmap.height())
+            if tag:
+                tag_item = self.__item(self.__tag_items, tags, QGraphicsSimpleTextItem)
+                tag_item.setFont(self.font)
+                tag_item.setBrush(QColor(*color))
+                tag_item.setText(tag)
+                tag_item.setPos(x + pixmap.width() + 2, y - pixmap.height() + 2)
+                tags += 1
+        self.__hide(self.__label_items, len(annotations.labels))
+        self.__hide(self.__tag_items, tags)
+
+        for i, (x, y, radius, color) in enumerate(annotations.points):
+            item = self.__item(self.__point_items, i, QGraphicsEllipseItem)
+            item.setRect(x - radius, y - radius, 2 * radius, 2 * radius)
+            item.setPen(self.__pen(color, 1))
+            item.setBrush(QColor(*color))
+        self.__hide(self.__point_items, len(annotations.points))
+
+    def clear(self):
+        for pool in (self.__path_items, self.__label_items, self.__tag_items, self.__point_items):
+            self.__hide(pool, 0)
+
+    def __item(self, pool, i, item_type):
+        if i < len(pool):
+            item = pool[i]
+        else:
+            item = item_type()
+            item.setZValue(self.z)
+            self.scene.addItem(item)
+            pool.append(item)
+        item.setVisible(True)
+        return item
+
+    @staticmethod
+    def __hide(pool, used):
+        for item in pool[used:]:
+            if not item.isVisible():
+                break
+            item.setVisible(False)
+
+    def __pen(self, color, width):
+        key = (color, width)
+        if key not in self.__pens:
+            self.__pens[key] = QPen(QColor(*color), width)
+        return self.__pens[key]
+
+    def __label(self, text: str, color):
+        # text rendering is the expensive part, each label is rendered once and reused
+        key = (text, color)
+        pixmap = self.__labels.get(key)
+        if pixmap is not None:
+            self.__labels.move_to_end(key)
+            return pixmap
+        metrics = QFontMetrics(self.font)
+        pixmap = QPixmap(metrics.horizontalAdvance(text) + 6, metrics.height() + 4)
+        pixmap.fill(QColor(*color))
+        painter = QPainter(pixmap)
+        painter.setFont(self.font)
+        painter.setPen(QColor(0, 0, 0))
+        painter.drawText(3, 2 + metrics.ascent(), text)
+        painter.end()
+        self.__labels[key] = pixmap
+        if len(self.__labels) > self.label_cache_size:
+            self.__labels.popitem(last=False)
+        return pixmap
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+STAGES = ('read', 'convert', 'stats', 'mode', 'draw', 'emit', 'render')
+# bucket b counts durations in [2^(b-1), 2^b) ns, the last one is open ended (> 1 s)
+BUCKETS = 32
+
+
+class StageProfiler:
+    def __init__(self, stages=STAGES, trace_capacity=20000):
+        self.stages = tuple(stages)
+        self.enabled = True
+        self.__index = {name: i for i, name in enumerate(self.stages)}
+        # the capture thread records most stages, the GUI thread records render
+        self.__lock = threading.Lock()
+        self.__trace_capacity = trace_capacity
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            n = len(self.stages)
+            self.histograms = np.zeros((n, BUCKETS), np.int64)
+            self.counts = np.zeros(n, np.int64)
+            self.totals = np.zeros(n, np.int64)
+            self.maxima = np.zeros(n, np.int64)
+            self.last = np.zeros(n, np.int64)
+            # stage, thread id, start, duration; the oldest events are overwritten
+            self.__trace = np.zeros((self.__trace_capacity, 4), np.int64)
+            self.__trace_count = 0
+            self.__origin = time.perf_counter_ns()
+
+    @staticmethod
+    def now():
+        return time.perf_counter_ns()
+
+    def record(self, stage: str, start: int, end: int):
+        if not self.enabled:
+            return
+        i = self.__index[stage]
+        duration = end - start
+        with self.__lock:
+            self.histograms[i, min(duration.bit_length(), BUCKETS - 1)] += 1
+            self.counts[i] += 1
+            self.totals[i] += duration
+            self.last[i] = duration
+            if duration > self.maxima[i]:
+                self.maxima[i] = duration
+            self.__trace[self.__trace_count % self.__trace_capacity] = (
+                i, threading.get_ident() & 0x7fffffff, start - self.__origin, duration)
+            self.__trace_count += 1
+
+    def lap(self, stage: str, start: int):
+        # records stage as ending now and returns now as the start of the next one
+        end = time.perf_counter_ns()
+        self.record(stage, start, end)
+        return end
+
+    def percentile(self, stage: str, q: float):
+        # upper edge of the bucket holding the q-th percentile, in ns
+        histogram = self.histograms[self.__index[stage]]
+        total = histogram.sum()
+        if total == 0:
+            return 0
+        bucket = int(np.searchsorted(np.cumsum(histogram), q / 100 * total))
+        return 1 << bucket
+
+    def summary(self):
+        result = {}
+        for i, stage in enumerate(self.stages):
+            count = int(self.counts[i])
+            result[stage] = {
+                'count': count,
+                'mean_ms': round(self.totals[i] / max(count, 1) / 1e6, 3),
+                'last_ms': round(self.last[i] / 1e6, 3),
+                'p50_ms': round(self.percentile(stage, 50) / 1e6, 3),
+                'p99_ms': round(self.percentile(stage, 99) / 1e6, 3),
+                'max_ms': round(self.maxima[i] / 1e6, 3),
+                'histogram_ns_log2': self.histograms[i].tolist(),
+            }
+        return result
+
+    def overlay_text(self):
+        total = max(int(self.totals.sum()), 1)
+        lines = [f'{"stage":<8}{"last":>8}{"mean":>8}{"p99<":>8}{"share":>7}']
+        for i, stage in enumerate(self.stages):
+            if self.counts[i] == 0:
+                continue
+            mean = self.totals[i] / self.counts[i]
+            lines.append(f'{stage:<8}{self.last[i] / 1e6:>8.2f}{mean / 1e6:>8.2f}'
+                         f'{self.percentile(stage, 99) / 1e6:>8.2f}'
+                         f'{100 * self.totals[i] / total:>6.0f}%')
+        return '\n'.join(lines)
+
+    def dump_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'unit': 'ms', 'stages': self.summary()}, f, indent=2)
+
+    def dump_chrome_trace(self, path: str):
+        # loadable in chrome://tracing or ui.perfetto.dev
+        with self.__lock:
+            count = min(self.__trace_count, self.__trace_capacity)
+            start = self.__trace_count - count
+            order = (np.arange(start, start + count)) % self.__trace_capacity
+            trace = self.__trace[order]
+        pid = os.getpid()
+        events = [{'name': self.stages[stage], 'ph': 'X', 'pid': pid, 'tid': int(tid),
+                   'ts': begin / 1000, 'dur': duration / 1000}
+                  for stage, tid, begin, duration in trace.tolist()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# one row per object: kind, id, cls, conf, x, y, w, h
+KIND_DETECTION = 0
+KIND_TRACK = 1
+KIND_MOTION = 2
+KIND_BLOB = 3
+KIND_NAMES = ('det', 'track', 'motion', 'blob')
+OBJECT_COLUMNS = ('frame', 'kind', 'id', 'cls', 'conf', 'x', 'y', 'w', 'h')
+FRAME_COLUMNS = ('frame', 't', 'fps', 'mean_r', 'mean_g', 'mean_b',
+                 'std_r', 'std_g', 'std_b', 'min', 'max')
+FORMATS = ('jsonl', 'csv', 'columnar')
+FRAME_CSV = '%d,%.3f,%.1f,%.1f,%.1f,%.1f,%.1f,%.1f,%.1f,%d,%d'
+OBJECT_CSV = '%d,%d,%d,%d,%.3f,%d,%d,%d,%d'
+
+
+def objects_array(kind: int, boxes, ids=None, classes=None, confidences=None):
+    boxes = np.asarray(boxes, np.float32).reshape(-1, 4)
+    n = len(boxes)
+    rows = np.empty((n, 8), np.float32)
+    rows[:, 0] = kind
+    rows[:, 1] = -1 if ids is None else ids
+    rows[:, 2] = -1 if classes is None else classes
+    rows[:, 3] = 1 if confidences is None else confidences
+    rows[:, 4:] = boxes
+    return rows
+
+
+def object_rows(objects):
+    # [kind, id, cls, conf, x, y, w, h] with the kind spelled out, as stored in JSONL
+    return [[KIND_NAMES[int(o[0])], int(o[1]), int(o[2]), round(float(o[3]), 3),
+             *o[4:].astype(int).tolist()] for o in objects]
+
+
+class ResultSink:
+    def __init__(self, path: str, fmt='jsonl', flush_interval=1.0, max_pending=100000):
+        if fmt not in FORMATS:
+            raise ValueError(f'unknown result format {fmt}, expected one of {FORMATS}')
+        self.path = os.path.splitext(path)[0]
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        # set when a write fails, the sink stops writing and only counts drops
+        self.error = None
+
+        self.__pending = []
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__chunk = 0
+        self.__files = []
+        self.__parquet = {}
+        self.__open()
+        self.__thread = threading.Thread(target=self.__run, name='result-sink', daemon=True)
+        self.__thread.start()
+
+    def write_frame(self, frame_index: int, timestamp: float, fps: float,
+                    mean, std, min_max, objects=None):
+        # called from the capture loop, only appends to a list
+        record = (frame_index, timestamp, fps,
+                  np.asarray(mean, np.float32).reshape(-1), np.asarray(std, np.float32).reshape(-1),
+                  np.asarray(min_max, np.float32).reshape(-1),
+                  None if objects is None or len(objects) == 0 else objects)
+        with self.__lock:
+            if self.error is not None or len(self.__pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self.__pending.append(record)
+
+    def close(self):
+        self.__stop.set()
+        self.__thread.join()
+        for closable in [*self.__parquet.values(), *self.__files]:
+            try:
+                closable.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def __open(self):
+        if self.fmt == 'jsonl':
+            self.__jsonl = open(f'{self.path}.jsonl', 'a')
+            self.__files = [self.__jsonl]
+        elif self.fmt == 'csv':
+            self.__frames_csv = open(f'{self.path}.frames.csv', 'a')
+            self.__objects_csv = open(f'{self.path}.objects.csv', 'a')
+            self.__files = [self.__frames_csv, self.__objects_csv]
+            if self.__frames_csv.tell() == 0:
+                self.__frames_csv.write(','.join(FRAME_COLUMNS) + '\n')
+                self.__objects_csv.write(','.join(OBJECT_COLUMNS) + '\n')
+
+    def __run(self):
+        try:
+            while not self.__stop.wait(self.flush_interval):
+                self.__flush()
+            self.__flush()
+        except Exception as e:
+            # a full disk or a bad path; the window reports it and stops exporting
+            with self.__lock:
+                self.error = e
+                self.dropped += len(self.__pending)
+                self.__pending = []
+
+    def __flush(self):
+        with self.__lock:
+            records, self.__pending = self.__pending, []
+        if not records:
+            return
+        try:
+            self.__write(records)
+        except Exception:
+            with self.__lock:
+                self.dropped += len(records)
+            raise
+        for f in self.__files:
+            f.flush()
+        self.written += len(records)
+
+    def __write(self, records):
+        if self.fmt == 'jsonl':
+            self.__write_jsonl(records)
+        else:
+            frames, objects = self.__tables(records)
+            if self.fmt == 'csv':
+                np.savetxt(self.__frames_csv, frames, FRAME_CSV)
+                np.savetxt(self.__objects_csv, objects, OBJECT_CSV)
+            else:
+                self.__write_columnar(frames, objects)
+
+    def __tables(self, records):
+        frames = np.zeros((len(records), len(FRAME_COLUMNS)))
+        parts = []
+        for i, (frame_index, timestamp, fps, mean, std, min_max, objects) in enumerate(records):
+            frames[i, :3] = frame_index, timestamp, fps
+            frames[i, 3:3 + min(3, len(mean))] = mean[:3]
+            frames[i, 6:6 + min(3, len(std))] = std[:3]
+            frames[i, 9:11] = min_max[:2]
+            if objects is not None:
+                part = np.empty((len(objects), len(OBJECT_COLUMNS)), np.float32)
+                part[:, 0] = frame_index
+                part[:, 1:] = objects
+                parts.append(part)
+        objects = np.concatenate(parts) if parts else np.zeros((0, len(OBJECT_COLUMNS)), np.float32)
+        return frames, objects
+
+    def __write_jsonl(self, records):
+        lines = []
+        for frame_index, timestamp, fps, mean, std, min_max, objects in records:
+            record = {'f': int(frame_index), 't': round(timestamp, 3), 'fps': round(float(fps), 1),
+                      'mean': np.round(mean, 1).tolist(), 'std': np.round(std, 1).tolist(),
+                      'mm': min_max.astype(int).tolist()}
+            if objects is not None:
+                record['obj'] = object_rows(objects)
+            lines.append(json.dumps(record, separators=(',', ':')))
+        self.__jsonl.write('\n'.join(lines) + '\n')
+
+    def __write_columnar(self, frames, objects):
+        tables = {'frames': (FRAME_COLUMNS, frames), 'objects': (OBJECT_COLUMNS, objects)}
+        if pa is None:
+            # no pyarrow: one compressed npz per flush, read back with np.load and concatenated
+            for name, (columns, data) in tables.items():
+                np.savez_compressed(f'{self.path}.{name}.{self.__chunk:05d}.npz',
+                                    **{c: data[:, i] for i, c in enumerate(columns)})
+            self.__chunk += 1
+            return
+        for name, (columns, data) in tables.items():
+            table = pa.table({c: data[:, i] for i, c in enumerate(columns)})
+            if name not in self.__parquet:
+                self.__parquet[name] = pq.ParquetWriter(f'{self.path}.{name}.parquet', table.schema)
+            self.__parquet[name].write_table(table)
@@ -0,0 +1,79 @@
+import cv2 as cv
+import numpy as np
+
+
+def largest_contour(contours):
+    if len(contours) == 0:
+        return None
+    return max(contours, key=cv.contourArea)
+
+
+class HSVSegmenter:
+    def __init__(self, analysis_scale=0.5, blur_ksize=7):
+        self.analysis_scale = analysis_scale
+        self.blur_ksize = blur_ksize
+        self.__shape = None
+
+    def __buffers(self, frame: np.ndarray):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.analysis_scale)
+        shape = (max(1, int(height * scale)), max(1, int(width * scale)))
+        if shape != self.__shape:
+            # reallocated only when the frame size or the scale changes
+            self.__shape = shape
+            self.__small = np.empty((*shape, 3), np.uint8)
+            self.__hsv = np.empty((*shape, 3), np.uint8)
+            self.__blurred = np.empty((*shape, 3), np.uint8)
+            self.__mask = np.empty(shape, np.uint8)
+        return shape
+
+    def segment(self, frame: np.ndarray, lower, upper):
+        height, width = self.__buffers(frame)
+        if (height, width) == frame.shape[:2]:
+            small = frame
+        else:
+            small = cv.resize(frame, (width, height), dst=self.__small,
+                              interpolation=cv.INTER_AREA)
+        cv.cvtColor(small, cv.COLOR_RGB2HSV, dst=self.__hsv)
+        cv.medianBlur(self.__hsv, self.blur_ksize, dst=self.__blurred)
+        cv.inRange(self.__blurred, lower, upper, dst=self.__mask)
+        return self.__mask
+
+    def to_frame(self, frame: np.ndarray, rect):
+        # maps a rect found on the analysis mask back to frame coordinates
+        sy = frame.shape[0] / self.__shape[0]
+        sx = frame.shape[1] / self.__shape[1]
+        x, y, w, h = rect
+        return (int(x * sx), int(y * sy), int(w * sx), int(h * sy))
+
+
+def extract_blobs(mask: np.ndarray, min_area=0):
+    # one row per blob: x, y, w, h, area, cx, cy
+    count, _, stats, centroids = cv.connectedComponentsWithStats(mask, connectivity=8)
+    blobs = np.hstack([stats[1:count], centroids[1:count]])
+    return blobs[blobs[:, cv.CC_STAT_AREA] >= min_area]
+
+
+def find_motion_rect(segmenter: HSVSegmenter, background, frame: np.ndarray, lower, upper):
+    # MOTION mode: color mask, background model, box of the largest moving region
+    mask = segmenter.segment(frame, lower, upper)
+    mask = background.apply(mask)
+    contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    contour = largest_contour(contours)
+    rect = None if contour is None else segmenter.to_frame(frame, cv.boundingRect(contour))
+    return rect, mask
+
+
+def find_bright_blobs(frame: np.ndarray, brightness_min, brightness_max, min_area=0, scale=1.0):
+    # CONTRAST mode: blobs in the brightness range, in frame coordinates
+    gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY)
+    if scale < 1:
+        gray = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    thresh = cv.inRange(gray, brightness_min, brightness_max)
+    blobs = extract_blobs(thresh, min_area * scale * scale)
+    if scale < 1:
+        # back to frame coordinates, areas by the square of the scale
+        blobs = blobs.astype(np.float64)
+        blobs[:, [0, 1, 2, 3, 5, 6]] /= scale
+        blobs[:, 4] /= scale * scale
+    return blobs
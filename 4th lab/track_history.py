@@ -0,0 +1,50 @@
+import numpy as np
+
+
+class TrackHistory:
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        # every sample is written twice, so the last `capacity` samples are
+        # always one contiguous slice and no reordering copy is needed
+        self.__points = np.zeros((2 * capacity, 2), np.int32)
+        self.__times = np.zeros(2 * capacity, np.float64)
+        self.__head = 0
+        self.__size = 0
+
+    def __len__(self):
+        return self.__size
+
+    def clear(self):
+        self.__head = 0
+        self.__size = 0
+
+    def append(self, x: int, y: int, timestamp: float):
+        i = self.__head
+        self.__points[i] = self.__points[i + self.capacity] = (x, y)
+        self.__times[i] = self.__times[i + self.capacity] = timestamp
+        self.__head = (i + 1) % self.capacity
+        self.__size = min(self.__size + 1, self.capacity)
+
+    def points(self):
+        start = self.__head + self.capacity - self.__size
+        return self.__points[start:start + self.__size]
+
+    def times(self):
+        start = self.__head + self.capacity - self.__size
+        return self.__times[start:start + self.__size]
+
+    def velocity(self, window=10):
+        # least-squares slope over the last samples, in pixels per second
+        n = min(window, self.__size)
+        if n < 2:
+            return np.zeros(2)
+        t = self.times()[-n:]
+        p = self.points()[-n:].astype(np.float64)
+        t = t - t.mean()
+        denom = np.dot(t, t)
+        if denom == 0:
+            return np.zeros(2)
+        return t @ (p - p.mean(axis=0)) / denom
+
+    def speed(self, window=10):
+        return float(np.hypot(*self.velocity(window)))
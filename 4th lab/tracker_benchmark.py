@@ -0,0 +1,109 @@
+import argparse
+import json
+import time
+
+import cv2 as cv
+import numpy as np
+
+from trackers import available_trackers, create_tracker
+from mot import iou_matrix
+
+
+def read_clip(path: str):
+    cap = cv.VideoCapture(path)
+    frames = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(cv.cvtColor(frame, cv.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
+def read_ground_truth(path: str):
+    # one "x,y,w,h" line per frame, as written by most tracking datasets
+    return np.loadtxt(path, delimiter=',', ndmin=2)[:, :4]
+
+
+def run_tracker(frames, bbox, name, scale):
+    tracker = create_tracker(name, scale)
+    tracker.init(frames[0], bbox)
+    boxes = np.zeros((len(frames), 4))
+    boxes[0] = bbox
+    lost = 0
+    start = time.perf_counter()
+    for i, frame in enumerate(frames[1:], 1):
+        ok, box = tracker.update(frame)
+        if ok:
+            boxes[i] = box
+        else:
+            boxes[i] = boxes[i - 1]
+            lost += 1
+    elapsed = time.perf_counter() - start
+    return boxes, (len(frames) - 1) / max(elapsed, 1e-9), lost
+
+
+def benchmark(clip, bbox, trackers, scales, ground_truth=None):
+    frames = read_clip(clip)
+    if len(frames) < 2:
+        raise ValueError(f'{clip} has less than two frames')
+
+    reference = ground_truth
+    if reference is None:
+        # without annotations, drift is measured against the most accurate tracker at full size
+        ref_name = 'CSRT' if 'CSRT' in available_trackers() else trackers[0]
+        reference, _, _ = run_tracker(frames, bbox, ref_name, 1.0)
+
+    results = []
+    for name in trackers:
+        for scale in scales:
+            boxes, fps, lost = run_tracker(frames, bbox, name, scale)
+            n = min(len(boxes), len(reference))
+            # one box per frame on both sides, only the matching frames are compared
+            iou = np.diag(iou_matrix(boxes[:n], reference[:n]))
+            results.append({
+                'clip': clip,
+                'tracker': name,
+                'scale': scale,
+                'fps': round(fps, 1),
+                'mean_iou': round(float(iou.mean()), 3),
+                'final_iou': round(float(iou[-1]), 3),
+                'lost_frames': lost,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare MANUAL mode trackers on recorded clips')
+    parser.add_argument('clips', nargs='+')
+    parser.add_argument('--bbox', required=True,
+                        help='initial box on the first frame: x,y,w,h')
+    parser.add_argument('--ground-truth', nargs='*', default=None,
+                        help='per-frame x,y,w,h files, one per clip')
+    parser.add_argument('--trackers', nargs='*', default=available_trackers())
+    parser.add_argument('--scales', nargs='*', type=float, default=[1.0, 0.5])
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    bbox = tuple(int(v) for v in args.bbox.split(','))
+    results = []
+    for i, clip in enumerate(args.clips):
+        ground_truth = None
+        if args.ground_truth:
+            ground_truth = read_ground_truth(args.ground_truth[i])
+        results += benchmark(clip, bbox, args.trackers, args.scales, ground_truth)
+
+    print(f'{"tracker":<10}{"scale":>6}{"fps":>9}{"mean IoU":>10}{"final IoU":>11}{"lost":>6}  clip')
+    for r in results:
+        print(f'{r["tracker"]:<10}{r["scale"]:>6}{r["fps"]:>9}{r["mean_iou"]:>10}'
+              f'{r["final_iou"]:>11}{r["lost_frames"]:>6}  {r["clip"]}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import cv2 as cv
+
+
+def _factory(*names):
+    # contrib and legacy builds expose the same trackers under different modules
+    for name in names:
+        module = cv
+        for part in name.split('.')[:-1]:
+            module = getattr(module, part, None)
+        factory = getattr(module, name.split('.')[-1], None) if module is not None else None
+        if factory is not None:
+            return factory
+    return None
+
+
+class TemplateTracker:
+    def __init__(self, search_factor=2.0, min_score=0.5):
+        self.search_factor = search_factor
+        self.min_score = min_score
+        self.template = None
+        self.bbox = None
+
+    def init(self, frame, bbox):
+        x, y, w, h = [int(v) for v in bbox]
+        gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY)
+        self.template = gray[y:y + h, x:x + w].copy()
+        self.bbox = (x, y, w, h)
+
+    def update(self, frame):
+        x, y, w, h = self.bbox
+        gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY)
+        pad_x = int(w * (self.search_factor - 1) / 2)
+        pad_y = int(h * (self.search_factor - 1) / 2)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1 = min(gray.shape[1], x + w + pad_x)
+        y1 = min(gray.shape[0], y + h + pad_y)
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < h or window.shape[1] < w:
+            return False, self.bbox
+
+        scores = cv.matchTemplate(window, self.template, cv.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv.minMaxLoc(scores)
+        if score < self.min_score:
+            return False, self.bbox
+        self.bbox = (x0 + loc[0], y0 + loc[1], w, h)
+        return True, self.bbox
+
+
+TRACKER_FACTORIES = {
+    'MIL': _factory('TrackerMIL_create', 'legacy.TrackerMIL_create'),
+    'KCF': _factory('TrackerKCF_create', 'legacy.TrackerKCF_create'),
+    'CSRT': _factory('TrackerCSRT_create', 'legacy.TrackerCSRT_create'),
+    'MOSSE': _factory('legacy.TrackerMOSSE_create', 'TrackerMOSSE_create'),
+    'TEMPLATE': TemplateTracker,
+}
+
+
+def available_trackers():
+    return [name for name, factory in TRACKER_FACTORIES.items() if factory is not None]
+
+
+class ScaledTracker:
+    def __init__(self, tracker, scale=1.0):
+        self.tracker = tracker
+        self.scale = scale
+
+    def __resize(self, frame):
+        if self.scale == 1.0:
+            return frame
+        return cv.resize(frame, None, fx=self.scale, fy=self.scale,
+                         interpolation=cv.INTER_AREA)
+
+    def init(self, frame, bbox):
+        x, y, w, h = bbox
+        # a box dragged right-to-left arrives with a negative size
+        x, w = (x + w, -w) if w < 0 else (x, w)
+        y, h = (y + h, -h) if h < 0 else (y, h)
+        # only the size needs at least one pixel, an edge at 0 has to stay at 0
+        scaled = (int(round(x * self.scale)), int(round(y * self.scale)),
+                  max(1, int(round(w * self.scale))), max(1, int(round(h * self.scale))))
+        self.tracker.init(self.__resize(frame), scaled)
+
+    def update(self, frame):
+        ok, bbox = self.tracker.update(self.__resize(frame))
+        return ok, tuple(v / self.scale for v in bbox)
+
+
+def create_tracker(name='MIL', scale=1.0):
+    factory = TRACKER_FACTORIES.get(name)
+    if factory is None:
+        factory = TRACKER_FACTORIES['TEMPLATE']
+    return ScaledTracker(factory(), scale)
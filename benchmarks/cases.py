@@ -0,0 +1,127 @@
+import os
+import sys
+from functools import partial
+
+import cv2 as cv
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, '1st-2nd labs'))
+sys.path.insert(0, os.path.join(ROOT, '4th lab'))
+
+import filters
+from nn_utils import format_yolov5, wrap_detection, INPUT_SIZES
+from segmentation import HSVSegmenter, find_motion_rect, find_bright_blobs
+from motion_gate import MotionGate
+
+RESOLUTIONS = {
+    'qvga': (320, 240),
+    'vga': (640, 480),
+    'hd': (1280, 720),
+    'fhd': (1920, 1080),
+}
+MEDIAN_MAX_PIXELS = 640 * 480
+# real camera frames are not redistributable with the repo, drop them in here locally
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def synthetic_image(width: int, height: int, seed=0):
+    # gradient, noise and a few filled shapes, so thresholds and contours find something
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), np.uint8)
+    image[..., 0] = (x + y) / 2
+    image[..., 1] = x[::-1]
+    image[..., 2] = y
+    image = cv.add(image, rng.integers(0, 40, image.shape, np.uint8))
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(height // 40 + 1, height // 8 + 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv.circle(image, center, radius, color, -1)
+    return image
+
+
+def load_images(resolutions, fixtures=()):
+    images = {name: synthetic_image(*RESOLUTIONS[name]) for name in resolutions}
+    paths = list(fixtures)
+    if os.path.isdir(FIXTURES_DIR):
+        paths += sorted(os.path.join(FIXTURES_DIR, f) for f in os.listdir(FIXTURES_DIR))
+    for path in paths:
+        image = cv.imread(path, cv.IMREAD_COLOR)
+        if image is not None:
+            images[os.path.splitext(os.path.basename(path))[0]] = image
+    return images
+
+
+def yolo_output(size: int, seed=0):
+    # what a YOLOv5 export returns for one image: 3 anchors on strides 8, 16 and 32
+    rows = 3 * sum((size // stride) ** 2 for stride in (8, 16, 32))
+    rng = np.random.default_rng(seed)
+    output = rng.random((rows, 85), np.float32)
+    output[:, :2] *= size
+    output[:, 2:4] = output[:, 2:4] * size / 4 + 4
+    # a realistic few percent of rows pass the objectness threshold
+    output[:, 4] = np.where(rng.random(rows) < 0.02, 0.9, 0.1)
+    return output
+
+
+def frame_stats(frame):
+    mean, std = cv.meanStdDev(frame)
+    return mean, std, np.array([np.min(frame), np.max(frame)])
+
+
+def cases(images):
+    # (group, name, image name, function of no arguments)
+    result = []
+    for image_name, image in images.items():
+        for name, operation in filters.OPERATIONS.items():
+            result.append(('filters', name, image_name, lambda op=operation, im=image: op(im)))
+        # the hand-written median takes seconds on large frames
+        if image.shape[0] * image.shape[1] <= MEDIAN_MAX_PIXELS:
+            result.append(('filters', 'median', image_name, lambda im=image: filters.median(im)))
+        result.append(('nn_utils', 'format_yolov5', image_name,
+                       lambda im=image: format_yolov5(im)))
+        padded = format_yolov5(image)
+        result.append(('nn_utils', 'blob_640', image_name,
+                       lambda im=padded: cv.dnn.blobFromImage(
+                           im, 1 / 255.0, (640, 640), swapRB=True, crop=False)))
+        result.append(('stats', 'frame_stats', image_name, lambda im=image: frame_stats(im)))
+        # the same per-frame steps the CONTRAST and MOTION modes of cap.py run
+        result.append(('pipelines', 'contrast', image_name,
+                       lambda im=image: find_bright_blobs(im, 100, 255, 20)))
+        result.append(('pipelines', 'contrast_half', image_name,
+                       lambda im=image: find_bright_blobs(im, 100, 255, 20, 0.5)))
+        result.append(('pipelines', 'hsv_segment', image_name,
+                       lambda im=image, s=HSVSegmenter(): s.segment(
+                           im, (0, 0, 0), (255, 255, 200))))
+        # background models keep state, every case gets its own
+        moving = moving_frames(image)
+        result.append(('pipelines', 'motion', image_name, cycle(
+            partial(find_motion_rect, HSVSegmenter(),
+                    cv.createBackgroundSubtractorMOG2(200, 16, True)),
+            moving, (0, 0, 0), (255, 255, 200))))
+        result.append(('pipelines', 'motion_gate', image_name,
+                       cycle(MotionGate().regions, moving)))
+
+    for size in INPUT_SIZES:
+        output = yolo_output(size)
+        input_img = np.zeros((size, size, 3), np.uint8)
+        result.append(('nn_utils', 'wrap_detection', str(size),
+                       lambda im=input_img, out=output, s=size: wrap_detection(im, out, s)))
+    return result
+
+
+def moving_frames(image, count=8, step=8):
+    # a static frame would be learned away by the background models
+    return [np.ascontiguousarray(np.roll(image, i * step, axis=1)) for i in range(count)]
+
+
+def cycle(run, frames, *args):
+    state = {'index': 0}
+
+    def call():
+        state['index'] = (state['index'] + 1) % len(frames)
+        return run(frames[state['index']], *args)
+    return call
@@ -0,0 +1,201 @@
+import argparse
+import gc
+import hashlib
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+
+from cases import RESOLUTIONS, load_images, cases
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def fingerprint():
+    # timings are only comparable between runs with the same fingerprint
+    info = {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv.__version__,
+        'opencv_threads': cv.getNumThreads(),
+        'opencv_optimized': cv.useOptimized(),
+    }
+    if hasattr(cv, 'getCPUFeaturesLine'):
+        info['cpu_features'] = cv.getCPUFeaturesLine()
+    digest = hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()[:12]
+    # containers and CI runners get a new hostname every run, so it is not hashed
+    info['host'] = platform.node()
+    return digest, info
+
+
+def measure(func, min_samples=10, max_samples=100, budget=1.0):
+    # the first calls pay for allocations and lazy OpenCV initialisation
+    func()
+    func()
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        began = time.perf_counter()
+        while len(samples) < max_samples and \
+                (len(samples) < min_samples or time.perf_counter() - began < budget):
+            start = time.perf_counter_ns()
+            func()
+            samples.append((time.perf_counter_ns() - start) / 1e6)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return samples
+
+
+def summarize(samples):
+    samples = np.asarray(samples)
+    return {
+        'n': len(samples),
+        'median_ms': round(float(np.median(samples)), 4),
+        'mean_ms': round(float(samples.mean()), 4),
+        'stdev_ms': round(float(samples.std(ddof=1)) if len(samples) > 1 else 0.0, 4),
+        'min_ms': round(float(samples.min()), 4),
+        'p90_ms': round(float(np.percentile(samples, 90)), 4),
+    }
+
+
+def mann_whitney(a, b):
+    # two-sided p-value of the Mann-Whitney U test, normal approximation with tie
+    # correction; timings are skewed and have outliers, so no t-test
+    a = np.asarray(a, np.float64)
+    b = np.asarray(b, np.float64)
+    n1, n2 = len(a), len(b)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    values = np.concatenate([a, b])
+    n = n1 + n2
+    ranks = np.empty(n)
+    ranks[np.argsort(values, kind='mergesort')] = np.arange(1, n + 1)
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    # tied values share the mean of their ranks
+    ranks = (np.bincount(inverse, weights=ranks) / counts)[inverse]
+    u1 = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    ties = (counts ** 3 - counts).sum() / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties))
+    if sigma == 0:
+        return 1.0
+    z = (u1 - n1 * n2 / 2) / sigma
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def compare(results, baseline, alpha=0.01, threshold=0.10):
+    # a change counts only when it is both significant and larger than threshold
+    verdicts = {}
+    for key, result in results.items():
+        old = baseline['results'].get(key)
+        if old is None:
+            verdicts[key] = ('new', None, None)
+            continue
+        ratio = result['median_ms'] / max(old['median_ms'], 1e-9)
+        p = mann_whitney(result['samples'], old['samples'])
+        if p < alpha and ratio > 1 + threshold:
+            verdict = 'SLOWER'
+        elif p < alpha and ratio < 1 / (1 + threshold):
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        verdicts[key] = (verdict, ratio, p)
+    return verdicts
+
+
+def run(resolutions, fixtures=(), pattern=None, min_samples=10, max_samples=100, budget=1.0):
+    results = {}
+    images = load_images(resolutions, fixtures)
+    if len(images) == len(resolutions):
+        print('no fixture images found, timing synthetic frames only')
+    for group, name, image_name, func in cases(images):
+        key = f'{group}/{name}@{image_name}'
+        if pattern and pattern not in key:
+            continue
+        samples = measure(func, min_samples, max_samples, budget)
+        results[key] = {'group': group, 'name': name, 'image': image_name,
+                        **summarize(samples), 'samples': [round(s, 4) for s in samples]}
+        print(f'{key:<40} {results[key]["median_ms"]:>10.3f} ms  (n={len(samples)})',
+              flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the filters, detector pre/post-processing, detection pipelines '
+                    'and frame statistics, and compare with the baseline of this machine')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='only run cases whose group/name@image contains this')
+    parser.add_argument('--resolutions', nargs='+', default=['qvga', 'vga', 'hd'],
+                        choices=sorted(RESOLUTIONS))
+    parser.add_argument('--images', nargs='*', default=[],
+                        help='fixture images to run on too, next to any in benchmarks/fixtures '
+                             '(none are committed, without them only synthetic frames are timed)')
+    parser.add_argument('--min-samples', type=int, default=10)
+    parser.add_argument('--max-samples', type=int, default=100)
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='seconds per case once min-samples are taken')
+    parser.add_argument('--baseline', default=None,
+                        help='baseline JSON to compare with (default: baselines/<fingerprint>.json)')
+    parser.add_argument('--save', action='store_true',
+                        help='store this run as the baseline compared with next time')
+    parser.add_argument('--out', default=None, help='also write this run to a JSON file')
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help='significance level of the Mann-Whitney U test')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='smallest relative change of the median that is reported')
+    args = parser.parse_args()
+
+    fingerprint_id, machine = fingerprint()
+    print(f'machine {fingerprint_id}: {machine["processor"] or machine["machine"]}, '
+          f'{machine["cpu_count"]} cpus, OpenCV {machine["opencv"]}, numpy {machine["numpy"]}')
+    results = run(args.resolutions, args.images, args.pattern,
+                  args.min_samples, args.max_samples, args.budget)
+    report = {'fingerprint_id': fingerprint_id, 'fingerprint': machine,
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+
+    baseline_path = args.baseline or os.path.join(BASELINES_DIR, f'{fingerprint_id}.json')
+    slower = 0
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['fingerprint_id'] != fingerprint_id:
+            changed = sorted(k for k in machine
+                             if k != 'host' and baseline['fingerprint'].get(k) != machine[k])
+            print(f'warning: baseline is from another machine or setup ({", ".join(changed)})')
+        print(f'\ncompared with {baseline_path} ({baseline["created"]})')
+        for key, (verdict, ratio, p) in compare(
+                results, baseline, args.alpha, args.threshold).items():
+            if verdict == 'new':
+                print(f'{key:<40} {"new":>8}')
+                continue
+            print(f'{key:<40} {verdict:>8} {ratio:>7.2f}x  p={p:.4f}')
+            slower += verdict == 'SLOWER'
+    else:
+        print(f'\nno baseline at {baseline_path}, run with --save to create one')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f)
+        print(f'baseline saved to {baseline_path}')
+    if slower:
+        print(f'{slower} significant slowdowns')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()